@@ -0,0 +1,324 @@
+"""
+Per-model admission queue for Ollama generations
+
+Ollama runs a bounded number of generations per model at a time and queues
+the rest internally in arrival order, so a short lights command could wait
+behind a long chat completion. The controller below admits at most
+`concurrency` generations per model and holds the others in a bounded queue
+ordered by priority class, then arrival. A full queue is answered with 429
+and a Retry-After estimate instead of piling up more requests.
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+from residency import model_key
+from resilience import DeadlineExceeded, UpstreamUnavailable, remaining
+
+INTERACTIVE = 'interactive'
+CHAT = 'chat'
+BATCH = 'batch'
+PRIORITIES = (INTERACTIVE, CHAT, BATCH)
+
+
+class QueueFull(UpstreamUnavailable):
+    """The model's admission queue is full"""
+
+    status_code = 429
+
+
+class Slot:
+    """An admitted generation; release it once the upstream call is done"""
+
+    def __init__(self, controller, model, admitted_at):
+        self._controller = controller
+        self._model = model
+        self._admitted_at = admitted_at
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        if self._controller is not None:
+            self._controller._release(self._model, time.monotonic() - self._admitted_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AdmittedResponse:
+    """
+    Streamed requests.Response that holds its admission slot
+
+    The slot is released when the lines have been read to the end or the
+    response is closed, whichever comes first.
+    """
+
+    def __init__(self, response, slot):
+        self._response = response
+        self._slot = slot
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def iter_lines(self, *args, **kwargs):
+        try:
+            yield from self._response.iter_lines(*args, **kwargs)
+        finally:
+            self.close()
+
+    def close(self):
+        try:
+            self._response.close()
+        finally:
+            self._slot.release()
+
+
+class _LoopEvent:
+    """Event a queued asyncio request waits on, set from any thread"""
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def set(self):
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # The loop has been closed, nobody is waiting any more
+            pass
+
+    async def wait(self, timeout=None):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class _ModelQueue:
+    def __init__(self):
+        self.in_flight = 0
+        self.waiting = []
+        self.admitted = 0
+        self.rejected = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.service_seconds = None
+
+
+class AdmissionController:
+    """
+    Bounded priority queue per model in front of the Ollama generations
+    """
+
+    def __init__(self, name, concurrency=1, max_queue=16, enabled=True):
+        """
+        Args:
+            name: Upstream name used in errors
+            concurrency: Generations admitted at once per model, should
+                match Ollama's OLLAMA_NUM_PARALLEL
+            max_queue: Requests that may wait per model; when the queue is
+                full a request of a higher class displaces the newest request
+                of the lowest class waiting, otherwise it is refused
+            enabled: False admits every call at once
+        """
+        self.name = name
+        self.concurrency = max(concurrency, 1)
+        self.max_queue = max_queue
+        self.enabled = enabled
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    def _retry_after(self, queue):
+        # Time for everything ahead to drain, from the average generation time
+        service = queue.service_seconds if queue.service_seconds is not None else 1.0
+        ahead = queue.in_flight + len(queue.waiting)
+        return max(service * ahead / self.concurrency, 1.0)
+
+    def _queue_full(self, model, queue):
+        queue.rejected += 1
+        return QueueFull(
+            f"Too many requests queued for model {model}",
+            upstream=self.name,
+            retry_after=self._retry_after(queue)
+        )
+
+    def acquire(self, model, priority=CHAT):
+        """
+        Wait for a generation slot for a model
+
+        Waits at most until the current deadline budget runs out.
+
+        Args:
+            model: Model name
+            priority: INTERACTIVE, CHAT or BATCH
+
+        Returns:
+            Slot to release when the upstream call is done, also usable in
+            a with statement
+
+        Raises:
+            QueueFull: When the model's queue is full, or the request was
+                displaced by a higher priority one while waiting
+            DeadlineExceeded: When the budget ran out while waiting
+        """
+        if not self.enabled:
+            return Slot(None, model, time.monotonic())
+
+        model = model_key(model)
+        start = time.monotonic()
+        slot, waiter = self._enter(model, priority, threading.Event())
+        if slot is not None:
+            return slot
+
+        timeout = remaining()
+        waiter["event"].wait(timeout if timeout is None else max(timeout, 0))
+        return self._admitted(model, waiter, start)
+
+    async def acquire_async(self, model, priority=CHAT):
+        """
+        acquire() for the event loop
+
+        A queued request waits on an asyncio event instead of a thread, so
+        requests piling up in the queue hold no executor threads. A request
+        cancelled while queued (the client went away) leaves the queue, or
+        hands its slot on when it had just been admitted.
+        """
+        if not self.enabled:
+            return Slot(None, model, time.monotonic())
+
+        model = model_key(model)
+        start = time.monotonic()
+        slot, waiter = self._enter(model, priority, _LoopEvent(asyncio.get_running_loop()))
+        if slot is not None:
+            return slot
+
+        timeout = remaining()
+        try:
+            await waiter["event"].wait(timeout if timeout is None else max(timeout, 0))
+        except asyncio.CancelledError:
+            self._abandon(model, waiter)
+            raise
+        return self._admitted(model, waiter, start)
+
+    def _enter(self, model, priority, event):
+        """
+        Admit a request at once or queue it
+
+        Returns:
+            Tuple of (Slot, None) when admitted, (None, waiter) when queued
+
+        Raises:
+            QueueFull: When the queue is full of requests of the same or a
+                higher class
+        """
+        rank = PRIORITIES.index(priority)
+        with self._lock:
+            queue = self._queues.setdefault(model, _ModelQueue())
+            if queue.in_flight < self.concurrency and not queue.waiting:
+                queue.in_flight += 1
+                queue.admitted += 1
+                return Slot(self, model, time.monotonic()), None
+
+            if len(queue.waiting) >= self.max_queue:
+                lowest = max(queue.waiting) if queue.waiting else None
+                if lowest is None or lowest[0] <= rank:
+                    raise self._queue_full(model, queue)
+                queue.waiting.remove(lowest)
+                heapq.heapify(queue.waiting)
+                lowest[2]["displaced"] = True
+                lowest[2]["event"].set()
+
+            waiter = {"event": event, "admitted": False, "displaced": False, "priority": priority}
+            heapq.heappush(queue.waiting, (rank, next(self._sequence), waiter))
+        return None, waiter
+
+    def _admitted(self, model, waiter, start):
+        """Slot of a waiter whose wait ended, or the reason it was not admitted"""
+        waited = time.monotonic() - start
+        with self._lock:
+            queue = self._queues[model]
+            if waiter["displaced"]:
+                raise self._queue_full(model, queue)
+            if not waiter["admitted"]:
+                self._remove_waiter(queue, waiter)
+                raise DeadlineExceeded(
+                    f"Request deadline exceeded while queued for model {model}",
+                    upstream=self.name
+                )
+            queue.waited += 1
+            queue.wait_seconds += waited
+            queue.max_wait_seconds = max(queue.max_wait_seconds, waited)
+        return Slot(self, model, time.monotonic())
+
+    def _abandon(self, model, waiter):
+        """Take a cancelled waiter out of the queue, passing on a slot it was already given"""
+        with self._lock:
+            admitted = waiter["admitted"]
+            if not admitted:
+                self._remove_waiter(self._queues[model], waiter)
+        if admitted:
+            self._release(model, None)
+
+    @staticmethod
+    def _remove_waiter(queue, waiter):
+        queue.waiting = [entry for entry in queue.waiting if entry[2] is not waiter]
+        heapq.heapify(queue.waiting)
+
+    def _release(self, model, service_seconds):
+        """Hand a slot to the next waiter; service_seconds is None for a slot that was never used"""
+        with self._lock:
+            queue = self._queues[model]
+            if service_seconds is not None:
+                if queue.service_seconds is None:
+                    queue.service_seconds = service_seconds
+                else:
+                    queue.service_seconds = 0.8 * queue.service_seconds + 0.2 * service_seconds
+            if queue.waiting:
+                # Hand the slot straight to the next waiter
+                _, _, waiter = heapq.heappop(queue.waiting)
+                waiter["admitted"] = True
+                queue.admitted += 1
+                waiter["event"].set()
+            else:
+                queue.in_flight -= 1
+
+    def stats(self):
+        """
+        Returns:
+            Dictionary with enabled, concurrency, max_queue and per model
+            in_flight, queued (per priority class), admitted, rejected and
+            wait times of the requests that had to queue
+        """
+        with self._lock:
+            models = {}
+            for model, queue in self._queues.items():
+                queued = {priority: 0 for priority in PRIORITIES}
+                for _, _, waiter in queue.waiting:
+                    queued[waiter["priority"]] += 1
+                models[model] = {
+                    "in_flight": queue.in_flight,
+                    "queued": queued,
+                    "depth": len(queue.waiting),
+                    "admitted": queue.admitted,
+                    "rejected": queue.rejected,
+                    "waited": queue.waited,
+                    "avg_wait_ms": round(queue.wait_seconds / queue.waited * 1000, 3) if queue.waited else 0.0,
+                    "max_wait_ms": round(queue.max_wait_seconds * 1000, 3),
+                    "avg_generation_ms": round(queue.service_seconds * 1000, 3) if queue.service_seconds is not None else None
+                }
+        return {
+            "enabled": self.enabled,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "models": models
+        }
@@ -0,0 +1,434 @@
+"""
+Optional asyncio serving mode for the token streaming routes
+
+The Flask routes in service.py hold one worker thread for the whole life of an
+Ollama token stream. This module exposes an ASGI application that serves
+/api/chat/stream and /api/generate/stream (and their shortcut paths) on the
+event loop with an async HTTP client, so one process can keep thousands of SSE
+streams open. Every other request, including lights commands sent through the
+chat stream, is handed to the regular Flask app unchanged.
+
+Run with:
+    uvicorn async_service:app --host 0.0.0.0 --port 5000
+
+Requires the packages in requirements-async.txt.
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+
+from config import (
+    OLLAMA_API_HOST, DEFAULT_MODEL, CORS_ORIGINS,
+    ASYNC_STREAM_MAX_CONNECTIONS, ASYNC_STREAM_MAX_KEEPALIVE, ASYNC_STREAM_TIMEOUT
+)
+import intent_router
+from intent_router import classify_messages
+import metrics
+from admission import BATCH, CHAT, QueueFull
+from resilience import CircuitOpenError
+from upstream import ollama_http, ollama_admission
+from client import model_residency
+from jsonlog import get_logger
+from service import (
+    app as flask_app, response_cache, lookup_cached_response, request_coalesce_key, async_stream_coalescer,
+    fit_context, chat_sessions, session_messages
+)
+from sessions import SessionError
+
+flask_asgi = WsgiToAsgi(flask_app)
+
+log = get_logger("async_service")
+
+_client = None
+
+
+def _get_client():
+    """Return the shared async Ollama client, creating it on first use"""
+    global _client
+    if _client is None:
+        connect_timeout, read_timeout = ASYNC_STREAM_TIMEOUT
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=ASYNC_STREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_STREAM_MAX_KEEPALIVE
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+        )
+    return _client
+
+
+def _cors_headers(scope):
+    """Mirror the Access-Control-Allow-Origin header flask_cors would add"""
+    if CORS_ORIGINS == '*':
+        return [(b"access-control-allow-origin", b"*")]
+    origin = dict(scope.get("headers", [])).get(b"origin")
+    allowed = [CORS_ORIGINS] if isinstance(CORS_ORIGINS, str) else list(CORS_ORIGINS)
+    if origin and origin.decode("latin-1") in allowed:
+        return [(b"access-control-allow-origin", origin), (b"vary", b"Origin")]
+    return []
+
+
+async def _read_body(receive):
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+def _replay_receive(body, receive):
+    """Build a receive callable that hands an already read body to another app"""
+    sent = False
+
+    async def replay():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return replay
+
+
+async def _send_json(send, scope, status, payload, headers=()):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("ascii"))
+        ] + list(headers) + _cors_headers(scope)
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def _start_sse(scope, send, cache_status=None, shared=False):
+    headers = [(b"content-type", b"text/event-stream")] + _cors_headers(scope)
+    if cache_status:
+        headers.append((b"x-cache", cache_status.encode("ascii")))
+    if shared:
+        headers.append((b"x-coalesced", b"true"))
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+
+
+async def _replay_stream(scope, send, lines, on_complete=None):
+    """Send cached NDJSON lines in the same SSE framing as a live stream"""
+    await _start_sse(scope, send, "HIT")
+    body = "".join(f"data: {line}\n\n" for line in lines).encode("utf-8")
+    await send({"type": "http.response.body", "body": body, "more_body": False})
+    if on_complete is not None:
+        on_complete(lines)
+
+
+def _session_recorder(session_id):
+    """on_complete callback storing a completed stream's reply in the session, None without one"""
+    if not session_id:
+        return None
+    return lambda lines: chat_sessions.record_reply(session_id, lines)
+
+
+async def _admit(model, priority):
+    """
+    Pass the Ollama circuit breaker and take an admission slot, waiting on the event loop
+
+    The half-open trial is only claimed once the slot is granted: a request
+    refused or cancelled while queued would never report the trial's outcome.
+    """
+    breaker = ollama_http.breaker
+    breaker.check()
+    slot = await ollama_admission.acquire_async(model, priority)
+    try:
+        breaker.before_call()
+    except BaseException:
+        slot.release()
+        raise
+    return slot
+
+
+class _AdmittedLines:
+    """
+    Async iterator over an _ollama_lines() generator that holds its slot
+
+    An async generator that never started ignores aclose(), so the slot is
+    also released here for a stream that was closed before its first line.
+    """
+
+    def __init__(self, lines, slot):
+        self._lines = lines
+        self._slot = slot
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return self._lines.__anext__()
+
+    async def aclose(self):
+        try:
+            await self._lines.aclose()
+        finally:
+            self._slot.release()
+
+
+def _final_frame(line):
+    try:
+        return json.loads(line) if line else None
+    except ValueError:
+        return None
+
+
+def _record_generation(lines, model, cache_key):
+    """Record the metrics of an Ollama stream read to the end, and cache it when it completed"""
+    final = _final_frame(lines[-1]) if lines else None
+    if final is None:
+        return
+    metrics.observe_ollama_generation(final, model)
+    if cache_key and final.get('done'):
+        response_cache.set(cache_key, list(lines))
+
+
+async def _ollama_lines(path, payload, slot, on_complete=None):
+    """
+    Lines of an Ollama NDJSON stream
+
+    Records the upstream latency, errors and circuit breaker outcome, and
+    releases the admission slot when the stream ends or is closed; a failed
+    stream just ends early. on_complete receives every line of a stream that
+    was read to the end.
+    """
+    breaker = ollama_http.breaker
+    lines = [] if on_complete else None
+    started = time.perf_counter()
+    try:
+        async with _get_client().stream("POST", f"{OLLAMA_API_HOST}{path}", json=payload) as response:
+            metrics.UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - started, upstream="ollama", method="POST")
+            if response.status_code >= 500:
+                metrics.UPSTREAM_ERRORS.inc(upstream="ollama", kind="http_5xx")
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            async for line in response.aiter_lines():
+                if line:
+                    if lines is not None:
+                        lines.append(line)
+                    yield line
+    except (httpx.ConnectError, httpx.TimeoutException) as e:
+        log.error("Async stream from Ollama failed", error=str(e))
+        metrics.UPSTREAM_ERRORS.inc(
+            upstream="ollama",
+            kind="timeout" if isinstance(e, httpx.TimeoutException) else "connection"
+        )
+        breaker.record_failure()
+        return
+    except httpx.HTTPError as e:
+        log.error("Async stream from Ollama failed", error=str(e))
+        metrics.UPSTREAM_ERRORS.inc(upstream="ollama", kind="error")
+        return
+    finally:
+        slot.release()
+
+    if on_complete is not None:
+        on_complete(lines)
+
+
+async def _proxy_stream(scope, receive, send, path, payload, cache_key=None, priority=CHAT, on_complete=None,
+                        coalesce_key=None):
+    """
+    Forward an Ollama NDJSON stream as SSE frames
+
+    Uses the same "data: <ndjson line>" framing as the Flask routes, so
+    static/script.js parses both modes identically. Completed deterministic
+    streams are stored in the shared response cache. The Ollama circuit
+    breaker and the per-model admission queue are shared with the Flask
+    routes; a queued request waits on the event loop. Requests with the same
+    coalesce_key share one upstream stream while it is in flight, like the
+    Flask routes do. on_complete receives the lines of a stream that
+    completed with "done": true.
+    """
+    started = time.perf_counter()
+    labels = {"route": scope["path"], "method": "POST", "status": "200"}
+    model = payload["model"]
+
+    def finished(lines):
+        _record_generation(lines, model, cache_key)
+
+    async def open_stream():
+        slot = await _admit(model, priority)
+        return _AdmittedLines(_ollama_lines(path, payload, slot), slot)
+
+    try:
+        if coalesce_key is None:
+            slot = await _admit(model, priority)
+            lines, shared = _AdmittedLines(_ollama_lines(path, payload, slot, finished), slot), False
+        else:
+            lines, shared = await async_stream_coalescer.subscribe(coalesce_key, open_stream, finished)
+    except (CircuitOpenError, QueueFull) as e:
+        labels["status"] = str(getattr(e, 'status_code', 503))
+        retry_after = str(max(int(round(e.retry_after or 0)), 1)).encode("ascii")
+        await _send_json(send, scope, getattr(e, 'status_code', 503),
+                         {"success": False, "error": str(e), "upstream": e.upstream},
+                         [(b"retry-after", retry_after)])
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, **labels)
+        return
+
+    metrics.HTTP_STREAMS_IN_FLIGHT.inc(route=labels["route"])
+    try:
+        await _forward_stream(scope, receive, send, lines, "MISS" if cache_key else None, shared, on_complete)
+    finally:
+        await lines.aclose()
+        metrics.HTTP_STREAMS_IN_FLIGHT.dec(route=labels["route"])
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, **labels)
+
+
+async def _forward_stream(scope, receive, send, lines, cache_status, shared, on_complete=None):
+    await _start_sse(scope, send, cache_status, shared)
+
+    received = [] if on_complete else None
+    last = None
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        async for line in lines:
+            # Stop pulling tokens from Ollama once the browser has gone away
+            if disconnected.done():
+                return
+            last = line
+            if received is not None:
+                received.append(line)
+            await send({
+                "type": "http.response.body",
+                "body": f"data: {line}\n\n".encode("utf-8"),
+                "more_body": True
+            })
+    finally:
+        disconnected.cancel()
+
+    final = _final_frame(last)
+    if received and final is not None and final.get('done'):
+        on_complete(received)
+
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def generate_stream(scope, receive, send):
+    try:
+        data = json.loads(await _read_body(receive))
+        payload = {
+            "model": data.get('model', DEFAULT_MODEL),
+            "prompt": data.get('prompt', ''),
+            "stream": True
+        }
+        if data.get('options'):
+            payload["options"] = data['options']
+        session_id = data.get('session_id')
+        context = await asyncio.to_thread(chat_sessions.context, session_id) if session_id else None
+        if context:
+            payload["context"] = context
+            cache_key, cached, coalesce_key = None, None, None
+        else:
+            cache_key, cached = lookup_cached_response('generate_stream', payload["model"], payload["prompt"], data.get('options'))
+            coalesce_key = request_coalesce_key('generate_stream', payload["model"], payload["prompt"], data.get('options'))
+    except SessionError as e:
+        await _send_json(send, scope, e.status_code, {"success": False, "error": str(e)})
+        return
+    except Exception as e:
+        await _send_json(send, scope, 500, {"error": str(e)})
+        return
+
+    if cached is not None:
+        await _replay_stream(scope, send, cached, _session_recorder(session_id))
+        return
+    await _proxy_stream(scope, receive, send, "/api/generate", model_residency.apply(payload), cache_key,
+                        BATCH if data.get('priority') == BATCH else CHAT, _session_recorder(session_id), coalesce_key)
+
+
+async def chat_stream(scope, receive, send):
+    body = await _read_body(receive)
+    try:
+        data = json.loads(body)
+        # Only the newest turn decides the intent; a session request carries just that turn
+        message = data.get('message')
+        turns = [message] if isinstance(message, dict) else data.get('messages', [])
+
+        # Lights commands and queries call blocking client helpers, leave them to Flask
+        if classify_messages(turns).kind != intent_router.CHAT:
+            await flask_asgi(scope, _replay_receive(body, receive), send)
+            return
+
+        messages, session_id = await asyncio.to_thread(session_messages, data)
+        model = data.get('model', DEFAULT_MODEL)
+        messages = fit_context(model, messages)
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": True
+        }
+        if data.get('options'):
+            payload["options"] = data['options']
+        cache_key, cached = lookup_cached_response('chat_stream', payload["model"], messages, data.get('options'))
+        coalesce_key = request_coalesce_key('chat_stream', payload["model"], messages, data.get('options'))
+    except SessionError as e:
+        await _send_json(send, scope, e.status_code,
+                         {"success": False, "error": str(e), "session_expired": e.status_code == 404})
+        return
+    except Exception as e:
+        await _send_json(send, scope, 500, {"error": str(e)})
+        return
+
+    if cached is not None:
+        await _replay_stream(scope, send, cached, _session_recorder(session_id))
+        return
+    await _proxy_stream(scope, receive, send, "/api/chat", model_residency.apply(payload), cache_key,
+                        BATCH if data.get('priority') == BATCH else CHAT, _session_recorder(session_id), coalesce_key)
+
+
+STREAM_ROUTES = {
+    "/api/generate/stream": generate_stream,
+    "/generate/stream": generate_stream,
+    "/api/chat/stream": chat_stream,
+    "/chat/stream": chat_stream
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            _get_client()
+            model_residency.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            global _client
+            if _client is not None:
+                await _client.aclose()
+                _client = None
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point: async streaming routes, everything else via Flask"""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+
+    if scope["type"] == "http" and scope["method"] == "POST":
+        handler = STREAM_ROUTES.get(scope["path"])
+        if handler is not None:
+            await handler(scope, receive, send)
+            return
+
+    await flask_asgi(scope, receive, send)
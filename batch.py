@@ -0,0 +1,175 @@
+"""
+Streaming helpers for batch endpoints
+
+Batch inputs are read incrementally from the request stream and processed in
+fixed-size chunks, so memory use depends on the chunk size and the number of
+chunks in flight, not on the size of the upload.
+"""
+
+import codecs
+import json
+from collections import deque, namedtuple
+
+READ_SIZE = 64 * 1024
+
+# Placeholder yielded for an NDJSON line that is not valid JSON, so the
+# remaining lines are still processed and the indexes stay aligned
+InvalidRecord = namedtuple('InvalidRecord', ['error'])
+
+_decoder = json.JSONDecoder()
+
+
+def _decode_text(stream, read_size):
+    """Yield decoded text blocks from a binary stream"""
+    # The incremental decoder keeps multi-byte characters split between blocks
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while True:
+        block = stream.read(read_size)
+        if not block:
+            break
+        text = decoder.decode(block)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _skip_whitespace(blocks, buffer, position):
+    """
+    Advance past whitespace, reading more blocks when the buffer runs out
+
+    Returns:
+        Tuple of (buffer, position); position is len(buffer) at the end of
+        the input
+    """
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n':
+            position += 1
+        if position < len(buffer):
+            return buffer, position
+        block = next(blocks, None)
+        if block is None:
+            return buffer, position
+        buffer, position = block, 0
+
+
+def _iter_json_array(blocks, buffer):
+    """Yield the items of a top-level JSON array one at a time"""
+    buffer, position = _skip_whitespace(blocks, buffer, buffer.index('[') + 1)
+    if position < len(buffer) and buffer[position] == ']':
+        return
+    exhausted = False
+    while True:
+        if position >= len(buffer):
+            raise ValueError("JSON array is not terminated")
+        if buffer[position] in ',]':
+            raise ValueError(f"Expected a JSON array item at offset {position}")
+
+        while True:
+            try:
+                item, end = _decoder.raw_decode(buffer, position)
+                # A number at the end of the buffer may continue in the next block
+                if end < len(buffer) or exhausted:
+                    break
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise ValueError(f"Invalid JSON array item at offset {position}")
+            block = next(blocks, None)
+            if block is None:
+                exhausted = True
+            else:
+                buffer = buffer[position:] + block
+                position = 0
+        yield item
+
+        # Exactly one comma between items, none after the last one
+        buffer, position = _skip_whitespace(blocks, buffer, end)
+        if position >= len(buffer):
+            raise ValueError("JSON array is not terminated")
+        if buffer[position] == ']':
+            return
+        if buffer[position] != ',':
+            raise ValueError(f"Expected ',' or ']' at offset {position}")
+        buffer, position = _skip_whitespace(blocks, buffer, position + 1)
+
+
+def _iter_ndjson(blocks, buffer):
+    """Yield one decoded value per non-empty line"""
+    while True:
+        *lines, buffer = buffer.split('\n')
+        for line in lines:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield InvalidRecord(f"Invalid JSON line: {str(e)}")
+        block = next(blocks, None)
+        if block is None:
+            break
+        buffer += block
+    if buffer.strip():
+        try:
+            yield json.loads(buffer)
+        except json.JSONDecodeError as e:
+            yield InvalidRecord(f"Invalid JSON line: {str(e)}")
+
+
+def iter_records(stream, read_size=READ_SIZE):
+    """
+    Read records from a JSON array or NDJSON upload without loading it whole
+
+    The format is detected from the first non-whitespace character.
+
+    Args:
+        stream: Binary file-like object (request.stream or an uploaded file)
+        read_size: Bytes read per block
+
+    Yields:
+        Decoded records, InvalidRecord for NDJSON lines that are not JSON
+
+    Raises:
+        ValueError: When a JSON array upload is malformed
+    """
+    blocks = _decode_text(stream, read_size)
+    buffer = ""
+    for block in blocks:
+        buffer += block
+        if buffer.strip():
+            break
+    else:
+        return
+
+    if buffer.lstrip().startswith('['):
+        yield from _iter_json_array(blocks, buffer)
+    else:
+        yield from _iter_ndjson(blocks, buffer)
+
+
+def iter_chunks(records, size):
+    """Group an iterable into lists of at most size items"""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ordered_map(pool, func, chunks, max_in_flight):
+    """
+    Apply func to every chunk on a pool, yielding results in input order
+
+    At most max_in_flight chunks are submitted at a time, so a slow upstream
+    applies back-pressure to the input reader instead of queueing the whole
+    upload in memory.
+    """
+    in_flight = deque()
+    for chunk in chunks:
+        in_flight.append(pool.submit(func, chunk))
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
@@ -0,0 +1,98 @@
+"""
+Benchmark: bytes and latency saved by downscaling uploads before classification
+
+Builds a synthetic 12 MP photo, runs the image_preprocess.downscale stage on
+it and compares, for the original and the downscaled upload:
+  - bytes sent to the classifier
+  - transfer time at the given link speed
+  - classifier-side decode and resize to the 224x224 MobileNet input
+The downscaling time itself is charged to the downscaled path.
+
+Usage:
+    python benchmarks/bench_image_downscale.py [--width 4000] [--height 3000]
+        [--max-side 448] [--mbps 100] [--repeat 5]
+
+Requires Pillow.
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageFilter  # noqa: E402
+
+from image_preprocess import downscale  # noqa: E402
+
+CLASSIFIER_INPUT = (224, 224)
+
+
+def make_photo(width, height):
+    """Encode a photo-like JPEG: smooth gradients with sensor-like noise"""
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    red = Image.blend(gradient, noise, 0.3)
+    green = Image.blend(gradient.rotate(90).resize((width, height)), noise, 0.3)
+    blue = noise.filter(ImageFilter.GaussianBlur(2))
+    output = io.BytesIO()
+    Image.merge('RGB', (red, green, blue)).save(output, format='JPEG', quality=92)
+    return output.getvalue()
+
+
+def classifier_decode(data):
+    """What the classifier does with an upload before inference"""
+    with Image.open(io.BytesIO(data)) as image:
+        image.convert('RGB').resize(CLASSIFIER_INPUT)
+
+
+def best_of(repeat, func, *args):
+    """Return (best wall time in seconds, last result)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--width", type=int, default=4000, help="Photo width in pixels")
+    parser.add_argument("--height", type=int, default=3000, help="Photo height in pixels")
+    parser.add_argument("--max-side", type=int, default=448, help="Longest side after downscaling")
+    parser.add_argument("--mbps", type=float, default=100.0, help="Link speed to the classifier in Mbit/s")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, best is reported")
+    args = parser.parse_args()
+
+    original = make_photo(args.width, args.height)
+    downscale_time, small = best_of(args.repeat, downscale, original, args.max_side)
+    if small is None:
+        print("Downscaling did not make the image smaller, nothing to compare")
+        return
+
+    decode_original, _ = best_of(args.repeat, classifier_decode, original)
+    decode_small, _ = best_of(args.repeat, classifier_decode, small)
+
+    def transfer(size):
+        return size * 8 / (args.mbps * 1_000_000)
+
+    original_total = transfer(len(original)) + decode_original
+    small_total = downscale_time + transfer(len(small)) + decode_small
+
+    print(f"Photo: {args.width}x{args.height}, downscaled to max side {args.max_side}, link {args.mbps:g} Mbit/s")
+    print(f"{'path':<12} {'bytes':>12} {'downscale ms':>14} {'transfer ms':>13} {'decode ms':>11} {'total ms':>10}")
+    print(f"{'original':<12} {len(original):>12} {0:>14.1f} {transfer(len(original)) * 1000:>13.1f} "
+          f"{decode_original * 1000:>11.1f} {original_total * 1000:>10.1f}")
+    print(f"{'downscaled':<12} {len(small):>12} {downscale_time * 1000:>14.1f} {transfer(len(small)) * 1000:>13.1f} "
+          f"{decode_small * 1000:>11.1f} {small_total * 1000:>10.1f}")
+    print(f"Bytes saved: {len(original) - len(small)} ({(1 - len(small) / len(original)) * 100:.1f}%)")
+    print(f"Latency saved per upload: {(original_total - small_total) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
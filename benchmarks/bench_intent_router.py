@@ -0,0 +1,133 @@
+"""
+Microbenchmark: intent classification of chat messages
+
+Compares the keyword scans chat() used to run (a dozen any(k in msg ...)
+passes per message) with the compiled single-pass matcher in
+intent_router.py, over a mixed Turkish / English corpus. Also prints how
+many messages the two classifiers label differently.
+
+Usage:
+    python benchmarks/bench_intent_router.py [--repeat 2000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import intent_router  # noqa: E402
+
+CORPUS = [
+    # Turkish lights commands
+    "Salonun ışıklarını aç",
+    "Mutfaktaki ışıkları kapat",
+    "Yatak odasındaki lambayı söndür",
+    "mutfak ışığını kapat lütfen",
+    "banyo ışıklarını yak",
+    "tuvaletin ışığını kapatır mısın",
+    "oturulan odanın lambasını aç",
+    # Turkish status queries
+    "Hangi odalarda ışık açık?",
+    "salon ışığı açık mı",
+    "Işıkların durumu ne?",
+    "bana odaları listele",
+    "ışıkları göster",
+    # English lights commands
+    "Turn on the living room lights",
+    "Turn off the kitchen lights",
+    "Switch off the bedroom lamp",
+    "please switch on the bathroom light",
+    # English status queries
+    "Which lights are on?",
+    "Is the kitchen light on?",
+    "Show me the lights in every room",
+    "what is the status of the bedroom lamp",
+    # Plain chat, Turkish and English
+    "Bana kısa bir şiir yaz",
+    "Python'da bir listeyi nasıl sıralarım?",
+    "Yarın hava nasıl olacak?",
+    "Explain the difference between TCP and UDP",
+    "Write a haiku about autumn",
+    "What is the capital of Australia?",
+    "Can you summarize this article for me? " + "It is a long paragraph about distributed systems. " * 8,
+    "Merhaba, nasılsın? " + "Bugün çok yoğun bir gün geçirdim ve biraz dinlenmek istiyorum. " * 6,
+]
+
+
+def legacy_classify(message):
+    """Keyword scans as chat() did them before the intent router"""
+    user_message = message.lower()
+    light_control_keywords = ['aç', 'kapat', 'söndür', 'yak', 'turn on', 'turn off', 'switch on', 'switch off']
+    status_keywords = ['status', 'durum', 'state', 'which', 'hangi', 'list', 'liste', 'show', 'göster', 'rooms', 'odalar', 'have', 'var']
+    status_phrase_patterns = ['is the', 'are the', 'tell me about', 'what is', 'bana söyle', 'durum ne', 'ışıkları göster', 'show me']
+    light_keywords = ['ışık', 'lamba', 'aydınlat', 'lights', 'light', 'lamp']
+    room_keywords = ['salon', 'sitting', 'oturulan', 'mutfak', 'yatak', 'banyo', 'tuvalet', 'toilet', 'wc', 'living', 'kitchen', 'bedroom', 'bathroom', 'room', 'oda']
+
+    is_light_control = any(k in user_message for k in light_control_keywords) and \
+        any(k in user_message for k in light_keywords) and \
+        any(k in user_message for k in room_keywords)
+
+    is_status_query = False
+    if any(k in user_message for k in status_keywords) and \
+       (any(k in user_message for k in light_keywords) or any(k in user_message for k in room_keywords)):
+        is_status_query = True
+    if any(p in user_message for p in status_phrase_patterns) and \
+       (any(k in user_message for k in light_keywords) or any(k in user_message for k in room_keywords)):
+        is_status_query = True
+    if any(k in user_message for k in light_keywords) and \
+       any(k in user_message for k in room_keywords) and \
+       not is_light_control and \
+       not any(k in user_message for k in light_control_keywords):
+        is_status_query = True
+
+    is_english_query = any(w in user_message for w in ['turn', 'switch', 'lights', 'on', 'off'])
+
+    if is_light_control:
+        return intent_router.LIGHT_CONTROL, is_english_query
+    if is_status_query:
+        return intent_router.LIGHT_STATUS, is_english_query
+    return intent_router.CHAT, is_english_query
+
+
+def router_classify(message):
+    intent = intent_router.classify(message)
+    return intent.kind, intent.is_english
+
+
+def measure(classify, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for message in CORPUS:
+            classify(message)
+    return (time.perf_counter() - start) / (repeat * len(CORPUS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000, help="Passes over the corpus")
+    args = parser.parse_args()
+
+    legacy = measure(legacy_classify, args.repeat)
+    router = measure(router_classify, args.repeat)
+
+    print(f"Corpus: {len(CORPUS)} messages x {args.repeat} passes")
+    print(f"{'classifier':<14} {'us / message':>14}")
+    print(f"{'legacy any()':<14} {legacy * 1e6:>14.2f}")
+    print(f"{'intent_router':<14} {router * 1e6:>14.2f}")
+    print(f"Speedup: {legacy / router:.2f}x")
+
+    print("\nMessages labelled differently (legacy -> router):")
+    differences = 0
+    for message in CORPUS:
+        before, after = legacy_classify(message), router_classify(message)
+        if before[0] != after[0]:
+            differences += 1
+            print(f"  {message[:60]!r}: {before[0]} -> {after[0]}")
+    if not differences:
+        print("  none")
+
+
+if __name__ == "__main__":
+    main()
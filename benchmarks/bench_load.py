@@ -0,0 +1,415 @@
+"""
+Load test: throughput and latency of every route family, with stored baselines
+
+Starts a local stand-in for the upstreams (Ollama, regression, image and
+lights services) and the Flask app from service.py, each in its own process
+so the clients do not share an interpreter with them, and drives each route
+family with a fixed number of concurrent clients:
+  - generate        POST /api/generate
+  - chat_stream     POST /api/chat/stream (SSE)
+  - image_explain   POST /api/image/predict_with_explanation/stream (SSE)
+  - regression      POST /api/regression/predict
+  - lights          POST /api/lights/control_from_text
+It reports throughput, p50/p95/p99 latency and, for the SSE routes, time to
+the first byte. --save writes the results as a JSON baseline; --baseline
+compares the run with one and exits with status 1 when a route family got
+slower or lost throughput by more than --threshold.
+
+The stand-in answers after fixed delays, so the numbers are the service's own
+overhead (routing, admission, caching, framing) on top of those delays. They
+are only comparable on the same machine with the same settings. Prompts and
+images are unique per request, so the caches and request coalescing do not
+hide the work. The admission queue admits --concurrency generations per model
+unless OLLAMA_MODEL_CONCURRENCY is set.
+
+Usage:
+    python benchmarks/bench_load.py [--concurrency 8] [--requests 200]
+        [--warmup 20] [--families generate,chat_stream,...] [--tokens 32]
+        [--token-ms 2] [--upstream-ms 5] [--save FILE] [--baseline FILE]
+        [--threshold 0.2]
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import os
+import platform
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FAMILIES = ('generate', 'chat_stream', 'image_explain', 'regression', 'lights')
+STREAMING = ('chat_stream', 'image_explain')
+
+# Settings that must match for two runs to be compared
+COMPARED_SETTINGS = ('concurrency', 'requests', 'tokens', 'token_ms', 'upstream_ms')
+
+
+class StandInUpstream(ThreadingHTTPServer):
+    """One local server answering for Ollama, the regression, image and lights services"""
+
+    daemon_threads = True
+
+    def __init__(self, tokens, token_ms, upstream_ms):
+        super().__init__(("127.0.0.1", 0), _StandInHandler)
+        self.tokens = tokens
+        self.token_delay = token_ms / 1000.0
+        self.upstream_delay = upstream_ms / 1000.0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so the service's pooled upstream sessions reuse connections
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; without this, delayed ACKs add ~40 ms per reply
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _ndjson(self, frames):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for frame in frames:
+            line = (json.dumps(frame) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _final(self, frame):
+        tokens = self.server.tokens
+        frame.update({
+            "done": True,
+            "load_duration": 0,
+            "prompt_eval_count": 16,
+            "prompt_eval_duration": 1000000,
+            "eval_count": tokens,
+            "eval_duration": max(int(tokens * self.server.token_delay * 1e9), 1)
+        })
+        return frame
+
+    def _tokens(self, frame_for):
+        for index in range(self.server.tokens):
+            if self.server.token_delay:
+                time.sleep(self.server.token_delay)
+            yield frame_for(f"tok{index} ")
+
+    def do_GET(self):
+        if self.path == "/api/ps":
+            return self._json({"models": []})
+        if self.path == "/api/tags":
+            return self._json({"models": [{"name": "mistral:7b"}, {"name": "llama3.2:latest"}]})
+        if self.path == "/api/get_states":
+            return self._json({room: False for room in ("living_room", "kitchen", "bedroom", "bathroom")})
+        return self._json({})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.server.upstream_delay:
+            time.sleep(self.server.upstream_delay)
+
+        if self.path == "/predict":
+            if self.headers.get("Content-Type", "").startswith("multipart/form-data"):
+                return self._json({"success": True, "predictions": [{"label": "tabby cat", "probability": 0.91}]})
+            return self._json({"prediction": 42.0})
+        if self.path == "/api/lights":
+            return self._json({"success": True})
+
+        data = json.loads(body or b"{}")
+        model = data.get("model")
+        if self.path == "/api/generate":
+            if not data.get("prompt"):
+                # Preload request
+                return self._json({"model": model, "response": "", "done": True, "load_duration": 0})
+            if data.get("stream"):
+                frames = self._tokens(lambda text: {"model": model, "response": text, "done": False})
+                return self._ndjson(itertools.chain(frames, [self._final({"model": model, "response": "", "context": [1, 2, 3]})]))
+            text = "".join(f"tok{index} " for index in range(self.server.tokens))
+            time.sleep(self.server.token_delay * self.server.tokens)
+            return self._json(self._final({"model": model, "response": text, "context": [1, 2, 3]}))
+        if self.path == "/api/chat":
+            if data.get("stream", True):
+                frames = self._tokens(lambda text: {"model": model, "message": {"role": "assistant", "content": text}, "done": False})
+                return self._ndjson(itertools.chain(frames, [self._final({"model": model, "message": {"role": "assistant", "content": ""}})]))
+            time.sleep(self.server.token_delay * self.server.tokens)
+            return self._json(self._final({"model": model, "message": {"role": "assistant", "content": '{"room": "kitchen", "lights": true}'}}))
+        return self._json({"error": "not found"}, 404)
+
+
+def _serve_upstream(tokens, token_ms, upstream_ms, conn):
+    upstream = StandInUpstream(tokens, token_ms, upstream_ms)
+    conn.send(upstream.url)
+    upstream.serve_forever()
+
+
+def _serve_app(environment, conn):
+    # config.py reads the environment at import time
+    os.environ.update(environment)
+    from werkzeug.serving import make_server
+    import service
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, service.app, threaded=True)
+    conn.send(f"http://127.0.0.1:{server.server_port}")
+    server.serve_forever()
+
+
+def start_process(target, *args):
+    """Run target in a spawned process and return (process, the address it sends back)"""
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=target, args=args + (sender,), daemon=True)
+    process.start()
+    if not receiver.poll(60):
+        process.terminate()
+        raise RuntimeError(f"{target.__name__} did not start")
+    return process, receiver.recv()
+
+
+def build_request(family, index):
+    """Return (path, requests keyword arguments) of request number index of a family"""
+    if family == 'generate':
+        return '/api/generate', {"json": {"prompt": f"Benchmark prompt {index}: explain load testing"}}
+    if family == 'chat_stream':
+        return '/api/chat/stream', {"json": {"messages": [
+            {"role": "user", "content": f"Benchmark question {index}: what is a percentile?"}
+        ]}}
+    if family == 'image_explain':
+        # Unique bytes per request, so the classification cache never answers
+        image = index.to_bytes(8, 'big') + os.urandom(16 * 1024)
+        return '/api/image/predict_with_explanation/stream', {
+            "files": {"image": (f"bench-{index}.jpg", image, "image/jpeg")},
+            "data": {"message": "What is in this picture?"}
+        }
+    if family == 'regression':
+        return '/api/regression/predict', {"json": {"age": 20 + index % 50, "sex": "male", "bmi": 24.5}}
+    if family == 'lights':
+        room = ("kitchen", "bedroom", "bathroom")[index % 3]
+        action = "on" if index % 2 else "off"
+        return '/api/lights/control_from_text', {"json": {"text": f"turn {action} the {room} lights"}}
+    raise ValueError(f"Unknown route family {family}")
+
+
+def percentile(values, p):
+    """Nearest-rank percentile, None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(int(math.ceil(p / 100.0 * len(ordered))) - 1, 0)]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "mean": round(sum(values) / len(values), 3)
+    }
+
+
+def drive(base_url, family, total, concurrency):
+    """
+    Send total requests of a family from concurrency client threads
+
+    Returns:
+        Tuple of (wall seconds, latencies in ms, times to first byte in ms,
+        error count)
+    """
+    numbers = itertools.count()
+    latencies = []
+    ttfbs = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client():
+        session = requests.Session()
+        while True:
+            index = next(numbers)
+            if index >= total:
+                return
+            path, kwargs = build_request(family, index)
+            start = time.perf_counter()
+            first = None
+            try:
+                with session.post(base_url + path, stream=True, timeout=120, **kwargs) as response:
+                    for _ in response.iter_content(chunk_size=None):
+                        if first is None:
+                            first = time.perf_counter()
+                    ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            end = time.perf_counter()
+            with lock:
+                if not ok:
+                    errors[0] += 1
+                    continue
+                latencies.append((end - start) * 1000)
+                ttfbs.append(((first or end) - start) * 1000)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, latencies, ttfbs, errors[0]
+
+
+def run_family(base_url, family, args):
+    if args.warmup:
+        drive(base_url, family, args.warmup, args.concurrency)
+    seconds, latencies, ttfbs, errors = drive(base_url, family, args.requests, args.concurrency)
+    return {
+        "requests": args.requests,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "throughput_rps": round(len(latencies) / seconds, 3) if seconds else 0.0,
+        "latency_ms": summarize(latencies),
+        "ttfb_ms": summarize(ttfbs) if family in STREAMING else None
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns:
+        List of regression descriptions, empty when the run is within the
+        threshold of the baseline
+    """
+    regressions = []
+    for family, current in results.items():
+        base = baseline["results"].get(family)
+        if base is None:
+            continue
+        if current["errors"] > base["errors"]:
+            regressions.append(f"{family}: {current['errors']} errors (baseline {base['errors']})")
+        for metric in ('latency_ms', 'ttfb_ms'):
+            if not current.get(metric) or not base.get(metric):
+                continue
+            for stat in ('p50', 'p95'):
+                now, before = current[metric][stat], base[metric][stat]
+                if now > before * (1 + threshold):
+                    regressions.append(f"{family}: {metric} {stat} {now:.1f} ms (baseline {before:.1f} ms, "
+                                       f"+{(now / before - 1) * 100:.0f}%)")
+        now, before = current["throughput_rps"], base["throughput_rps"]
+        if now < before * (1 - threshold):
+            regressions.append(f"{family}: throughput {now:.1f} req/s (baseline {before:.1f} req/s, "
+                               f"-{(1 - now / before) * 100:.0f}%)")
+    return regressions
+
+
+def print_table(results):
+    def stats(summary):
+        if summary is None:
+            return f"{'-':>8} {'-':>8} {'-':>8}"
+        return f"{summary['p50']:>8.1f} {summary['p95']:>8.1f} {summary['p99']:>8.1f}"
+
+    print(f"{'family':<14} {'req':>5} {'err':>4} {'req/s':>8} "
+          f"{'lat p50':>8} {'p95':>8} {'p99':>8} {'ttfb p50':>8} {'p95':>8} {'p99':>8}")
+    for family, result in results.items():
+        print(f"{family:<14} {result['requests']:>5} {result['errors']:>4} {result['throughput_rps']:>8.1f} "
+              f"{stats(result['latency_ms'])} {stats(result['ttfb_ms'])}")
+    print("(latencies in ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients per route family")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per route family")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per family before the run")
+    parser.add_argument("--families", default=",".join(FAMILIES), help="Comma separated route families to run")
+    parser.add_argument("--tokens", type=int, default=32, help="Tokens per stand-in generation")
+    parser.add_argument("--token-ms", type=float, default=2.0, help="Stand-in delay per generated token")
+    parser.add_argument("--upstream-ms", type=float, default=5.0, help="Stand-in delay before every upstream reply")
+    parser.add_argument("--save", help="Write the results to this JSON baseline file")
+    parser.add_argument("--baseline", help="Compare with this JSON baseline file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed slowdown or throughput loss against the baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    families = [name.strip() for name in args.families.split(",") if name.strip()]
+    unknown = [name for name in families if name not in FAMILIES]
+    if unknown:
+        parser.error(f"unknown route families: {', '.join(unknown)} (choose from {', '.join(FAMILIES)})")
+
+    settings = {
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "tokens": args.tokens,
+        "token_ms": args.token_ms,
+        "upstream_ms": args.upstream_ms
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        mismatched = [name for name in COMPARED_SETTINGS if baseline["settings"].get(name) != settings[name]]
+        if mismatched:
+            print(f"Baseline {args.baseline} was recorded with different settings: " +
+                  ", ".join(f"{name}={baseline['settings'].get(name)}" for name in mismatched))
+            sys.exit(2)
+
+    upstream, upstream_url = start_process(_serve_upstream, args.tokens, args.token_ms, args.upstream_ms)
+    environment = {name: upstream_url for name in
+                   ("OLLAMA_API_HOST", "REGRESSION_API_HOST", "IMAGE_API_HOST", "LIGHTS_API_HOST")}
+    environment["OLLAMA_MODEL_CONCURRENCY"] = os.environ.get("OLLAMA_MODEL_CONCURRENCY", str(args.concurrency))
+    environment["OLLAMA_QUEUE_MAX_DEPTH"] = os.environ.get("OLLAMA_QUEUE_MAX_DEPTH", str(args.concurrency * 4))
+    environment["MODEL_PRELOAD"] = os.environ.get("MODEL_PRELOAD", "")
+    environment["LOG_LEVEL"] = os.environ.get("LOG_LEVEL", "warning")
+    app, base_url = start_process(_serve_app, environment)
+
+    print(f"Concurrency {args.concurrency}, {args.requests} requests per family (+{args.warmup} warmup), "
+          f"stand-in: {args.tokens} tokens x {args.token_ms} ms, {args.upstream_ms} ms per reply")
+    results = {}
+    for family in families:
+        results[family] = run_family(base_url, family, args)
+    app.terminate()
+    upstream.terminate()
+    print_table(results)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({
+                "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "settings": settings,
+                "results": results
+            }, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions against {args.baseline} (threshold {args.threshold * 100:.0f}%):")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (threshold {args.threshold * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Microbenchmark: SSE framing cost for the image explanation stream
+
+Compares the legacy JSON envelope framing (decode each Ollama NDJSON line and
+re-encode it inside {"type": "explanation", "content": ...}) with the byte
+passthrough framing (event: explanation / data: <raw line>), and reports the
+CPU time spent per 1k tokens for each.
+
+Usage:
+    python benchmarks/bench_sse_framing.py [--tokens 1000] [--repeat 200]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sse  # noqa: E402
+
+
+def make_ollama_lines(tokens):
+    """Build NDJSON lines shaped like Ollama /api/chat streaming frames"""
+    words = ["Bu", "görselde", "bir", "kedi", "görülüyor", "and", "the", "model", "is", "confident."]
+    lines = []
+    for i in range(tokens):
+        lines.append(json.dumps({
+            "model": "llama3.2:latest",
+            "created_at": "2025-05-15T08:07:29.123456Z",
+            "message": {"role": "assistant", "content": words[i % len(words)] + " "},
+            "done": False
+        }, ensure_ascii=False).encode('utf-8'))
+    lines.append(json.dumps({
+        "model": "llama3.2:latest",
+        "created_at": "2025-05-15T08:07:31.123456Z",
+        "message": {"role": "assistant", "content": ""},
+        "done": True,
+        "eval_count": tokens,
+        "eval_duration": 2000000000
+    }).encode('utf-8'))
+    return lines
+
+
+def measure(frame, lines, repeat):
+    """Return (CPU seconds per pass, bytes emitted per pass)"""
+    emitted = 0
+    for line in lines:
+        out = frame(line)
+        emitted += len(out) if isinstance(out, bytes) else len(out.encode('utf-8'))
+
+    start = time.process_time()
+    for _ in range(repeat):
+        for line in lines:
+            out = frame(line)
+            # The Flask response encodes str frames to bytes before writing
+            if not isinstance(out, bytes):
+                out.encode('utf-8')
+    return (time.process_time() - start) / repeat, emitted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=1000, help="Tokens per simulated stream")
+    parser.add_argument("--repeat", type=int, default=200, help="Number of simulated streams")
+    args = parser.parse_args()
+
+    lines = make_ollama_lines(args.tokens)
+    legacy_cpu, legacy_bytes = measure(sse.json_explanation_frame, lines, args.repeat)
+    passthrough_cpu, passthrough_bytes = measure(sse.explanation_frame, lines, args.repeat)
+
+    per_1k = 1000.0 / len(lines)
+    print(f"Frames per stream: {len(lines)} (repeat {args.repeat})")
+    print(f"{'framing':<12} {'CPU ms / 1k tokens':>20} {'bytes / 1k tokens':>20}")
+    print(f"{'json':<12} {legacy_cpu * 1000 * per_1k:>20.3f} {legacy_bytes * per_1k:>20.0f}")
+    print(f"{'passthrough':<12} {passthrough_cpu * 1000 * per_1k:>20.3f} {passthrough_bytes * per_1k:>20.0f}")
+    saved = legacy_cpu - passthrough_cpu
+    print(f"CPU saved per 1k tokens: {saved * 1000 * per_1k:.3f} ms "
+          f"({saved / legacy_cpu * 100 if legacy_cpu else 0:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+In-process caches used by the Flask service
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from jsonlog import get_logger
+
+log = get_logger("cache")
+
+
+class ModelListCache:
+    """
+    Cache for the Ollama model list (/api/tags)
+
+    - Within ttl seconds of the last fetch the cached list is returned as is.
+    - Between ttl and stale_ttl the cached list is still returned, and a
+      single background refresh is started (stale-while-revalidate).
+    - Past stale_ttl, or when nothing is cached, the caller fetches inline.
+
+    Every cached value carries an ETag derived from its content, so clients
+    can revalidate with If-None-Match and get a 304.
+    """
+
+    def __init__(self, fetch, ttl=30, stale_ttl=300):
+        """
+        Args:
+            fetch: Callable returning the parsed model list, raises on failure
+            ttl: Seconds a fetched list is considered fresh
+            stale_ttl: Seconds a list may be served while it is refreshed
+        """
+        self._fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self._lock = threading.Lock()
+        self._value = None
+        self._etag = None
+        self._fetched_at = 0.0
+        self._refreshing = False
+        # Bumped on invalidate() so refreshes started earlier are discarded
+        self._generation = 0
+
+    @staticmethod
+    def _make_etag(value):
+        body = json.dumps(value, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+    def _store(self, value, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._value = value
+            self._etag = self._make_etag(value)
+            self._fetched_at = time.monotonic()
+
+    def _refresh_in_background(self, generation):
+        try:
+            self._store(self._fetch(), generation)
+        except Exception as e:
+            # Keep serving the stale list, the next request will retry
+            log.warning("Background model list refresh failed", error=str(e))
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self):
+        """
+        Return the model list and its ETag
+
+        Returns:
+            Tuple of (model list, etag)
+        """
+        with self._lock:
+            age = time.monotonic() - self._fetched_at
+            value, etag, generation = self._value, self._etag, self._generation
+
+            if value is not None and age < self.ttl:
+                return value, etag
+
+            if value is not None and age < self.stale_ttl:
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(
+                        target=self._refresh_in_background,
+                        args=(generation,),
+                        daemon=True
+                    ).start()
+                return value, etag
+
+        # Nothing usable cached, fetch inline
+        value = self._fetch()
+        self._store(value, generation)
+        return value, self._make_etag(value)
+
+    def invalidate(self):
+        """Drop the cached list, e.g. after a model was pulled or deleted"""
+        with self._lock:
+            self._generation += 1
+            self._value = None
+            self._etag = None
+            self._fetched_at = 0.0
+
+
+def _approximate_size(key, value):
+    """Approximate memory footprint of a cache entry from its JSON size"""
+    return len(key) + len(json.dumps(value, ensure_ascii=False, default=str))
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with a per-entry TTL and hit/miss counters
+
+    Besides the entry count, the cache can be bounded by the approximate
+    memory its entries take (max_bytes), measured from their JSON size.
+    """
+
+    def __init__(self, max_entries=256, ttl=600, max_bytes=None):
+        """
+        Args:
+            max_entries: Maximum number of entries before the least recently
+                used one is evicted
+            ttl: Seconds an entry stays valid, None to never expire
+            max_bytes: Maximum approximate size of all entries, None for no
+                limit
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def _remove(self, key):
+        del self._entries[key]
+        self._bytes -= self._sizes.pop(key, 0)
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        size = _approximate_size(key, value) if self.max_bytes is not None else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                # Would evict everything else and still not fit
+                return
+            self._entries[key] = (value, expires_at)
+            self._sizes[key] = size
+            self._bytes += size
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes if self.max_bytes is not None else None,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+def is_deterministic(options):
+    """
+    Check whether an Ollama request will always produce the same output
+
+    Only temperature 0 or an explicit seed make a generation repeatable.
+    """
+    if not options:
+        return False
+    return options.get('temperature') == 0 or options.get('seed') is not None
+
+
+def response_cache_key(kind, model, body, options):
+    """
+    Build a cache key for an Ollama generation
+
+    Args:
+        kind: Route family, e.g. "chat" or "generate_stream"
+        model: Model name
+        body: Prompt string or list of chat messages
+        options: Ollama options dict
+
+    Returns:
+        Hex digest identifying the request
+    """
+    if isinstance(body, list):
+        # Only the fields Ollama reads take part in the key
+        body = [
+            {k: message.get(k) for k in ('role', 'content', 'images') if message.get(k) is not None}
+            for message in body
+        ]
+    canonical = json.dumps(
+        [kind, model, body, options or {}],
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+_DECIMAL_COMMA = re.compile(r"(\d),(\d)")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_prompt_text(text):
+    """
+    Normalize free text so equivalent phrasings share a cache entry
+
+    Unicode forms, letter case, runs of whitespace, surrounding punctuation
+    and Turkish decimal commas ("27,5" -> "27.5") are unified.
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _DECIMAL_COMMA.sub(r"\1.\2", text)
+    text = _SPACES.sub(" ", text)
+    return text.strip(" .!?;:")
+
+
+def extraction_cache_key(kind, model, text):
+    """
+    Build a cache key for an LLM feature extraction
+
+    Args:
+        kind: Extraction family, e.g. "regression"
+        model: Model that performs the extraction
+        text: User text the features are extracted from
+
+    Returns:
+        Hex digest identifying the normalized request
+    """
+    canonical = json.dumps([kind, model, normalize_prompt_text(text)], ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
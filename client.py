@@ -4,8 +4,47 @@ Client utilities for accessing the Ollama and Regression API services
 
 import requests
 import json
+import time
 import traceback
-from config import OLLAMA_API_HOST, REGRESSION_API_HOST, REGRESSION_PREDICT_ENDPOINT
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    OLLAMA_API_HOST, REGRESSION_API_HOST, REGRESSION_PREDICT_ENDPOINT,
+    LIGHTS_FAST_PATH_ENABLED, LIGHTS_FAST_PATH_MIN_CONFIDENCE,
+    LIGHT_STATE_MAX_AGE, LIGHT_STATE_REFRESH_INTERVAL, LIGHTS_BATCH_MAX_PARALLEL,
+    EXTRACTION_CACHE_ENABLED, EXTRACTION_CACHE_MAX_ENTRIES, EXTRACTION_CACHE_MAX_BYTES,
+    EXTRACTION_CACHE_TTL, REGRESSION_BATCH_SEND_ARRAYS,
+    IMAGE_API_HOST, HEALTH_CHECK_INTERVAL, HEALTH_PROBE_TIMEOUT, REQUEST_DEADLINES,
+    MODEL_PRELOAD, MODEL_KEEP_ALIVE, MODEL_KEEP_ALIVE_DEFAULT, MODEL_RESIDENCY_INTERVAL,
+    CONTEXT_SUMMARY_MODEL, CONTEXT_SUMMARY_TOKENS
+)
+from health import HealthMonitor
+from residency import ModelResidency
+from resilience import UpstreamUnavailable, deadline
+from cache import LRUCache, extraction_cache_key
+from light_state import LightStateMirror
+from lights_parser import parse_lights_actions
+from stats import LatencyCounters
+from upstream import ollama_http, regression_http, image_http, lights_http, ollama_admission
+from admission import INTERACTIVE, BATCH
+from jsonlog import get_logger
+
+log = get_logger("client")
+
+# Latency per lights command path ("fast" = parsed without the LLM, "llm")
+lights_path_stats = LatencyCounters()
+
+# Features extracted by the LLM per normalized regression request
+extraction_cache = LRUCache(
+    max_entries=EXTRACTION_CACHE_MAX_ENTRIES,
+    ttl=EXTRACTION_CACHE_TTL,
+    max_bytes=EXTRACTION_CACHE_MAX_BYTES
+)
+
+# Fan-out pool for commands that address several rooms
+_lights_batch_pool = ThreadPoolExecutor(
+    max_workers=LIGHTS_BATCH_MAX_PARALLEL,
+    thread_name_prefix="lights-batch"
+)
 
 def test_regression_service():
     """
@@ -23,7 +62,7 @@ def test_regression_service():
     
     # Test 1: Basic connection to host
     try:
-        response = requests.get(REGRESSION_API_HOST, timeout=5)
+        response = regression_http.get(REGRESSION_API_HOST, timeout=5, circuit=False)
         results["tests"].append({
             "name": "Basic connection to host",
             "success": True,
@@ -41,10 +80,11 @@ def test_regression_service():
     # Test 2: Connection to predict endpoint
     test_data = {"age": 30, "sex": "male", "bmi": 25.0, "children": 1, "smoker": "no", "region": "northeast"}
     try:
-        response = requests.post(
+        response = regression_http.post(
             f"{REGRESSION_API_HOST}{REGRESSION_PREDICT_ENDPOINT}",
             json=test_data,
-            timeout=5
+            timeout=5,
+            circuit=False
         )
         results["tests"].append({
             "name": "Predict endpoint test",
@@ -68,6 +108,9 @@ def check_regression_service():
     """
     Check if the regression service is running
     
+    This sends probe requests; routes read health_monitor instead, which
+    runs this check in the background.
+    
     Returns:
         Boolean indicating if service is accessible
     """
@@ -76,17 +119,19 @@ def check_regression_service():
         # First try the predict endpoint with a minimal request to see if it's alive
         try:
             # Try a small probe request - not all APIs support GET on the root
-            response = requests.get(
+            response = regression_http.get(
                 f"{REGRESSION_API_HOST}{REGRESSION_PREDICT_ENDPOINT}", 
-                timeout=3
+                timeout=HEALTH_PROBE_TIMEOUT,
+                circuit=False
             )
             return True
         except:
             # If that fails, try the root URL
             try:
-                response = requests.get(
+                response = regression_http.get(
                     f"{REGRESSION_API_HOST}", 
-                    timeout=3
+                    timeout=HEALTH_PROBE_TIMEOUT,
+                    circuit=False
                 )
                 return True
             except:
@@ -105,15 +150,15 @@ def get_regression_prediction(data):
     Returns:
         Dictionary with prediction results or error
     """
-    # First check if regression service is reachable
-    if not check_regression_service():
+    # First check if regression service is reachable (cached, no probe request)
+    if not health_monitor.is_healthy("regression"):
         return {
             "success": False,
             "error": f"Regression service not running at {REGRESSION_API_HOST}. Please start the service on port 5001."
         }
     
     try:
-        response = requests.post(
+        response = regression_http.post(
             f"{REGRESSION_API_HOST}{REGRESSION_PREDICT_ENDPOINT}",
             json=data
         )
@@ -130,20 +175,68 @@ def get_regression_prediction(data):
                 "details": response.text
             }
             
+    except UpstreamUnavailable:
+        # Let the route answer 503 instead of a prediction error
+        raise
     except Exception as e:
         return {
             "success": False,
             "error": f"Request Error: {str(e)}"
         }
         
+def get_regression_predictions(rows):
+    """
+    Get predictions for a chunk of rows from the regression model API
+    
+    Unlike get_regression_prediction(), the service probe is skipped: a batch
+    reports per-row errors instead of failing as a whole.
+    
+    Args:
+        rows: List of dictionaries with regression model input features
+        
+    Returns:
+        List with one {"success": True, "prediction": ...} or
+        {"success": False, "error": ...} dictionary per row, in order
+    """
+    url = f"{REGRESSION_API_HOST}{REGRESSION_PREDICT_ENDPOINT}"
+    
+    if REGRESSION_BATCH_SEND_ARRAYS:
+        try:
+            response = regression_http.post(url, json=rows)
+            predictions = response.json() if response.status_code == 200 else None
+            if isinstance(predictions, list) and len(predictions) == len(rows):
+                return [{"success": True, "prediction": prediction} for prediction in predictions]
+            error = f"API Error: {response.status_code}" if predictions is None else "Unexpected batch response"
+        except Exception as e:
+            error = f"Request Error: {str(e)}"
+        return [{"success": False, "error": error} for _ in rows]
+    
+    results = []
+    for row in rows:
+        try:
+            response = regression_http.post(url, json=row)
+            if response.status_code == 200:
+                results.append({"success": True, "prediction": response.json()})
+            else:
+                results.append({
+                    "success": False,
+                    "error": f"API Error: {response.status_code}",
+                    "details": response.text
+                })
+        except Exception as e:
+            results.append({"success": False, "error": f"Request Error: {str(e)}"})
+    return results
+        
 def process_regression_request_from_prompt(user_message, model="mistral:7b"):
     """
     Process a user prompt to extract regression input data and get a prediction
     
     This function:
-    1. Asks the LLM to extract structured data from the user message
+    1. Asks the LLM to extract structured data from the user message, unless
+       the same normalized message was extracted before with this model
     2. Sends that data to the regression model
-    3. Returns the prediction with an explanation
+    3. Returns the prediction with an explanation and "extraction_cache"
+       ("hit", "miss" or "disabled")
     
     Args:
         user_message: String with user's natural language request
@@ -187,18 +280,29 @@ def process_regression_request_from_prompt(user_message, model="mistral:7b"):
     Sadece JSON çıktısını döndür, başka açıklama ekleme.
     """
     
-    # Ask LLM to extract structured data
+    # Repeated or templated requests reuse the features extracted earlier
+    cache_key = extraction_cache_key("regression", model, user_message)
+    if EXTRACTION_CACHE_ENABLED:
+        cached = extraction_cache.get(cache_key)
+        if cached is not None:
+            result = _explain_regression_prediction(dict(cached))
+            result["extraction_cache"] = "hit"
+            return result
+    
+    # Ask LLM to extract structured data, leaving part of the budget for the prediction
     try:
-        extraction_response = requests.post(
-            f"{OLLAMA_API_HOST}/api/chat",
-            json={
-                "model": model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ]
-            }
-        )
+        with deadline(REQUEST_DEADLINES.get('regression_extract')):
+            with ollama_admission.acquire(model, INTERACTIVE):
+                extraction_response = ollama_http.post(
+                    f"{OLLAMA_API_HOST}/api/chat",
+                    json=model_residency.apply({
+                        "model": model,
+                        "messages": [
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": user_message}
+                        ]
+                    })
+                )
         
         if extraction_response.status_code != 200:
             return {
@@ -240,29 +344,13 @@ def process_regression_request_from_prompt(user_message, model="mistral:7b"):
             else:
                 regression_data = parsed_data  # Fallback to old format if needed
             
-            # Make prediction with regression model
-            prediction_result = get_regression_prediction(regression_data)
+            if EXTRACTION_CACHE_ENABLED and isinstance(regression_data, dict):
+                extraction_cache.set(cache_key, dict(regression_data))
             
-            if prediction_result["success"]:
-                # Format nice explanation
-                prediction_data = prediction_result["prediction"]
-                # Format input data for display
-                age = regression_data.get('age', 'N/A')
-                sex = regression_data.get('sex', 'N/A')
-                bmi = regression_data.get('bmi', 'N/A')
-                children = regression_data.get('children', 'N/A')
-                smoker = regression_data.get('smoker', 'N/A')
-                region = regression_data.get('region', 'N/A')
-                
-                explanation = {
-                    "success": True,
-                    "input_data": regression_data,
-                    "prediction_result": prediction_data,
-                    "explanation": f"Based on the input features (age: {age}, sex: {sex}, BMI: {bmi}, children: {children}, smoker: {smoker}, region: {region}), the regression model predicts: {prediction_data}"
-                }
-                return explanation
-            else:
-                return prediction_result
+            # Make prediction with regression model
+            result = _explain_regression_prediction(regression_data)
+            result["extraction_cache"] = "miss" if EXTRACTION_CACHE_ENABLED else "disabled"
+            return result
                 
         except json.JSONDecodeError:
             return {
@@ -271,6 +359,8 @@ def process_regression_request_from_prompt(user_message, model="mistral:7b"):
                 "llm_output": llm_content,
                 "prompt": system_prompt[:100] + "..."  # Include part of the prompt for debugging
             }
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             return {
                 "success": False,
@@ -278,6 +368,8 @@ def process_regression_request_from_prompt(user_message, model="mistral:7b"):
                 "traceback": traceback.format_exc()
             }
             
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return {
             "success": False,
@@ -286,23 +378,161 @@ def process_regression_request_from_prompt(user_message, model="mistral:7b"):
             "prompt": system_prompt[:100] + "..."
         }
 
+def _explain_regression_prediction(regression_data):
+    """
+    Get a prediction for extracted features and describe it
+    
+    Args:
+        regression_data: Dictionary with regression model input features
+        
+    Returns:
+        Dictionary with the input data, prediction and explanation, or the
+        get_regression_prediction() error
+    """
+    prediction_result = get_regression_prediction(regression_data)
+    
+    if not prediction_result["success"]:
+        return prediction_result
+    
+    # Format nice explanation
+    prediction_data = prediction_result["prediction"]
+    # Format input data for display
+    age = regression_data.get('age', 'N/A')
+    sex = regression_data.get('sex', 'N/A')
+    bmi = regression_data.get('bmi', 'N/A')
+    children = regression_data.get('children', 'N/A')
+    smoker = regression_data.get('smoker', 'N/A')
+    region = regression_data.get('region', 'N/A')
+    
+    return {
+        "success": True,
+        "input_data": regression_data,
+        "prediction_result": prediction_data,
+        "explanation": f"Based on the input features (age: {age}, sex: {sex}, BMI: {bmi}, children: {children}, smoker: {smoker}, region: {region}), the regression model predicts: {prediction_data}"
+    }
+
+def check_ollama_service():
+    """
+    Check if the Ollama API is running
+    
+    Returns:
+        Boolean indicating if service is accessible
+    """
+    response = ollama_http.get(f"{OLLAMA_API_HOST}/api/version", timeout=HEALTH_PROBE_TIMEOUT, circuit=False)
+    return response.status_code == 200
+
+def preload_ollama_model(model, keep_alive=None):
+    """
+    Load a model into Ollama memory without generating anything
+    
+    Ollama loads the model for a generate request without a prompt and
+    returns once it is resident.
+    
+    Args:
+        model: Model name, e.g. "llama3.2:latest"
+        keep_alive: How long Ollama keeps the model loaded afterwards
+        
+    Returns:
+        Dictionary with success, ms (wall time of the request), load_ms (time
+        Ollama spent loading, 0 if it was already resident) and error
+    """
+    payload = {"model": model, "stream": False}
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    
+    start = time.perf_counter()
+    try:
+        response = ollama_http.post(f"{OLLAMA_API_HOST}/api/generate", json=payload)
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 3)
+        if response.status_code != 200:
+            return {"success": False, "ms": elapsed_ms, "load_ms": None,
+                    "error": f"Ollama API error: {response.status_code}"}
+        load_duration = response.json().get("load_duration") or 0
+        return {"success": True, "ms": elapsed_ms, "load_ms": round(load_duration / 1e6, 3), "error": None}
+    except Exception as e:
+        return {"success": False, "ms": round((time.perf_counter() - start) * 1000, 3), "load_ms": None,
+                "error": str(e)}
+
+def list_loaded_models():
+    """
+    List the models Ollama currently holds in memory
+    
+    Returns:
+        The "models" list of /api/ps (name, size, size_vram, expires_at, ...)
+    """
+    response = ollama_http.get(f"{OLLAMA_API_HOST}/api/ps", timeout=HEALTH_PROBE_TIMEOUT, circuit=False)
+    response.raise_for_status()
+    return response.json().get("models", [])
+
+def summarize_conversation(model, previous_summary, messages):
+    """
+    Summarize chat turns that no longer fit in the conversation window
+    
+    Runs as batch work behind the interactive and chat generations of the
+    model.
+    
+    Args:
+        model: Chat model of the conversation, used unless
+            CONTEXT_SUMMARY_MODEL is set
+        previous_summary: Summary of the turns before these, or None
+        messages: Chat messages to fold into the summary
+        
+    Returns:
+        The summary text
+    """
+    model = CONTEXT_SUMMARY_MODEL or model
+    transcript = "\n".join(f"{message.get('role', 'user')}: {message.get('content', '')}" for message in messages)
+    prompt = (
+        "Summarize the conversation below in a few sentences, in its own language. "
+        "Keep names, numbers, decisions and open questions. Only return the summary.\n\n"
+    )
+    if previous_summary:
+        prompt += f"Summary so far:\n{previous_summary}\n\nNew turns:\n"
+    prompt += transcript
+    
+    with ollama_admission.acquire(model, BATCH):
+        response = ollama_http.post(
+            f"{OLLAMA_API_HOST}/api/generate",
+            json=model_residency.apply({
+                "model": model,
+                "prompt": prompt,
+                "stream": False,
+                "options": {"temperature": 0, "num_predict": CONTEXT_SUMMARY_TOKENS}
+            })
+        )
+    response.raise_for_status()
+    return response.json().get("response", "").strip()
+
+def check_image_service():
+    """
+    Check if the image classification service is running
+    
+    Any HTTP response counts, the service may not serve GET on its root.
+    
+    Returns:
+        Boolean indicating if service is accessible
+    """
+    image_http.get(IMAGE_API_HOST, timeout=HEALTH_PROBE_TIMEOUT, circuit=False)
+    return True
+
 def check_lights_service():
     """
     Check if the home lights control service is running
     
+    This sends probe requests; routes read health_monitor instead, which
+    runs this check in the background.
+    
     Returns:
         Boolean indicating if service is accessible
     """
     try:
         from config import LIGHTS_API_HOST, LIGHTS_API_ENDPOINT
-        print(f"[DEBUG] Işık servisi kontrol ediliyor (host: {LIGHTS_API_HOST})")
         
         # Try to make a simple API request first (more reliable than socket check)
         try:
             import requests
-            response = requests.get(f"{LIGHTS_API_HOST}{LIGHTS_API_ENDPOINT}", timeout=1)
+            response = lights_http.get(f"{LIGHTS_API_HOST}{LIGHTS_API_ENDPOINT}", timeout=HEALTH_PROBE_TIMEOUT, circuit=False)
             if response.status_code == 200:
-                print(f"[DEBUG] Işık servisi API yanıt verdi: {response.status_code}")
                 return True
         except:
             # If API request fails, fall back to socket check
@@ -317,18 +547,36 @@ def check_lights_service():
         # Simply check if we can connect to the port
         import socket
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(HEALTH_PROBE_TIMEOUT)
         result = sock.connect_ex((hostname, port))
         sock.close()
         
-        is_running = result == 0
-        print(f"[DEBUG] Işık servisi çalışıyor mu? (Socket kontrolü: {is_running})")
-        return is_running
+        return result == 0
     except Exception as e:
-        print(f"[ERROR] Işık servisi kontrolünde hata: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.error("Işık servisi kontrolünde hata", error=str(e), traceback=traceback.format_exc())
         return False
 
+# Upstream health, probed in the background so routes never wait for a probe
+health_monitor = HealthMonitor(
+    {
+        "ollama": check_ollama_service,
+        "regression": check_regression_service,
+        "image": check_image_service,
+        "lights": check_lights_service
+    },
+    interval=HEALTH_CHECK_INTERVAL
+)
+
+# Keeps the configured models loaded in Ollama, see MODEL_KEEP_ALIVE in config.py
+model_residency = ModelResidency(
+    list_loaded_models,
+    preload_ollama_model,
+    policies=MODEL_KEEP_ALIVE,
+    default_keep_alive=MODEL_KEEP_ALIVE_DEFAULT,
+    preload=MODEL_PRELOAD,
+    interval=MODEL_RESIDENCY_INTERVAL
+)
+
 def control_home_lights(room, turn_on=True):
     """
     Control the lights in a specified room of the home
@@ -342,7 +590,7 @@ def control_home_lights(room, turn_on=True):
     """
     from config import LIGHTS_API_HOST, LIGHTS_API_ENDPOINT
     
-    print(f"[DEBUG] Işık kontrolü çağrıldı: Oda={room}, Durum={turn_on}")
+    log.debug("Işık kontrolü çağrıldı", room=room, turn_on=turn_on)
     
     try:
         import requests
@@ -350,18 +598,19 @@ def control_home_lights(room, turn_on=True):
         api_url = f"{LIGHTS_API_HOST}{LIGHTS_API_ENDPOINT}"
         api_data = {"room": room, "lights": turn_on}
         
-        print(f"[DEBUG] Işık API'sine istek yapılıyor: URL={api_url}, Data={api_data}")
+        log.debug("Işık API'sine istek yapılıyor", url=api_url, payload=api_data)
         
-        # Timeout değerini düşürerek yanıt süresini hızlandıralım
-        response = requests.post(
+        # Timeout, config.py içindeki UPSTREAM_POOLS['lights'] ayarından gelir
+        response = lights_http.post(
             api_url,
-            json=api_data,
-            timeout=2.0  # 2 saniye timeout ekleyelim
+            json=api_data
         )
         
         if response.status_code == 200:
+            # Keep the local state mirror in sync without another API call
+            light_state_mirror.update(room, turn_on)
             action = "açıldı" if turn_on else "kapatıldı"
-            print(f"[SUCCESS] {room.capitalize()} odası ışıkları {action}.")
+            log.info("Işık durumu değiştirildi", room=room, turn_on=turn_on)
             return {
                 "success": True,
                 "message": f"{room.capitalize()} odası ışıkları {action}.",
@@ -369,7 +618,7 @@ def control_home_lights(room, turn_on=True):
                 "status": "on" if turn_on else "off"
             }
         else:
-            print(f"[ERROR] API yanıt kodu: {response.status_code}, Detay: {response.text}")
+            log.error("Işık API hatası", status=response.status_code, payload=response.text)
             return {
                 "success": False,
                 "error": f"API Hatası: {response.status_code}",
@@ -377,7 +626,7 @@ def control_home_lights(room, turn_on=True):
             }
             
     except requests.exceptions.Timeout:
-        print(f"[ERROR] API isteği zaman aşımına uğradı: {api_url}")
+        log.error("API isteği zaman aşımına uğradı", url=api_url)
         return {
             "success": False,
             "error": "API yanıt vermedi, zaman aşımı oluştu. Servis çalışıyor ancak yanıt vermiyor.",
@@ -385,7 +634,7 @@ def control_home_lights(room, turn_on=True):
             "status": "unknown"
         }
     except requests.exceptions.ConnectionError:
-        print(f"[ERROR] API bağlantı hatası: {api_url}")
+        log.error("API bağlantı hatası", url=api_url)
         return {
             "success": False,
             "error": "API bağlantı hatası. Işık kontrol servisi çalışmıyor olabilir.",
@@ -393,9 +642,7 @@ def control_home_lights(room, turn_on=True):
             "status": "unknown"
         }
     except Exception as e:
-        print(f"[ERROR] Işık kontrolünde beklenmeyen hata: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.error("Işık kontrolünde beklenmeyen hata", room=room, error=str(e), traceback=traceback.format_exc())
         return {
             "success": False,
             "error": f"Beklenmeyen hata: {str(e)}",
@@ -403,29 +650,78 @@ def control_home_lights(room, turn_on=True):
             "status": "unknown"
         }
     except requests.exceptions.ConnectionError:
-        print(f"[ERROR] API'ye bağlantı kurulamadı: {api_url}")
+        log.error("API'ye bağlantı kurulamadı", url=api_url)
         return {
             "success": False,
             "error": "API'ye bağlantı kurulamadı. Servis çalıştığından emin olun."
         }
     except Exception as e:
-        import traceback
-        print(f"[ERROR] Beklenmeyen hata: {str(e)}")
-        traceback.print_exc()
+        log.error("Beklenmeyen hata", error=str(e), traceback=traceback.format_exc())
         return {
             "success": False,
             "error": f"İstek Hatası: {str(e)}",
             "traceback": traceback.format_exc()
         }
 
+def control_home_lights_batch(actions):
+    """
+    Control the lights in several rooms at once
+    
+    One lights API call is sent per room, in parallel on a bounded pool, so
+    the whole batch takes about as long as the slowest room instead of the
+    sum of all of them.
+    
+    Args:
+        actions: List of (room, turn_on) tuples
+        
+    Returns:
+        Dictionary with success (True only if every room succeeded), message,
+        rooms and results, the per-room control_home_lights results in the
+        same order as actions
+    """
+    futures = [
+        _lights_batch_pool.submit(control_home_lights, room, turn_on)
+        for room, turn_on in actions
+    ]
+    results = []
+    for (room, turn_on), future in zip(actions, futures):
+        result = future.result()
+        result.setdefault("room", room)
+        result.setdefault("status", "on" if turn_on else "off")
+        results.append(result)
+    
+    succeeded = [result for result in results if result["success"]]
+    failed = [result["room"] for result in results if not result["success"]]
+    response = {
+        "success": not failed,
+        "message": " ".join(result["message"] for result in succeeded),
+        "rooms": [result["room"] for result in results],
+        "results": results
+    }
+    if failed:
+        response["error"] = f"Işıklar kontrol edilemedi: {', '.join(failed)}"
+    return response
+
+def _control_actions(actions):
+    """Send one (room, turn_on) action directly, several as a batch"""
+    if len(actions) == 1:
+        room, turn_on = actions[0]
+        return control_home_lights(room, turn_on)
+    return control_home_lights_batch(actions)
+
 def process_lights_command_from_text(user_message, model="mistral:7b"):
     """
     Process a natural language command to control home lights
     
     This function:
-    1. Asks the LLM to extract room and action (turn on/off) from user message
-    2. Sends a command to the lights API
-    3. Returns the result
+    1. Parses rooms and actions deterministically and, when the parse is
+       confident, sends the command to the lights API without the LLM
+    2. Otherwise asks the LLM to extract rooms and actions (turn on/off)
+    3. Returns the result, tagged with the path taken ("fast" or "llm")
+    
+    Commands for several rooms ("turn off the kitchen and bedroom lights",
+    "tüm ışıkları kapat") are sent to every room in parallel and return the
+    control_home_lights_batch() result.
     
     Args:
         user_message: String with user's natural language command
@@ -434,12 +730,35 @@ def process_lights_command_from_text(user_message, model="mistral:7b"):
     Returns:
         Dictionary with the lights control result
     """
+    start = time.perf_counter()
+    parsed = parse_lights_actions(user_message, all_rooms=light_state_mirror.rooms())
+    
+    if LIGHTS_FAST_PATH_ENABLED and parsed.confidence >= LIGHTS_FAST_PATH_MIN_CONFIDENCE:
+        log.debug("Lights fast path", actions=parsed.actions, confidence=parsed.confidence)
+        path = "fast"
+        result = _control_actions(parsed.actions)
+    else:
+        path = "llm"
+        result = _process_lights_command_with_llm(user_message, model, parsed)
+    
+    lights_path_stats.record(path, time.perf_counter() - start)
+    result["path"] = path
+    result["confidence"] = parsed.confidence
+    return result
+
+def _process_lights_command_with_llm(user_message, model, parsed):
+    """
+    Extract rooms and actions with the LLM and control the lights
+    
+    The deterministic parse is used as the fallback whenever the LLM call
+    fails or returns something that cannot be parsed.
+    """
     # Define system prompt for extraction
     system_prompt = """
     You are a language model assistant used for home automation.
 
     The user will give you natural language instructions to turn the home lights on or off.
-    Your task is to understand which room's lights should be controlled and provide output in JSON format.
+    Your task is to understand which rooms' lights should be controlled and provide output in JSON format.
 
     You must understand commands in both Turkish and English.
 
@@ -457,6 +776,14 @@ def process_lights_command_from_text(user_message, model="mistral:7b"):
       "lights": true/false (true to turn on, false to turn off)
     }
 
+    If the user addresses more than one room, use this format instead:
+    {
+      "actions": [
+        {"room": "room_name", "lights": true/false},
+        {"room": "other_room_name", "lights": true/false}
+      ]
+    }
+
     Examples:
     - "Turn on the living room lights" -> {"room": "living_room", "lights": true}
     - "Turn off the kitchen lights" -> {"room": "kitchen", "lights": false}
@@ -464,6 +791,8 @@ def process_lights_command_from_text(user_message, model="mistral:7b"):
     - "Salonun ışıklarını aç" -> {"room": "living_room", "lights": true}
     - "Mutfaktaki ışıkları kapat" -> {"room": "kitchen", "lights": false}
     - "Yatak odasındaki lambayı söndür" -> {"room": "bedroom", "lights": false}
+    - "Turn off the kitchen and bedroom lights" -> {"actions": [{"room": "kitchen", "lights": false}, {"room": "bedroom", "lights": false}]}
+    - "Mutfağı aç, banyoyu kapat" -> {"actions": [{"room": "kitchen", "lights": true}, {"room": "bathroom", "lights": false}]}
 
     If the user message does not specify a room or specifies a room that is not supported, default to "living_room."
 
@@ -472,32 +801,6 @@ def process_lights_command_from_text(user_message, model="mistral:7b"):
     Only return the JSON output, do not include any additional explanation.
     """
     
-    # Try to determine room and action directly from keywords
-    def extract_from_keywords(text):
-        text = text.lower()
-        room = "living_room"  # Default room
-        turn_on = True  # Default action
-        
-        # Room keywords
-        if any(kw in text for kw in ["salon", "living room", "oturma", "misafir", "lounge"]):
-            room = "living_room"
-        elif any(kw in text for kw in ["sitting", "sitting room", "oturulan", "sitting area"]):
-            room = "sitting_room"    
-        elif any(kw in text for kw in ["mutfak", "kitchen"]):
-            room = "kitchen"
-        elif any(kw in text for kw in ["yatak", "bedroom", "uyku", "sleep"]):
-            room = "bedroom"
-        elif any(kw in text for kw in ["banyo", "bathroom", "duş", "shower"]):
-            room = "bathroom"
-        elif any(kw in text for kw in ["tuvalet", "toilet", "wc", "lavabo"]):
-            room = "toilet"
-        
-        # Action keywords
-        if any(kw in text for kw in ["kapat", "söndür", "turn off", "switch off", "off"]):
-            turn_on = False
-        
-        return room, turn_on
-    
     # Ask LLM to extract structured data
     try:
         import requests
@@ -506,28 +809,29 @@ def process_lights_command_from_text(user_message, model="mistral:7b"):
         import traceback
         from config import OLLAMA_API_HOST
         
-        print(f"[DEBUG] Processing lights command: '{user_message}' with model '{model}'")
+        log.debug("Processing lights command", model=model, payload=user_message)
         
-        # First extract info using keyword matching as fallback
-        fallback_room, fallback_turn_on = extract_from_keywords(user_message)
-        print(f"[DEBUG] Fallback extraction: room='{fallback_room}', action={fallback_turn_on}")
+        # The deterministic parse is the fallback if the LLM path fails
+        fallback_actions = parsed.actions
+        log.debug("Fallback extraction", actions=fallback_actions)
         
-        extraction_response = requests.post(
-            f"{OLLAMA_API_HOST}/api/chat",
-            json={
-                "model": model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ]
-            }
-        )
+        with ollama_admission.acquire(model, INTERACTIVE):
+            extraction_response = ollama_http.post(
+                f"{OLLAMA_API_HOST}/api/chat",
+                json=model_residency.apply({
+                    "model": model,
+                    "messages": [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_message}
+                    ]
+                })
+            )
         
         if extraction_response.status_code != 200:
-            print(f"[ERROR] LLM API error: {extraction_response.status_code}")
+            log.error("LLM API error", model=model, status=extraction_response.status_code)
             # Use fallback if LLM API fails
-            print(f"[INFO] Using fallback values: room='{fallback_room}', action={fallback_turn_on}")
-            return control_home_lights(fallback_room, fallback_turn_on)
+            log.info("Using fallback values", actions=fallback_actions)
+            return _control_actions(fallback_actions)
         
         # Get the extracted JSON from the LLM response
         try:
@@ -536,83 +840,85 @@ def process_lights_command_from_text(user_message, model="mistral:7b"):
             
             try:
                 response_json = extraction_response.json()
-                print(f"[DEBUG] Response JSON keys: {list(response_json.keys())}")
+                log.debug("Response JSON keys", keys=list(response_json.keys()))
                 
                 # Check Ollama API response format
                 if "message" in response_json and "content" in response_json["message"]:
                     llm_content = response_json["message"]["content"]
-                    print(f"[DEBUG] Found content in message.content: {llm_content[:50]}...")
+                    log.debug("Found content in message.content", payload=llm_content)
                 elif "response" in response_json:
                     # Alternative format in some Ollama versions
                     llm_content = response_json["response"]
-                    print(f"[DEBUG] Found content in response: {llm_content[:50]}...")
+                    log.debug("Found content in response", payload=llm_content)
                 else:
-                    print(f"[WARNING] Unexpected API format with keys: {list(response_json.keys())}")
+                    log.warning("Unexpected API format", keys=list(response_json.keys()))
                     # Use fallback values
-                    print(f"[INFO] Using fallback values: room='{fallback_room}', action={fallback_turn_on}")
-                    return control_home_lights(fallback_room, fallback_turn_on)
+                    log.info("Using fallback values", actions=fallback_actions)
+                    return _control_actions(fallback_actions)
             except json.JSONDecodeError as je:
-                print(f"[ERROR] Response not valid JSON: {str(je)}")
-                print(f"[DEBUG] Raw response: {extraction_response.text[:200]}")
+                log.error("Response not valid JSON", error=str(je), payload=extraction_response.text)
                 # Use fallback values
-                print(f"[INFO] Using fallback values: room='{fallback_room}', action={fallback_turn_on}")
-                return control_home_lights(fallback_room, fallback_turn_on)
+                log.info("Using fallback values", actions=fallback_actions)
+                return _control_actions(fallback_actions)
             
             # Check if llm_content is empty or too short
             if not llm_content or len(llm_content.strip()) < 2:
-                print("[WARNING] LLM returned empty or too short content")
+                log.warning("LLM returned empty or too short content")
                 # Use fallback values
-                print(f"[INFO] Using fallback values: room='{fallback_room}', action={fallback_turn_on}")
-                return control_home_lights(fallback_room, fallback_turn_on)
+                log.info("Using fallback values", actions=fallback_actions)
+                return _control_actions(fallback_actions)
                 
             # Try to find and extract JSON from the text
             json_match = re.search(r'\{.*\}', llm_content, re.DOTALL)
             if json_match:
                 json_str = json_match.group(0)
-                print(f"[DEBUG] Extracted JSON: {json_str}")
+                log.debug("Extracted JSON", payload=json_str)
                 try:
                     # Parse the JSON data
                     parsed_data = json.loads(json_str)
-                    # Extract the room and action
-                    room = parsed_data.get("room", fallback_room)
-                    turn_on = parsed_data.get("lights", fallback_turn_on)
+                    # Extract the rooms and actions, either one room or an "actions" list
+                    fallback_room, fallback_turn_on = fallback_actions[0]
+                    if isinstance(parsed_data.get("actions"), list):
+                        actions = [
+                            (item.get("room", fallback_room), item.get("lights", fallback_turn_on))
+                            for item in parsed_data["actions"] if isinstance(item, dict)
+                        ] or fallback_actions
+                    else:
+                        actions = [(parsed_data.get("room", fallback_room), parsed_data.get("lights", fallback_turn_on))]
                     
-                    print(f"[DEBUG] Successfully extracted: room='{room}', action={turn_on}")
+                    log.debug("Successfully extracted", actions=actions)
                     
                     # Control the lights
-                    result = control_home_lights(room, turn_on)
+                    result = _control_actions(actions)
                     return result
                 except json.JSONDecodeError:
-                    print(f"[ERROR] Extracted pattern is not valid JSON: {json_str}")
+                    log.error("Extracted pattern is not valid JSON", payload=json_str)
                     # Use fallback values
-                    print(f"[INFO] Using fallback values: room='{fallback_room}', action={fallback_turn_on}")
-                    return control_home_lights(fallback_room, fallback_turn_on)
+                    log.info("Using fallback values", actions=fallback_actions)
+                    return _control_actions(fallback_actions)
             else:
-                print(f"[WARNING] No JSON pattern found in: {llm_content}")
+                log.warning("No JSON pattern found", payload=llm_content)
                 # Use fallback values
-                print(f"[INFO] Using fallback values: room='{fallback_room}', action={fallback_turn_on}")
-                return control_home_lights(fallback_room, fallback_turn_on)
+                log.info("Using fallback values", actions=fallback_actions)
+                return _control_actions(fallback_actions)
                 
         except json.JSONDecodeError:
-            print(f"[ERROR] JSON decode error for content: '{llm_content}'")
+            log.error("JSON decode error", payload=llm_content)
             # Use fallback values
-            print(f"[INFO] Using fallback values: room='{fallback_room}', action={fallback_turn_on}")
-            return control_home_lights(fallback_room, fallback_turn_on)
+            log.info("Using fallback values", actions=fallback_actions)
+            return _control_actions(fallback_actions)
         except Exception as e:
-            print(f"[ERROR] Processing error: {str(e)}")
-            traceback.print_exc()
+            log.error("Processing error", error=str(e), traceback=traceback.format_exc())
             # Use fallback values
-            print(f"[INFO] Using fallback values: room='{fallback_room}', action={fallback_turn_on}")
-            return control_home_lights(fallback_room, fallback_turn_on)
+            log.info("Using fallback values", actions=fallback_actions)
+            return _control_actions(fallback_actions)
             
     except Exception as e:
-        print(f"[ERROR] LLM request error: {str(e)}")
-        traceback.print_exc()
+        log.error("LLM request error", model=model, error=str(e), traceback=traceback.format_exc())
         
-        # Extract directly from keywords as fallback
-        room, turn_on = extract_from_keywords(user_message)
-        print(f"[INFO] Using fallback extraction: room='{room}', action={turn_on}")
-        return control_home_lights(room, turn_on)
+        # Use the deterministic parse as fallback
+        log.info("Using fallback extraction", actions=parsed.actions)
+        return _control_actions(parsed.actions)
 
 def get_home_lights_states():
     """
@@ -629,7 +935,7 @@ def get_home_lights_states():
         # Make a GET request to the API
         api_url = f"{LIGHTS_API_HOST}/api/get_states"
         
-        response = requests.get(api_url, timeout=2.0)
+        response = lights_http.get(api_url)
         
         if response.status_code == 200:
             return {
@@ -661,13 +967,20 @@ def get_home_lights_states():
             "traceback": traceback.format_exc()
         }
 
+# Status queries are answered from this mirror instead of calling /api/get_states each time
+light_state_mirror = LightStateMirror(
+    get_home_lights_states,
+    max_age=LIGHT_STATE_MAX_AGE,
+    refresh_interval=LIGHT_STATE_REFRESH_INTERVAL
+)
+
 def process_lights_status_query_from_text(user_message, model="mistral:7b"):
     """
     Process a natural language query about home light status
     
     This function:
     1. Checks if the query is about listing rooms or getting light states
-    2. Gets the current light states from the API
+    2. Gets the current light states from the local mirror (synced with the API)
     3. Uses an LLM to format a natural language response
     
     Args:
@@ -679,8 +992,8 @@ def process_lights_status_query_from_text(user_message, model="mistral:7b"):
     """
     import json
     
-    # Get current light states
-    states_result = get_home_lights_states()
+    # Get current light states (served from the mirror while it is fresh enough)
+    states_result = light_state_mirror.get()
     
     if not states_result["success"]:
         return {
@@ -713,16 +1026,17 @@ def process_lights_status_query_from_text(user_message, model="mistral:7b"):
         from config import OLLAMA_API_HOST
         
         # Ask LLM to generate a response
-        response = requests.post(
-            f"{OLLAMA_API_HOST}/api/chat",
-            json={
-                "model": model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ]
-            }
-        )
+        with ollama_admission.acquire(model, INTERACTIVE):
+            response = ollama_http.post(
+                f"{OLLAMA_API_HOST}/api/chat",
+                json=model_residency.apply({
+                    "model": model,
+                    "messages": [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_message}
+                    ]
+                })
+            )
         
         if response.status_code != 200:
             return {
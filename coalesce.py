@@ -0,0 +1,417 @@
+"""
+Single-flight coalescing of identical in-flight upstream requests
+
+When several clients send the same generation at the same moment (a dashboard
+refreshed in a few tabs), only the first one reaches Ollama. Later identical
+requests attach to it while it is in flight: non-streaming callers wait for
+the leader's result, streaming callers receive every line of the one upstream
+stream, from the start, fanned out to all subscribers.
+"""
+
+import asyncio
+import threading
+
+from jsonlog import get_logger
+
+log = get_logger("coalesce")
+
+
+class RequestCoalescer:
+    """
+    Share the result of one call among identical concurrent callers
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, func):
+        """
+        Run func once for all concurrent callers with the same key
+
+        Args:
+            key: Identifies identical requests
+            func: Callable without arguments doing the upstream call
+
+        Returns:
+            Tuple of (result, shared) where shared is True for callers that
+            received the result of another caller's call
+
+        Raises:
+            Whatever func raised, in every caller that waited for it
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+            else:
+                self.followers += 1
+                leader = False
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+
+        try:
+            call["result"] = func()
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["done"].set()
+        return call["result"], False
+
+    def stats(self):
+        with self._lock:
+            return {"leaders": self.leaders, "followers": self.followers, "in_flight": len(self._calls)}
+
+
+class _Flight:
+    """One upstream stream and the lines it produced so far"""
+
+    def __init__(self):
+        self.lines = []
+        self.done = False
+        self.subscribers = 1
+        self.opened = threading.Event()
+        self.open_error = None
+        self.condition = threading.Condition()
+
+    def publish(self, line):
+        with self.condition:
+            self.lines.append(line)
+            self.condition.notify_all()
+
+    def finish(self):
+        with self.condition:
+            self.done = True
+            self.condition.notify_all()
+
+
+class _Subscription:
+    """
+    One subscriber's iterator over the lines of a flight
+
+    A generator that was never started ignores close(), so a client that went
+    away before its response started would stay subscribed; closing this
+    leaves the flight either way.
+    """
+
+    def __init__(self, coalescer, key, flight):
+        self._lines = coalescer._follow(flight)
+        self._coalescer = coalescer
+        self._key = key
+        self._flight = flight
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._lines)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._lines.close()
+        self._coalescer._unsubscribe(self._key, self._flight)
+
+
+class StreamCoalescer:
+    """
+    Fan one upstream line stream out to every identical concurrent request
+
+    A background thread reads the upstream stream, so a slow or disconnected
+    subscriber never holds up the others. Subscribers that join late replay
+    the lines already received. When every subscriber has gone away, the
+    upstream stream is closed.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def subscribe(self, key, open_stream, on_complete=None):
+        """
+        Attach to the in-flight stream for key, or open it
+
+        Called in the view: an error opening the upstream stream is raised
+        here, for the leader and every subscriber waiting on it, before any
+        frame has been sent.
+
+        Args:
+            key: Identifies identical requests
+            open_stream: Callable returning a streamed requests.Response
+            on_complete: Optional callable receiving every line once the
+                upstream stream has been read to the end
+
+        Returns:
+            Tuple of (iterator over the NDJSON lines as bytes, shared); close
+            the iterator to leave the stream, also when it was never read
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.leaders += 1
+                leader = True
+            else:
+                with flight.condition:
+                    flight.subscribers += 1
+                self.followers += 1
+                leader = False
+
+        if not leader:
+            flight.opened.wait()
+            if flight.open_error is not None:
+                self._unsubscribe(key, flight)
+                raise flight.open_error
+            return _Subscription(self, key, flight), True
+
+        try:
+            response = open_stream()
+        except Exception as e:
+            flight.open_error = e
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.finish()
+            flight.opened.set()
+            raise
+        flight.opened.set()
+
+        threading.Thread(
+            target=self._pump,
+            args=(key, flight, response, on_complete),
+            daemon=True
+        ).start()
+        return _Subscription(self, key, flight), False
+
+    def _pump(self, key, flight, response, on_complete):
+        complete = False
+        try:
+            for line in response.iter_lines():
+                if line:
+                    flight.publish(line)
+                if flight.subscribers == 0:
+                    break
+            else:
+                complete = True
+        except Exception as e:
+            log.error("Shared upstream stream failed", error=str(e))
+        finally:
+            response.close()
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.finish()
+
+        if complete and on_complete is not None:
+            on_complete(flight.lines)
+
+    @staticmethod
+    def _follow(flight):
+        index = 0
+        while True:
+            with flight.condition:
+                while index >= len(flight.lines) and not flight.done:
+                    flight.condition.wait()
+                pending = flight.lines[index:]
+                done = flight.done
+            index += len(pending)
+            for line in pending:
+                yield line
+            if done and index >= len(flight.lines):
+                return
+
+    def _unsubscribe(self, key, flight):
+        with self._lock:
+            with flight.condition:
+                flight.subscribers -= 1
+                abandoned = flight.subscribers == 0
+            # New identical requests must not attach to a stream that is being closed
+            if abandoned and self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self):
+        with self._lock:
+            return {"leaders": self.leaders, "followers": self.followers, "in_flight": len(self._flights)}
+
+
+class _AsyncFlight:
+    """One upstream stream of the asyncio routes and the lines it produced so far"""
+
+    def __init__(self):
+        self.lines = []
+        self.done = False
+        self.subscribers = 1
+        self.opened = asyncio.get_running_loop().create_future()
+        self.condition = asyncio.Condition()
+        self.pump = None
+        self.pumping = False
+
+    async def publish(self, line):
+        async with self.condition:
+            self.lines.append(line)
+            self.condition.notify_all()
+
+    async def finish(self):
+        async with self.condition:
+            self.done = True
+            self.condition.notify_all()
+
+
+class _AsyncSubscription:
+    """One subscriber's async iterator over the lines of an _AsyncFlight"""
+
+    def __init__(self, coalescer, key, flight):
+        self._coalescer = coalescer
+        self._key = key
+        self._flight = flight
+        self._index = 0
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        flight = self._flight
+        try:
+            async with flight.condition:
+                await flight.condition.wait_for(lambda: self._index < len(flight.lines) or flight.done)
+            if self._index >= len(flight.lines):
+                raise StopAsyncIteration
+        except BaseException:
+            await self.aclose()
+            raise
+        line = flight.lines[self._index]
+        self._index += 1
+        return line
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            self._coalescer._unsubscribe(self._key, self._flight)
+
+
+class AsyncStreamCoalescer:
+    """
+    StreamCoalescer for the asyncio streaming routes (async_service.py)
+
+    The upstream stream is read by a task instead of a thread, and
+    subscribers wait on an asyncio.Condition. Use it from the one event loop
+    the ASGI server runs.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def subscribe(self, key, open_stream, on_complete=None):
+        """
+        Attach to the in-flight stream for key, or open it
+
+        Args:
+            key: Identifies identical requests
+            open_stream: Coroutine function returning an async iterator over
+                the upstream lines; an error it raises reaches the leader and
+                every subscriber waiting on it. Its aclose() is awaited once
+                the stream ends or every subscriber left, possibly before it
+                was iterated at all
+            on_complete: Optional callable receiving every line once the
+                upstream stream has been read to the end
+
+        Returns:
+            Tuple of (async iterator over the lines, shared); aclose() the
+            iterator to leave the stream
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.subscribers += 1
+            self.followers += 1
+            try:
+                await asyncio.shield(flight.opened)
+            except BaseException:
+                self._unsubscribe(key, flight)
+                if flight.opened.cancelled():
+                    # The leader went away before the stream was open, open it again
+                    return await self.subscribe(key, open_stream, on_complete)
+                raise
+            return _AsyncSubscription(self, key, flight), True
+
+        flight = _AsyncFlight()
+        self._flights[key] = flight
+        self.leaders += 1
+        try:
+            lines = await open_stream()
+        except BaseException as e:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if isinstance(e, asyncio.CancelledError):
+                flight.opened.cancel()
+            else:
+                flight.opened.set_exception(e)
+                # Retrieved here, so a leader without followers logs no warning
+                flight.opened.exception()
+            raise
+        flight.opened.set_result(None)
+        flight.pump = asyncio.ensure_future(self._pump(key, flight, lines, on_complete))
+        return _AsyncSubscription(self, key, flight), False
+
+    async def _pump(self, key, flight, lines, on_complete):
+        flight.pumping = True
+        complete = False
+        try:
+            # Every subscriber left before the task first ran, only close the stream
+            if flight.subscribers == 0:
+                return
+            async for line in lines:
+                if line:
+                    await flight.publish(line)
+                if flight.subscribers == 0:
+                    break
+            else:
+                complete = True
+        except Exception as e:
+            log.error("Shared upstream stream failed", error=str(e))
+        finally:
+            if hasattr(lines, "aclose"):
+                await lines.aclose()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            await flight.finish()
+
+        if complete and on_complete is not None:
+            on_complete(flight.lines)
+
+    def _unsubscribe(self, key, flight):
+        flight.subscribers -= 1
+        if flight.subscribers == 0:
+            # New identical requests must not attach to a stream that is being closed
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            # Unlike the thread, the task can stop waiting for Ollama's next line.
+            # A task cancelled before it first ran would skip its finally and
+            # never close the stream, so that one is left to notice by itself.
+            if flight.pump is not None and flight.pumping:
+                flight.pump.cancel()
+
+    def stats(self):
+        return {"leaders": self.leaders, "followers": self.followers, "in_flight": len(self._flights)}
@@ -37,3 +37,263 @@ DEFAULT_PARAMETERS = {
 
 # CORS Configuration
 CORS_ORIGINS = '*'  # Allow all origins, change to specific domains if needed
+
+# Upstream HTTP Client Configuration
+# One pooled keep-alive session is kept per upstream host (see upstream.py).
+# timeout is (connect, read) in seconds and is applied to every call that does
+# not pass its own. retries only covers connection setup failures, so a POST
+# that already reached the upstream is never sent twice.
+# failure_threshold consecutive failures (connection errors, timeouts, 5xx)
+# open the upstream's circuit breaker: calls then fail fast for reset_timeout
+# seconds before one trial call is let through (0 disables the breaker).
+UPSTREAM_POOLS = {
+    'ollama': {
+        'pool_size': int(os.environ.get("OLLAMA_POOL_SIZE", 20)),
+        'retries': 2,
+        'backoff_factor': 0.2,
+        'timeout': (3.05, 300),
+        'failure_threshold': 5,
+        'reset_timeout': 30
+    },
+    'regression': {
+        'pool_size': int(os.environ.get("REGRESSION_POOL_SIZE", 10)),
+        'retries': 2,
+        'backoff_factor': 0.1,
+        'timeout': (3.05, 30),
+        'failure_threshold': 5,
+        'reset_timeout': 15
+    },
+    'image': {
+        'pool_size': int(os.environ.get("IMAGE_POOL_SIZE", 10)),
+        'retries': 2,
+        'backoff_factor': 0.1,
+        'timeout': (3.05, 60),
+        'failure_threshold': 5,
+        'reset_timeout': 15
+    },
+    'lights': {
+        'pool_size': int(os.environ.get("LIGHTS_POOL_SIZE", 10)),
+        'retries': 1,
+        'backoff_factor': 0.1,
+        'timeout': (1.0, 2.0),
+        'failure_threshold': 3,
+        'reset_timeout': 10
+    }
+}
+
+# Async Streaming Configuration
+# Used by the optional ASGI entry point (async_service.py), which serves the
+# token streaming routes on an event loop instead of one worker thread each.
+ASYNC_STREAM_MAX_CONNECTIONS = int(os.environ.get("ASYNC_STREAM_MAX_CONNECTIONS", 1000))
+ASYNC_STREAM_MAX_KEEPALIVE = int(os.environ.get("ASYNC_STREAM_MAX_KEEPALIVE", 100))
+ASYNC_STREAM_TIMEOUT = (3.05, 300)  # (connect, read between tokens) in seconds
+
+# Image Explanation Stream Configuration
+# Default SSE framing for /api/image/predict_with_explanation/stream when the
+# request does not send a "framing" form field:
+#   "json"        - data: {"type": "explanation", "content": "<ollama line>"}
+#   "passthrough" - event: explanation / data: <ollama line>, bytes copied as-is
+IMAGE_EXPLANATION_SSE_FRAMING = os.environ.get("IMAGE_EXPLANATION_SSE_FRAMING", "json")
+# While the image is classified, the explanation model is loaded into Ollama
+# with an empty generate request, so a cold model load overlaps the classifier
+# call instead of following it. The model then stays loaded for its
+# MODEL_KEEP_ALIVE policy (see Model Residency below).
+IMAGE_EXPLANATION_PRELOAD = os.environ.get("IMAGE_EXPLANATION_PRELOAD", "1") == "1"
+
+# Model List Cache Configuration
+# /api/models is served from memory for MODELS_CACHE_TTL seconds. Until
+# MODELS_CACHE_STALE_TTL the cached list is still served while it is refreshed
+# in the background. Pulling or deleting a model through the service clears it.
+MODELS_CACHE_TTL = int(os.environ.get("MODELS_CACHE_TTL", 30))
+MODELS_CACHE_STALE_TTL = int(os.environ.get("MODELS_CACHE_STALE_TTL", 300))
+
+# Response Cache Configuration
+# Deterministic /api/generate and /api/chat requests (options.temperature == 0
+# or an explicit options.seed) are answered from an in-process LRU cache.
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 256))
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 600))
+
+# Lights Command Fast Path Configuration
+# Commands that lights_parser.py parses with at least this confidence are sent
+# to the lights API directly, without an LLM extraction round trip.
+LIGHTS_FAST_PATH_ENABLED = os.environ.get("LIGHTS_FAST_PATH_ENABLED", "1") == "1"
+LIGHTS_FAST_PATH_MIN_CONFIDENCE = float(os.environ.get("LIGHTS_FAST_PATH_MIN_CONFIDENCE", 0.9))
+
+# Light State Mirror Configuration
+# Status queries are answered from an in-process copy of the light states.
+# It is updated on every successful control call and re-synced from the
+# lights API when older than LIGHT_STATE_MAX_AGE seconds, plus every
+# LIGHT_STATE_REFRESH_INTERVAL seconds in the background (0 disables).
+LIGHT_STATE_MAX_AGE = float(os.environ.get("LIGHT_STATE_MAX_AGE", 10))
+LIGHT_STATE_REFRESH_INTERVAL = float(os.environ.get("LIGHT_STATE_REFRESH_INTERVAL", 5))
+
+# Lights Batch Control Configuration
+# Commands that address several rooms ("tüm ışıkları kapat", "turn off the
+# kitchen and bedroom lights") send one lights API call per room, at most
+# LIGHTS_BATCH_MAX_PARALLEL of them at the same time.
+LIGHTS_BATCH_MAX_PARALLEL = int(os.environ.get("LIGHTS_BATCH_MAX_PARALLEL", 8))
+
+# Regression Extraction Cache Configuration
+# /api/regression/predict_from_text remembers the features the LLM extracted
+# per normalized message and model, so repeated or templated requests skip
+# the extraction call. Bounded by entry count and approximate size in bytes.
+EXTRACTION_CACHE_ENABLED = os.environ.get("EXTRACTION_CACHE_ENABLED", "1") == "1"
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.environ.get("EXTRACTION_CACHE_MAX_ENTRIES", 10000))
+EXTRACTION_CACHE_MAX_BYTES = int(os.environ.get("EXTRACTION_CACHE_MAX_BYTES", 4 * 1024 * 1024))
+EXTRACTION_CACHE_TTL = int(os.environ.get("EXTRACTION_CACHE_TTL", 24 * 3600))
+
+# Regression Batch Configuration
+# /api/regression/predict_batch reads the upload incrementally, scores it in
+# chunks of REGRESSION_BATCH_CHUNK_SIZE rows with at most
+# REGRESSION_BATCH_MAX_PARALLEL chunks in flight, and streams NDJSON results
+# in input order. The regression service is called once per row over the
+# pooled connections; set REGRESSION_BATCH_SEND_ARRAYS=1 if it accepts a JSON
+# array of rows and returns an array of predictions.
+REGRESSION_BATCH_CHUNK_SIZE = int(os.environ.get("REGRESSION_BATCH_CHUNK_SIZE", 100))
+REGRESSION_BATCH_MAX_PARALLEL = int(os.environ.get("REGRESSION_BATCH_MAX_PARALLEL", 4))
+REGRESSION_BATCH_SEND_ARRAYS = os.environ.get("REGRESSION_BATCH_SEND_ARRAYS", "0") == "1"
+
+# Upstream Health Monitor Configuration
+# Every HEALTH_CHECK_INTERVAL seconds a background thread probes each upstream
+# with HEALTH_PROBE_TIMEOUT; routes and /api/health read the cached result.
+HEALTH_CHECK_INTERVAL = float(os.environ.get("HEALTH_CHECK_INTERVAL", 10))
+HEALTH_PROBE_TIMEOUT = float(os.environ.get("HEALTH_PROBE_TIMEOUT", 2))
+
+# Request Deadline Configuration
+# Total seconds a request may spend on upstream calls. Every call's timeout is
+# capped to what is left, and a request whose budget is used up fails with 503
+# instead of waiting. Chained flows also cap their first stage, so the call
+# after it is always left some time (regression_extract within
+# regression_from_text, image_classify within image_explain). Streaming
+# responses are bounded until the first byte; the stream itself is not cut.
+REQUEST_DEADLINES = {
+    'generate': 300,
+    'chat': 300,
+    'regression': 30,
+    'regression_from_text': 120,
+    'regression_extract': 100,
+    'image': 60,
+    'image_explain': 240,
+    'image_classify': 60
+}
+
+# Image Upload Configuration
+# Image uploads larger than IMAGE_UPLOAD_MAX_BYTES are refused with 413 while
+# the request is parsed; IMAGE_UPLOAD_FORM_OVERHEAD leaves room for the other
+# form fields (e.g. the chat history). Uploads above
+# IMAGE_UPLOAD_SPOOL_THRESHOLD bytes are spooled to a temporary file and
+# streamed to the classifier from there.
+IMAGE_UPLOAD_MAX_BYTES = int(os.environ.get("IMAGE_UPLOAD_MAX_BYTES", 10 * 1024 * 1024))
+IMAGE_UPLOAD_FORM_OVERHEAD = int(os.environ.get("IMAGE_UPLOAD_FORM_OVERHEAD", 1024 * 1024))
+IMAGE_UPLOAD_SPOOL_THRESHOLD = int(os.environ.get("IMAGE_UPLOAD_SPOOL_THRESHOLD", 512 * 1024))
+IMAGE_UPLOAD_ALLOWED_TYPES = os.environ.get(
+    "IMAGE_UPLOAD_ALLOWED_TYPES",
+    "image/jpeg,image/png,image/gif,image/webp,image/bmp"
+).split(",")
+
+# Image Classification Cache Configuration
+# Classifier results are cached by the SHA-256 of the uploaded image, so the
+# same image uploaded again (e.g. with a different question) skips /predict.
+IMAGE_CACHE_ENABLED = os.environ.get("IMAGE_CACHE_ENABLED", "1") == "1"
+IMAGE_CACHE_MAX_ENTRIES = int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", 512))
+IMAGE_CACHE_TTL = int(os.environ.get("IMAGE_CACHE_TTL", 3600))
+
+# Image Preprocessing Configuration
+# Optional per image upstream: uploads of at least min_bytes are decoded,
+# downscaled so the longest side is at most max_side pixels and re-encoded
+# (format, quality) before they are forwarded. The MobileNet classifier uses
+# 224x224 inputs, max_side keeps some headroom for its own crop. Runs in a
+# pool of IMAGE_PREPROCESS_WORKERS processes and requires Pillow.
+IMAGE_PREPROCESS = {
+    'image': {
+        'enabled': os.environ.get("IMAGE_PREPROCESS_ENABLED", "0") == "1",
+        'max_side': int(os.environ.get("IMAGE_PREPROCESS_MAX_SIDE", 448)),
+        'format': 'JPEG',
+        'quality': 90,
+        'min_bytes': 200 * 1024
+    }
+}
+IMAGE_PREPROCESS_WORKERS = int(os.environ.get("IMAGE_PREPROCESS_WORKERS", 2))
+
+# Model Residency Configuration
+# Models in MODEL_PRELOAD (comma separated) are loaded into Ollama when the
+# service starts. Requests to Ollama carry the model's MODEL_KEEP_ALIVE policy
+# (duration string, seconds, or -1 to keep it loaded), models without one get
+# MODEL_KEEP_ALIVE_DEFAULT (empty leaves Ollama's 5 minute default). /api/ps is
+# polled every MODEL_RESIDENCY_INTERVAL seconds for /api/models/residency.
+MODEL_PRELOAD = [
+    name.strip()
+    for name in os.environ.get("MODEL_PRELOAD", f"{DEFAULT_MODEL},llama3.2:latest").split(",")
+    if name.strip()
+]
+MODEL_KEEP_ALIVE = {
+    # Chat, lights and regression extraction default
+    DEFAULT_MODEL: os.environ.get("MODEL_KEEP_ALIVE_DEFAULT_MODEL", "30m"),
+    # Image explanations
+    'llama3.2:latest': os.environ.get("MODEL_KEEP_ALIVE_IMAGE_EXPLANATION", "30m")
+}
+MODEL_KEEP_ALIVE_DEFAULT = os.environ.get("MODEL_KEEP_ALIVE_DEFAULT") or None
+MODEL_RESIDENCY_INTERVAL = int(os.environ.get("MODEL_RESIDENCY_INTERVAL", 30))
+
+# Request Coalescing Configuration
+# Identical /api/generate and /api/chat requests (same model, prompt or
+# messages, and options) that arrive while one is in flight share its Ollama
+# call; streaming subscribers all receive the frames of one upstream stream.
+REQUEST_COALESCING_ENABLED = os.environ.get("REQUEST_COALESCING_ENABLED", "1") == "1"
+
+# Ollama Admission Queue Configuration
+# Generations are admitted OLLAMA_MODEL_CONCURRENCY at a time per model (match
+# Ollama's OLLAMA_NUM_PARALLEL); up to OLLAMA_QUEUE_MAX_DEPTH more wait per
+# model, lights and extraction commands ahead of chats ahead of batch work.
+# Beyond that requests are answered with 429 and a Retry-After estimate.
+OLLAMA_ADMISSION_ENABLED = os.environ.get("OLLAMA_ADMISSION_ENABLED", "1") == "1"
+OLLAMA_MODEL_CONCURRENCY = int(os.environ.get("OLLAMA_MODEL_CONCURRENCY", 1))
+OLLAMA_QUEUE_MAX_DEPTH = int(os.environ.get("OLLAMA_QUEUE_MAX_DEPTH", 16))
+
+# Logging Configuration
+# Every module logs JSON lines to stdout through a queue drained by a
+# background thread (jsonlog.py). Records below LOG_LEVEL are skipped; debug
+# and info records can be sampled (0.0 - 1.0). Request payloads (messages,
+# prompts, model output) are only logged with LOG_PAYLOADS=1, cut to
+# LOG_PAYLOAD_MAX_CHARS. When LOG_QUEUE_SIZE records are waiting, new ones are
+# dropped and counted instead of blocking the request.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "info")
+LOG_SAMPLE_RATES = {
+    'debug': float(os.environ.get("LOG_SAMPLE_RATE_DEBUG", 1.0)),
+    'info': float(os.environ.get("LOG_SAMPLE_RATE_INFO", 1.0))
+}
+LOG_PAYLOADS = os.environ.get("LOG_PAYLOADS", "0") == "1"
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get("LOG_PAYLOAD_MAX_CHARS", 512))
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+# Conversation Window Configuration
+# Chat requests send the system prompt plus the most recent turns that fit in
+# the model's prompt token budget (CONTEXT_TOKEN_BUDGETS, otherwise
+# CONTEXT_TOKEN_BUDGET_DEFAULT), estimated at about 4 characters per token.
+# Keep the budget below the model's num_ctx so the reply still fits. With
+# CONTEXT_SUMMARY_ENABLED=1 the older turns are summarized in the background
+# (at most CONTEXT_SUMMARY_TOKENS tokens, by CONTEXT_SUMMARY_MODEL or the chat
+# model) and the cached summary is sent in their place.
+CONTEXT_WINDOW_ENABLED = os.environ.get("CONTEXT_WINDOW_ENABLED", "1") == "1"
+CONTEXT_TOKEN_BUDGET_DEFAULT = int(os.environ.get("CONTEXT_TOKEN_BUDGET_DEFAULT", 3072))
+CONTEXT_TOKEN_BUDGETS = {
+    DEFAULT_MODEL: int(os.environ.get("CONTEXT_TOKEN_BUDGET_DEFAULT_MODEL", 6144)),
+    'llama3.2:latest': int(os.environ.get("CONTEXT_TOKEN_BUDGET_LLAMA3_2", 6144))
+}
+CONTEXT_SUMMARY_ENABLED = os.environ.get("CONTEXT_SUMMARY_ENABLED", "0") == "1"
+CONTEXT_SUMMARY_MODEL = os.environ.get("CONTEXT_SUMMARY_MODEL") or None
+CONTEXT_SUMMARY_TOKENS = int(os.environ.get("CONTEXT_SUMMARY_TOKENS", 256))
+CONTEXT_SUMMARY_CACHE_MAX_ENTRIES = int(os.environ.get("CONTEXT_SUMMARY_CACHE_MAX_ENTRIES", 1024))
+CONTEXT_SUMMARY_CACHE_TTL = int(os.environ.get("CONTEXT_SUMMARY_CACHE_TTL", 6 * 3600))
+
+# Chat Session Configuration
+# Clients may send a session_id with only the new message instead of the whole
+# conversation; the history is kept server side. Up to SESSION_MAX_SESSIONS
+# sessions are kept in memory with at most SESSION_MAX_MESSAGES messages each,
+# and expire after SESSION_TTL idle seconds. When the store is full the least
+# recently used session is written to SESSION_SPILL_DIR (empty drops it).
+SESSION_MAX_SESSIONS = int(os.environ.get("SESSION_MAX_SESSIONS", 1000))
+SESSION_MAX_MESSAGES = int(os.environ.get("SESSION_MAX_MESSAGES", 200))
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 24 * 3600))
+SESSION_SPILL_DIR = os.environ.get("SESSION_SPILL_DIR") or None
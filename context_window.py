@@ -0,0 +1,246 @@
+"""
+Token-budgeted conversation window for the chat routes
+
+The browser posts the whole conversation with every chat request, so the
+prompt Ollama evaluates (and its prompt-eval time) grows with every turn. The
+window below estimates the tokens of each message and sends the system prompt
+plus as many of the most recent turns as fit in the model's budget.
+
+Optionally the turns that no longer fit are compacted into a rolling summary,
+sent as a system message ahead of the kept turns. Summaries are produced on a
+background thread and cached per conversation, so a request never waits for
+one: until the summary has caught up, the request uses the latest cached
+summary of an earlier part of the conversation.
+"""
+
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from jsonlog import get_logger
+from residency import model_key
+
+log = get_logger("context_window")
+
+# Role markers and separators Ollama's chat templates add around each message
+_MESSAGE_OVERHEAD_TOKENS = 4
+_CHARS_PER_TOKEN = 4
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+def estimate_tokens(message):
+    """
+    Rough token count of a chat message, about 4 characters per token
+
+    Close enough for English and Turkish prose with the Llama and Mistral
+    tokenizers, and much cheaper than tokenizing.
+    """
+    content = message.get("content") or ""
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    return _MESSAGE_OVERHEAD_TOKENS + (len(content) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
+def _chain_hashes(messages):
+    """Hash of every prefix of messages, each one chained from the previous"""
+    hashes = []
+    digest = b""
+    for message in messages:
+        canonical = json.dumps([message.get("role"), message.get("content")], ensure_ascii=False)
+        digest = hashlib.sha256(digest + canonical.encode("utf-8")).digest()
+        hashes.append(digest.hex())
+    return hashes
+
+
+class ContextWindow:
+    """
+    Trim chat messages to a per-model token budget
+    """
+
+    def __init__(self, budgets=None, default_budget=4096, summarize=None, summary_cache=None,
+                 summary_tokens=256, enabled=True):
+        """
+        Args:
+            budgets: Dictionary of model name -> prompt token budget
+            default_budget: Budget of models without an entry
+            summarize: Optional callable (model, previous_summary, messages)
+                returning a summary of the earlier summary plus the messages;
+                None disables summaries
+            summary_cache: LRUCache holding one rolling summary per
+                conversation, required with summarize
+            summary_tokens: Part of the budget kept for the summary when
+                turns are trimmed
+            enabled: False passes messages through unchanged
+        """
+        self.budgets = {model_key(name): budget for name, budget in (budgets or {}).items()}
+        self.default_budget = default_budget
+        self.enabled = enabled
+        self._summarize = summarize
+        self._summaries = summary_cache
+        self.summary_tokens = summary_tokens
+        self._summary_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-summary")
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._counters = {
+            "requests": 0,
+            "trimmed_requests": 0,
+            "messages_trimmed": 0,
+            "tokens_in": 0,
+            "tokens_sent": 0,
+            "tokens_trimmed": 0,
+            "summaries_used": 0,
+            "summaries_stale": 0,
+            "summaries_built": 0,
+            "summary_errors": 0
+        }
+
+    def budget(self, model):
+        """Prompt token budget of a model"""
+        return self.budgets.get(model_key(model), self.default_budget)
+
+    def fit(self, model, messages):
+        """
+        Return the messages to send for a chat request
+
+        Leading system messages and the last message are always kept. Earlier
+        turns are kept newest first while they fit in the budget; the turns
+        before the first one that does not fit are trimmed (or summarized).
+
+        Args:
+            model: Model name, selects the budget
+            messages: Chat messages as posted by the client
+
+        Returns:
+            Tuple of (messages to send, info dict with tokens_in,
+            tokens_sent, messages_trimmed, tokens_trimmed and summary) where
+            summary is None, "current" or "stale"
+        """
+        tokens = [estimate_tokens(message) for message in messages]
+        total = sum(tokens)
+        info = {"tokens_in": total, "tokens_sent": total, "messages_trimmed": 0, "tokens_trimmed": 0, "summary": None}
+        budget = self.budget(model)
+        if not self.enabled or total <= budget or len(messages) < 2:
+            self._record(info)
+            return messages, info
+
+        head = 0
+        while head < len(messages) - 1 and messages[head].get("role") == "system":
+            head += 1
+        if self._summarize is not None:
+            budget -= self.summary_tokens
+
+        used = sum(tokens[:head]) + tokens[-1]
+        start = len(messages) - 1
+        while start > head and used + tokens[start - 1] <= budget:
+            start -= 1
+            used += tokens[start]
+
+        kept = messages[:head] + messages[start:]
+        trimmed = messages[head:start]
+        if not trimmed:
+            self._record(info)
+            return messages, info
+
+        summary = self._summary_for(model, trimmed) if self._summarize is not None else None
+        if summary is not None:
+            text, info["summary"] = summary
+            summary_message = {"role": "system", "content": SUMMARY_PREFIX + text}
+            kept = messages[:head] + [summary_message] + messages[start:]
+            used += estimate_tokens(summary_message)
+
+        info["tokens_sent"] = used
+        info["messages_trimmed"] = len(trimmed)
+        info["tokens_trimmed"] = sum(tokens[head:start])
+        self._record(info)
+        metrics.CHAT_CONTEXT_TOKENS_TRIMMED.inc(info["tokens_trimmed"], model=model_key(model))
+        return kept, info
+
+    def _summary_for(self, model, trimmed):
+        """
+        Cached rolling summary of the trimmed turns
+
+        One entry per conversation, keyed by its first trimmed message, holds
+        the summary of the first `count` trimmed turns. When more turns have
+        been trimmed since, the summary is extended in the background and the
+        cached one is used meanwhile.
+
+        Returns:
+            Tuple of (summary text, "current" or "stale"), None when nothing
+            usable is cached yet
+        """
+        hashes = _chain_hashes(trimmed)
+        key = "summary:" + hashes[0]
+        entry = self._summaries.get(key)
+        if entry is not None and (entry["count"] > len(trimmed) or entry["hash"] != hashes[entry["count"] - 1]):
+            # Another conversation that starts with the same message
+            entry = None
+
+        count = entry["count"] if entry is not None else 0
+        if count < len(trimmed):
+            self._schedule_summary(model, key, entry, trimmed, hashes)
+        if entry is None:
+            return None
+        return entry["summary"], "current" if count == len(trimmed) else "stale"
+
+    def _schedule_summary(self, model, key, entry, trimmed, hashes):
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._summary_pool.submit(self._build_summary, model, key, entry, list(trimmed), hashes[-1])
+
+    def _build_summary(self, model, key, entry, trimmed, last_hash):
+        try:
+            previous = entry["summary"] if entry is not None else None
+            count = entry["count"] if entry is not None else 0
+            summary = self._summarize(model, previous, trimmed[count:])
+            self._summaries.set(key, {"count": len(trimmed), "hash": last_hash, "summary": summary})
+            with self._lock:
+                self._counters["summaries_built"] += 1
+            log.debug("Conversation summary updated", model=model, turns=len(trimmed), payload=summary)
+        except Exception as e:
+            with self._lock:
+                self._counters["summary_errors"] += 1
+            log.warning("Conversation summary failed", model=model, error=str(e))
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _record(self, info):
+        with self._lock:
+            counters = self._counters
+            counters["requests"] += 1
+            counters["tokens_in"] += info["tokens_in"]
+            counters["tokens_sent"] += info["tokens_sent"]
+            if info["messages_trimmed"]:
+                counters["trimmed_requests"] += 1
+                counters["messages_trimmed"] += info["messages_trimmed"]
+                counters["tokens_trimmed"] += info["tokens_trimmed"]
+            if info["summary"] is not None:
+                counters["summaries_used"] += 1
+                if info["summary"] == "stale":
+                    counters["summaries_stale"] += 1
+
+    def stats(self):
+        """
+        Returns:
+            Dictionary with enabled, default_budget, budgets, the request and
+            token counters, and the summary cache stats when summaries are on
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            pending = len(self._pending)
+        stats = {
+            "enabled": self.enabled,
+            "default_budget": self.default_budget,
+            "budgets": dict(self.budgets),
+            "summaries_enabled": self._summarize is not None,
+            "summaries_pending": pending
+        }
+        stats.update(counters)
+        if self._summaries is not None:
+            stats["summary_cache"] = self._summaries.stats()
+        return stats
@@ -0,0 +1,107 @@
+"""
+Background health monitor for the upstream services
+
+Routes used to probe an upstream (one or two GETs, or a socket connect) before
+every call. The monitor probes each upstream on an interval from a background
+thread and keeps the latest result, so a route only reads a dictionary entry.
+"""
+
+import threading
+import time
+
+
+class HealthMonitor:
+    """
+    Cached health state per upstream
+
+    An upstream that has not been probed yet is reported as healthy, so the
+    first requests after startup are not refused while the first probes run.
+    """
+
+    def __init__(self, probes, interval=10.0):
+        """
+        Args:
+            probes: Dictionary of upstream name -> callable returning True
+                when the upstream is reachable (exceptions count as down)
+            interval: Seconds between two probe rounds
+        """
+        self._probes = probes
+        self.interval = interval
+        self._states = {
+            name: {"healthy": None, "checked_at": None, "latency_ms": None, "error": None, "since": None}
+            for name in probes
+        }
+        self._monitor = None
+        self._start_lock = threading.Lock()
+
+    def _start_monitor(self):
+        # Started on first use rather than at import, so the Flask reloader
+        # parent process does not probe the upstreams as well
+        if self._monitor is not None:
+            return
+        with self._start_lock:
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+                self._monitor.start()
+
+    def _monitor_loop(self):
+        while True:
+            self.probe_all()
+            time.sleep(self.interval)
+
+    def _probe(self, name):
+        start = time.perf_counter()
+        error = None
+        try:
+            healthy = bool(self._probes[name]())
+        except Exception as e:
+            healthy = False
+            error = str(e)
+        latency_ms = round((time.perf_counter() - start) * 1000, 3)
+
+        previous = self._states[name]
+        # Replace the whole entry so readers never see a half-updated state
+        self._states[name] = {
+            "healthy": healthy,
+            "checked_at": time.time(),
+            "latency_ms": latency_ms,
+            "error": error,
+            "since": previous["since"] if previous["healthy"] == healthy else time.time()
+        }
+
+    def probe_all(self):
+        """Probe every upstream once and update the cached states"""
+        for name in self._probes:
+            self._probe(name)
+
+    def is_healthy(self, name):
+        """
+        Return the cached health of one upstream without any network call
+
+        Args:
+            name: Upstream name, e.g. "regression"
+
+        Returns:
+            False only if the last probe found the upstream down
+        """
+        self._start_monitor()
+        return self._states[name]["healthy"] is not False
+
+    def status(self, name):
+        """Return the cached state entry of one upstream"""
+        self._start_monitor()
+        return dict(self._states[name])
+
+    def snapshot(self):
+        """
+        Returns:
+            Dictionary with healthy (no upstream known to be down), interval
+            and upstreams, the cached state of every upstream
+        """
+        self._start_monitor()
+        upstreams = {name: dict(state) for name, state in self._states.items()}
+        return {
+            "healthy": all(state["healthy"] is not False for state in upstreams.values()),
+            "interval": self.interval,
+            "upstreams": upstreams
+        }
@@ -0,0 +1,188 @@
+"""
+Optional downscaling stage for image uploads
+
+The classifier works at a small fixed input resolution, so forwarding a
+full-resolution phone photo only costs bandwidth and decode time on both
+sides. When enabled for an image upstream (IMAGE_PREPROCESS in config.py),
+uploads are decoded, downscaled and re-encoded before they are forwarded.
+The work runs in a process pool so it does not hold the GIL of the Flask
+worker threads.
+
+Requires Pillow; without it the stage is skipped and uploads are forwarded
+unchanged.
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from jsonlog import get_logger
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+log = get_logger("image_preprocess")
+
+_FORMAT_TYPES = {
+    'JPEG': ('image/jpeg', '.jpg'),
+    'PNG': ('image/png', '.png'),
+    'WEBP': ('image/webp', '.webp')
+}
+
+
+def downscale(data, max_side, image_format='JPEG', quality=90):
+    """
+    Downscale encoded image bytes so the longest side is at most max_side
+
+    Runs in a worker process. JPEG images are decoded at a reduced scale
+    (draft mode), which skips most of the decode work for large photos.
+
+    Returns:
+        Re-encoded bytes, or None if the image is already small enough or
+        the result would not be smaller
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        if max(image.size) <= max_side:
+            return None
+        if image.format == 'JPEG':
+            image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        output = io.BytesIO()
+        image.save(output, format=image_format, quality=quality)
+
+    encoded = output.getvalue()
+    return encoded if len(encoded) < len(data) else None
+
+
+class ImagePreprocessor:
+    """
+    Downscales uploads for one image upstream in a process pool
+    """
+
+    def __init__(self, settings, workers=2):
+        """
+        Args:
+            settings: IMAGE_PREPROCESS entry with enabled, max_side, format,
+                quality and min_bytes (smaller uploads are forwarded as is)
+            workers: Size of the process pool
+        """
+        self.settings = settings or {}
+        self.workers = workers
+        self.enabled = bool(self.settings.get('enabled'))
+        if self.enabled and Image is None:
+            log.warning("Image preprocessing is enabled but Pillow is not installed, uploads are forwarded unchanged")
+            self.enabled = False
+        self._pool = None
+        self._lock = threading.Lock()
+        self._counters = {"uploads": 0, "downscaled": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0}
+
+    def _get_pool(self):
+        # Under the lock, so concurrent first uploads do not each start a pool
+        with self._lock:
+            if self._pool is None:
+                # Spawned workers do not inherit the Flask threads or open sockets
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._pool
+
+    def _discard_pool(self, pool):
+        """Drop a broken pool so the next upload starts a fresh one"""
+        with self._lock:
+            # Another upload may have replaced it already
+            if self._pool is not pool:
+                return
+            self._pool = None
+        pool.shutdown(wait=False)
+
+    def process(self, fileobj, filename, content_type, size):
+        """
+        Downscale an uploaded image if that makes it smaller
+
+        Args:
+            fileobj: Seekable file object with the upload, at its start
+            filename: File name of the upload
+            content_type: Content type of the upload
+            size: Size of the upload in bytes
+
+        Returns:
+            Tuple of (file object, filename, content type, stats) where stats
+            is None when the upload is forwarded unchanged, otherwise a dict
+            with original_bytes, bytes and ms
+        """
+        if not self.enabled or size < self.settings.get('min_bytes', 0):
+            return fileobj, filename, content_type, None
+
+        image_format = self.settings.get('format', 'JPEG')
+        start = time.perf_counter()
+        data = fileobj.read()
+        fileobj.seek(0)
+        pool = self._get_pool()
+        try:
+            encoded = pool.submit(
+                downscale,
+                data,
+                self.settings.get('max_side', 448),
+                image_format,
+                self.settings.get('quality', 90)
+            ).result()
+        except BrokenProcessPool as e:
+            # A worker died; start a fresh pool for the next upload
+            log.warning("Image preprocessing pool failed, forwarding the original", error=str(e))
+            self._discard_pool(pool)
+            return fileobj, filename, content_type, None
+        except Exception as e:
+            # Undecodable or unusual images are left to the classifier
+            log.warning("Image preprocessing failed, forwarding the original", filename=filename, error=str(e))
+            return fileobj, filename, content_type, None
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._counters["uploads"] += 1
+            self._counters["seconds"] += elapsed
+            if encoded is not None:
+                self._counters["downscaled"] += 1
+                self._counters["bytes_in"] += size
+                self._counters["bytes_out"] += len(encoded)
+
+        if encoded is None:
+            return fileobj, filename, content_type, None
+
+        output_type, extension = _FORMAT_TYPES.get(image_format, (content_type, ''))
+        if extension:
+            filename = os.path.splitext(filename or 'image')[0] + extension
+        stats = {
+            "original_bytes": size,
+            "bytes": len(encoded),
+            "ms": round(elapsed * 1000, 3)
+        }
+        return io.BytesIO(encoded), filename, output_type, stats
+
+    def stats(self):
+        """
+        Returns:
+            Dictionary with enabled, uploads seen by the stage, downscaled
+            uploads, bytes before and after downscaling and average ms
+        """
+        with self._lock:
+            counters = dict(self._counters)
+        uploads = counters.pop("uploads")
+        seconds = counters.pop("seconds")
+        return {
+            "enabled": self.enabled,
+            "uploads": uploads,
+            **counters,
+            "bytes_saved": counters["bytes_in"] - counters["bytes_out"],
+            "avg_ms": round(seconds / uploads * 1000, 3) if uploads else 0.0
+        }
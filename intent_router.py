@@ -0,0 +1,168 @@
+"""
+Intent router for chat messages
+
+Classifies the latest user message into a plain chat turn, a lights control
+command or a lights status query. All keyword sets are compiled into one
+regular expression, so a message is scanned once instead of once per keyword
+list, and chat() and chat_stream() share the same rules.
+"""
+
+import re
+from collections import namedtuple
+
+CHAT = 'chat'
+LIGHT_CONTROL = 'light_control'
+LIGHT_STATUS = 'light_status'
+
+# Canonical room names understood by the lights API and their aliases.
+# Turkish stems ending in k also appear softened to ğ before a vowel suffix
+# ("mutfak" -> "mutfağı", "yatak" -> "yatağın"); aliases match word starts,
+# so both forms are listed.
+ROOM_ALIASES = {
+    'living_room': ['salon', 'living', 'oturma', 'misafir', 'lounge'],
+    'sitting_room': ['sitting', 'oturulan'],
+    'kitchen': ['mutfak', 'mutfağ', 'kitchen'],
+    'bedroom': ['yatak', 'yatağ', 'bedroom', 'uyku', 'sleep'],
+    'bathroom': ['banyo', 'bathroom', 'duş', 'shower'],
+    'toilet': ['tuvalet', 'toilet', 'wc', 'lavabo']
+}
+
+# Words that address every room ("tüm ışıkları kapat", "turn off all lights").
+# Matched as whole words, since "all" is part of many unrelated words.
+ALL_ROOMS_WORDS = ('tüm', 'tümü', 'tümünü', 'bütün', 'hepsi', 'hepsini', 'all', 'every', 'everywhere', 'whole')
+
+# Keyword sets, matched as substrings of the lowercased message
+KEYWORDS = {
+    'control': ['aç', 'kapat', 'söndür', 'yak', 'turn on', 'turn off', 'switch on', 'switch off'],
+    'status': ['status', 'durum', 'state', 'which', 'hangi', 'list', 'liste', 'show', 'göster', 'rooms', 'odalar', 'have', 'var'],
+    'status_phrase': ['is the', 'are the', 'tell me about', 'what is', 'bana söyle', 'durum ne', 'ışıkları göster', 'show me'],
+    # State adjectives ("açık" = on, "kapalı" = off) describe, they do not command
+    'state': ['açık', 'kapalı'],
+    'light': ['ışık', 'ışığ', 'lamba', 'aydınlat', 'lights', 'light', 'lamp'],
+    'room': [alias for aliases in ROOM_ALIASES.values() for alias in aliases] + ['room', 'oda']
+}
+
+# Words that mark a lights command as English for the reply language
+_ENGLISH_PATTERN = re.compile(r"\b(?:turn|switch|lights?|on|off)\b")
+_ALL_ROOMS_PATTERN = re.compile(r"\b(?:" + "|".join(ALL_ROOMS_WORDS) + r")\b")
+
+Intent = namedtuple('Intent', ['kind', 'is_english', 'categories'])
+
+
+def _trie_pattern(words):
+    """
+    Build a regex alternation for words with shared prefixes factored out
+
+    ["light", "lights", "lamp"] becomes "l(?:amp|ight(?:s)?)", which lets the
+    regex engine reject a position after one character instead of trying
+    every keyword in turn.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        group = '(?:' + '|'.join(branches) + ')'
+        # Greedy "?" prefers the longer keyword when a shorter one ends here
+        return group + '?' if '' in node else group
+
+    return build(trie)
+
+
+def _compile(keywords):
+    """
+    Build one pattern that reports every keyword occurrence in a single pass
+
+    The alternation is wrapped in a lookahead, so a match is tried at every
+    position and overlapping keywords are all seen. At one position only the
+    longest keyword matches, so each keyword also carries the categories of
+    the shorter keywords it starts with ("lights" -> "light", ...).
+    """
+    categories = {}
+    for category, words in keywords.items():
+        for word in words:
+            categories.setdefault(word, set()).add(category)
+
+    for word in categories:
+        # "açık" starts with the verb "aç" but must not count as a command
+        if 'state' in categories[word]:
+            continue
+        for other, other_categories in list(categories.items()):
+            if other != word and word.startswith(other):
+                categories[word] = categories[word] | other_categories
+
+    pattern = re.compile(f"(?=({_trie_pattern(categories)}))")
+    return pattern, {word: frozenset(cats) for word, cats in categories.items()}
+
+
+_PATTERN, _CATEGORIES = _compile(KEYWORDS)
+
+
+def match_categories(text):
+    """
+    Return the set of keyword categories present in text
+
+    Args:
+        text: Lowercased message
+
+    Returns:
+        Set of category names from KEYWORDS, plus 'all_rooms' when the text
+        addresses every room
+    """
+    found = set()
+    for word in set(_PATTERN.findall(text)):
+        found |= _CATEGORIES[word]
+    if _ALL_ROOMS_PATTERN.search(text):
+        found.add('all_rooms')
+    return found
+
+
+def classify(message):
+    """
+    Classify a single user message
+
+    Args:
+        message: Raw user message
+
+    Returns:
+        Intent(kind, is_english, categories) where kind is CHAT,
+        LIGHT_CONTROL or LIGHT_STATUS
+    """
+    text = message.lower()
+    found = match_categories(text)
+
+    # "tüm ışıkları kapat" names no room but addresses all of them
+    has_room = 'room' in found or 'all_rooms' in found
+    has_target = 'light' in found or has_room
+
+    if 'control' in found and 'light' in found and has_room:
+        kind = LIGHT_CONTROL
+    elif ('status' in found or 'status_phrase' in found or 'state' in found) and has_target:
+        kind = LIGHT_STATUS
+    elif 'light' in found and has_room and 'control' not in found:
+        # Light related but not a command, treat it as a status query
+        kind = LIGHT_STATUS
+    else:
+        kind = CHAT
+
+    is_english = kind != CHAT and _ENGLISH_PATTERN.search(text) is not None
+    return Intent(kind, is_english, frozenset(found))
+
+
+def classify_messages(messages):
+    """
+    Classify the latest turn of a chat history
+
+    Only a trailing user message can be a lights command or query.
+    """
+    if len(messages) == 0 or messages[-1].get('role') != 'user':
+        return Intent(CHAT, False, frozenset())
+    return classify(messages[-1].get('content', ''))
@@ -0,0 +1,171 @@
+"""
+Queue-based structured logging
+
+Log calls on the request path only build a small dict and put it on a queue;
+a background thread serializes the records as JSON lines and writes them in
+batches. Records below LOG_LEVEL cost one comparison, debug and info records
+can be sampled, and request payloads (messages, prompts, model output) are
+only logged when LOG_PAYLOADS is enabled, cut to LOG_PAYLOAD_MAX_CHARS.
+
+Usage:
+    log = get_logger("client")
+    log.debug("Fast path", actions=actions, confidence=0.9)
+    log.info("Received messages", count=len(messages), payload=messages)
+"""
+
+import atexit
+import json
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from config import LOG_LEVEL, LOG_SAMPLE_RATES, LOG_PAYLOADS, LOG_PAYLOAD_MAX_CHARS, LOG_QUEUE_SIZE
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+_LEVEL_NAMES = {value: name for name, value in LEVELS.items()}
+
+_BATCH_SIZE = 256
+
+
+class _Writer:
+    """Drains the record queue from a daemon thread"""
+
+    def __init__(self, stream, max_queue):
+        self.stream = stream
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, record):
+        if self._thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block a request on logging
+            self.dropped += 1
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            records = [self.queue.get()]
+            while len(records) < _BATCH_SIZE:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(records)
+
+    def _write(self, records):
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            records.append({"ts": time.time(), "level": WARNING, "logger": "jsonlog",
+                            "event": "Log records dropped, queue full", "fields": {"dropped": dropped}})
+        try:
+            self.stream.write("".join(_format(record) for record in records))
+            self.stream.flush()
+        except Exception:
+            pass
+
+    def flush(self):
+        """Write what is still queued, used at interpreter exit"""
+        records = []
+        while True:
+            try:
+                records.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if records:
+            self._write(records)
+
+
+def _format(record):
+    line = {
+        "ts": datetime.fromtimestamp(record["ts"], timezone.utc).isoformat(timespec="milliseconds"),
+        "level": _LEVEL_NAMES[record["level"]],
+        "logger": record["logger"],
+        "event": record["event"]
+    }
+    line.update(record["fields"])
+    return json.dumps(line, ensure_ascii=False, default=str) + "\n"
+
+
+def _bounded_payload(value):
+    """Serialize a payload now (it may change after the call) and cut it to size"""
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    if len(text) > LOG_PAYLOAD_MAX_CHARS:
+        return text[:LOG_PAYLOAD_MAX_CHARS] + f"...[{len(text) - LOG_PAYLOAD_MAX_CHARS} more chars]"
+    return text
+
+
+_writer = _Writer(sys.stdout, LOG_QUEUE_SIZE)
+
+
+class Logger:
+    """Named logger writing JSON lines through the shared background writer"""
+
+    def __init__(self, name):
+        self.name = name
+        self.level = LEVELS.get(LOG_LEVEL.lower(), INFO)
+
+    def is_enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, event, payload=None, sample=None, **fields):
+        """
+        Queue one record
+
+        Args:
+            level: DEBUG, INFO, WARNING or ERROR
+            event: Short human readable message
+            payload: Request or response content; only logged when
+                LOG_PAYLOADS is enabled, then cut to LOG_PAYLOAD_MAX_CHARS
+            sample: Fraction of these records to keep, defaults to the
+                LOG_SAMPLE_RATES entry of the level
+            fields: Structured context, serialized by the writer thread
+        """
+        if level < self.level:
+            return
+        rate = sample if sample is not None else LOG_SAMPLE_RATES.get(_LEVEL_NAMES[level], 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            return
+        if payload is not None and LOG_PAYLOADS:
+            fields["payload"] = _bounded_payload(payload)
+        _writer.submit({"ts": time.time(), "level": level, "logger": self.name, "event": event, "fields": fields})
+
+    def debug(self, event, **fields):
+        self.log(DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(ERROR, event, **fields)
+
+
+_loggers = {}
+
+
+def get_logger(name):
+    """Return the logger for a module name, e.g. service or client"""
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = _loggers.setdefault(name, Logger(name))
+    return logger
@@ -0,0 +1,155 @@
+"""
+In-process mirror of the home lights states
+
+Status questions used to call the lights API (/api/get_states) every time.
+The mirror keeps the last known states, is updated write-through whenever a
+control call succeeds, and is re-synced from the lights API periodically or
+when it is older than the allowed staleness.
+"""
+
+import threading
+import time
+
+
+def _apply(states, room, turn_on):
+    """
+    Set one room's lights in a states dictionary, keeping the value shape
+    the lights API uses: a plain boolean per room or an object with a
+    "lights" field
+    """
+    current = states.get(room)
+    if current is None:
+        current = next(iter(states.values()), None)
+        current = {} if isinstance(current, dict) else None
+    if isinstance(current, dict):
+        states[room] = {**current, "lights": bool(turn_on)}
+    else:
+        states[room] = bool(turn_on)
+
+
+class LightStateMirror:
+    """
+    Last known light state per room
+
+    The fetch callable must return the same dictionary shape as
+    client.get_home_lights_states(): {"success": bool, "states": {...}} or
+    {"success": False, "error": "..."}.
+    """
+
+    def __init__(self, fetch, max_age=10.0, refresh_interval=0):
+        """
+        Args:
+            fetch: Callable returning the lights API states result
+            max_age: Seconds since the last sync after which get() re-syncs
+            refresh_interval: Seconds between background syncs, 0 disables
+        """
+        self._fetch = fetch
+        self.max_age = max_age
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._states = None
+        # When the fetch of the snapshot in _states was started
+        self._synced_at = 0.0
+        # room -> (turn_on, monotonic time) of write-throughs not yet known
+        # to be in a snapshot
+        self._writes = {}
+        self._refresher = None
+        self._start_lock = threading.Lock()
+
+    def _start_refresher(self):
+        # Started on first use rather than at import, so the Flask reloader
+        # parent process does not poll the lights API as well
+        if self.refresh_interval <= 0 or self._refresher is not None:
+            return
+        with self._start_lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop, daemon=True)
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            self.refresh()
+
+    def refresh(self):
+        """
+        Re-sync the mirror from the lights API
+
+        Returns:
+            The fetch result
+        """
+        requested_at = time.monotonic()
+        result = self._fetch()
+        if result.get("success"):
+            with self._lock:
+                # A refresh started later has already been applied
+                if requested_at < self._synced_at:
+                    return result
+                states = dict(result["states"])
+                # Control calls that succeeded while the fetch was in flight
+                # are newer than the snapshot
+                self._writes = {room: write for room, write in self._writes.items() if write[1] > requested_at}
+                for room, (turn_on, _) in self._writes.items():
+                    _apply(states, room, turn_on)
+                self._states = states
+                self._synced_at = requested_at
+        return result
+
+    def update(self, room, turn_on):
+        """
+        Write-through after a successful control call
+
+        The write is also remembered with its time, so a refresh whose fetch
+        started before it cannot bring back the older state.
+        """
+        with self._lock:
+            self._writes[room] = (bool(turn_on), time.monotonic())
+            # Before the first sync there is nothing to update; the write is
+            # applied on top of the first snapshot if it is newer
+            if self._states is not None:
+                _apply(self._states, room, turn_on)
+
+    def rooms(self):
+        """
+        Returns:
+            Rooms known from the last sync, or None if nothing was synced yet
+        """
+        with self._lock:
+            return list(self._states) if self._states is not None else None
+
+    def get(self, max_age=None):
+        """
+        Return the light states, re-syncing if the mirror is too old
+
+        Args:
+            max_age: Override for the allowed staleness in seconds
+
+        Returns:
+            Dictionary with success, states, age (seconds since the last
+            sync) and source ("mirror" or "api"), or success False and error
+        """
+        self._start_refresher()
+        max_age = self.max_age if max_age is None else max_age
+
+        with self._lock:
+            age = time.monotonic() - self._synced_at
+            if self._states is not None and age <= max_age:
+                return {
+                    "success": True,
+                    "states": dict(self._states),
+                    "age": round(age, 3),
+                    "source": "mirror"
+                }
+
+        result = self.refresh()
+        if not result.get("success"):
+            return result
+        with self._lock:
+            # The snapshot plus any newer write-through
+            states = dict(self._states)
+        return {
+            "success": True,
+            "states": states,
+            "age": 0.0,
+            "source": "api"
+        }
@@ -0,0 +1,225 @@
+"""
+Deterministic parser for natural language lights commands
+
+Extracts the room and the on/off action from Turkish and English commands
+without calling the LLM, and scores how sure it is. Rooms are matched by stem
+so Turkish case suffixes ("salonun", "mutfaktaki", "yatak odasındaki") are
+understood. Commands parsed with high confidence can be executed directly;
+ambiguous text is left to the LLM extraction in client.py.
+"""
+
+import re
+from collections import namedtuple
+
+from intent_router import ROOM_ALIASES, ALL_ROOMS_WORDS
+
+DEFAULT_ROOM = 'living_room'
+
+ParsedCommand = namedtuple('ParsedCommand', ['room', 'turn_on', 'confidence', 'rooms', 'reasons'])
+ParsedActions = namedtuple('ParsedActions', ['actions', 'confidence', 'reasons'])
+
+# Apostrophes stay inside words, so "don't" and "wc'nin" are one token
+_TOKEN_PATTERN = re.compile(r"\w+(?:'\w+)*")
+
+# Stems matched against the start of each word
+_LIGHT_STEMS = ('ışık', 'ışığ', 'lamba', 'light', 'lamp')
+_ON_STEMS = ('aç', 'yak', 'aydınlat')
+_OFF_STEMS = ('kapat', 'söndür')
+# Words that start like a verb stem but are not commands
+_NOT_VERBS = ('açık', 'yakın', 'kapatıl')
+# Turkish negative imperative suffixes ("açma" = do not turn on)
+_NEGATIVE_SUFFIXES = ('ma', 'me', 'may', 'mey')
+_NEGATIONS = {'not', 'dont', 'never', 'cannot', 'değil'}
+_QUESTION_WORDS = {'mı', 'mi', 'mu', 'mü', 'is', 'are', 'which', 'hangi'}
+# Clause separators for commands with a different action per room
+_CLAUSE_PATTERN = re.compile(r"[,;]|\b(?:ve|sonra|ardından|and|then)\b")
+_ENGLISH_VERB_WORDS = {'turn', 'switch'}
+
+
+def _room_stems():
+    stems = []
+    for room, aliases in ROOM_ALIASES.items():
+        for alias in aliases:
+            stems.append((alias, room))
+    # Longest stems first so "sitting" wins over shorter overlaps
+    return sorted(stems, key=lambda item: len(item[0]), reverse=True)
+
+
+_ROOM_STEMS = _room_stems()
+
+
+def _tokens(text):
+    """Lowercased words of text, with typographic apostrophes made plain"""
+    return _TOKEN_PATTERN.findall(text.lower().replace('\u2019', "'"))
+
+
+def _match_room(token):
+    for stem, room in _ROOM_STEMS:
+        if token.startswith(stem):
+            return room
+    return None
+
+
+def _verb(token):
+    """Return True (on), False (off), None (no verb) and whether it is negated"""
+    if token.startswith(_NOT_VERBS):
+        return None, False
+    for stems, turn_on in ((_OFF_STEMS, False), (_ON_STEMS, True)):
+        for stem in stems:
+            if token.startswith(stem):
+                rest = token[len(stem):]
+                # "açma", "kapatmayın" are negative, but "açmanı" is not
+                negated = rest in _NEGATIVE_SUFFIXES or rest.startswith(('mayın', 'meyin'))
+                return turn_on, negated
+    return None, False
+
+
+def parse_lights_command(text):
+    """
+    Parse a lights command into a room and an action
+
+    Args:
+        text: Natural language command
+
+    Returns:
+        ParsedCommand(room, turn_on, confidence, rooms, reasons) where room
+        and turn_on fall back to living_room / on when not found, confidence
+        is between 0 and 1, rooms lists every room mentioned in order and
+        reasons explains any confidence penalty
+    """
+    lowered = text.lower()
+    tokens = _tokens(text)
+
+    rooms = []
+    actions = []
+    negated = False
+    has_light_word = False
+
+    for index, token in enumerate(tokens):
+        room = _match_room(token)
+        if room and room not in rooms:
+            rooms.append(room)
+
+        if token.startswith(_LIGHT_STEMS):
+            has_light_word = True
+
+        turn_on, is_negated = _verb(token)
+        if turn_on is not None:
+            actions.append(turn_on)
+            negated = negated or is_negated
+
+        # English: "turn on", "switch the lights off", "kitchen lights off"
+        if token in ('on', 'off'):
+            actions.append(token == 'on')
+        # "don't", "doesn't", "değil"
+        if token in _NEGATIONS or token.endswith("n't"):
+            negated = True
+
+    confidence = 1.0
+    reasons = []
+
+    if not rooms:
+        confidence *= 0.3
+        reasons.append("no room mentioned")
+    elif len(rooms) > 1:
+        confidence *= 0.4
+        reasons.append("several rooms mentioned")
+
+    distinct_actions = set(actions)
+    if not distinct_actions:
+        confidence *= 0.4
+        reasons.append("no on/off verb")
+    elif len(distinct_actions) > 1:
+        confidence *= 0.2
+        reasons.append("conflicting on/off verbs")
+
+    if negated:
+        confidence *= 0.3
+        reasons.append("negated command")
+
+    if '?' in lowered or _QUESTION_WORDS.intersection(tokens):
+        confidence *= 0.5
+        reasons.append("phrased as a question")
+
+    if not has_light_word:
+        confidence *= 0.8
+        reasons.append("no light word")
+
+    return ParsedCommand(
+        room=rooms[0] if rooms else DEFAULT_ROOM,
+        turn_on=actions[0] if len(distinct_actions) == 1 else True,
+        confidence=round(confidence, 3),
+        rooms=rooms,
+        reasons=reasons
+    )
+
+
+def parse_lights_actions(text, all_rooms=None):
+    """
+    Parse a lights command that may address several rooms
+
+    "turn off the kitchen, bedroom and toilet lights" gives one action per
+    room. When the text holds different verbs ("mutfağı aç, yatak odasını
+    kapat") it is split into clauses and each room takes the verb of its
+    clause; a clause without a verb borrows it from its neighbour (the next
+    clause for Turkish, where the verb comes last, the previous one for
+    English).
+
+    Args:
+        text: Natural language command
+        all_rooms: Rooms addressed by "all"/"tüm", defaults to every known room
+
+    Returns:
+        ParsedActions(actions, confidence, reasons) where actions is a list of
+        (room, turn_on) tuples in the order the rooms were mentioned
+    """
+    whole = parse_lights_command(text)
+    tokens = set(_tokens(text))
+    addresses_all = not tokens.isdisjoint(ALL_ROOMS_WORDS)
+
+    confidence = whole.confidence
+    reasons = list(whole.reasons)
+
+    # Several rooms are expected here, so drop that single-command penalty
+    if len(whole.rooms) > 1:
+        confidence /= 0.4
+        reasons.remove("several rooms mentioned")
+
+    if addresses_all and not whole.rooms:
+        confidence /= 0.3
+        reasons.remove("no room mentioned")
+        rooms = list(all_rooms or ROOM_ALIASES.keys())
+        return ParsedActions([(room, whole.turn_on) for room in rooms], round(min(confidence, 1.0), 3), reasons)
+
+    if "conflicting on/off verbs" not in reasons:
+        rooms = whole.rooms or [whole.room]
+        return ParsedActions([(room, whole.turn_on) for room in rooms], round(min(confidence, 1.0), 3), reasons)
+
+    # Different verbs: resolve the action clause by clause
+    confidence /= 0.2
+    reasons.remove("conflicting on/off verbs")
+    clauses = [parse_lights_command(clause) for clause in _CLAUSE_PATTERN.split(text.lower()) if clause and clause.strip()]
+    english = bool(_ENGLISH_VERB_WORDS.intersection(tokens))
+    step = -1 if english else 1
+
+    actions = []
+    for index, clause in enumerate(clauses):
+        if not clause.rooms:
+            continue
+        turn_on = None
+        position = index
+        while 0 <= position < len(clauses):
+            if "no on/off verb" not in clauses[position].reasons and \
+               "conflicting on/off verbs" not in clauses[position].reasons:
+                turn_on = clauses[position].turn_on
+                break
+            position += step
+        if turn_on is None:
+            confidence *= 0.4
+            reasons.append(f"no verb for {', '.join(clause.rooms)}")
+            turn_on = True
+        for room in clause.rooms:
+            if room not in [existing for existing, _ in actions]:
+                actions.append((room, turn_on))
+
+    return ParsedActions(actions or [(whole.room, whole.turn_on)], round(min(confidence, 1.0), 3), reasons)
@@ -0,0 +1,236 @@
+"""
+In-process metrics in the Prometheus text exposition format
+
+A small registry of counters, gauges and histograms with labels, rendered by
+the /metrics route. The metrics the service records are defined at the bottom
+of this module so every module updates the same instances.
+"""
+
+import bisect
+import threading
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}"
+        ]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing value per label set"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Gauge(_Metric):
+    """Value per label set that can go up and down"""
+
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=None):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets or DEFAULT_BUCKETS))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            entry["buckets"][index] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def _samples(self):
+        with self._lock:
+            values = {key: {"buckets": list(entry["buckets"]), "sum": entry["sum"], "count": entry["count"]}
+                      for key, entry in self._values.items()}
+        lines = []
+        for key, entry in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry["buckets"]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(entry['sum'])}")
+            lines.append(f"{self.name}_count{labels} {entry['count']}")
+        return lines
+
+
+class Registry:
+    """Metrics rendered together by /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Return the text exposition format (version 0.0.4) of every metric"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'http_request_duration_seconds',
+    'Time from request to the last byte of the response, by route',
+    ('route', 'method', 'status')
+))
+HTTP_STREAMS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'http_streams_in_flight',
+    'SSE and NDJSON responses currently being streamed, by route',
+    ('route',)
+))
+UPSTREAM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'upstream_request_duration_seconds',
+    'Time until an upstream call returned its response headers',
+    ('upstream', 'method')
+))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    'upstream_errors_total',
+    'Failed or refused upstream calls by kind (connection, timeout, deadline, circuit_open, http_5xx, error)',
+    ('upstream', 'kind')
+))
+OLLAMA_TTFT_SECONDS = REGISTRY.register(Histogram(
+    'ollama_time_to_first_token_seconds',
+    'Model load plus prompt evaluation time reported by Ollama',
+    ('model',),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+))
+OLLAMA_TOKENS_PER_SECOND = REGISTRY.register(Histogram(
+    'ollama_tokens_per_second',
+    'Generation speed reported by Ollama (eval_count / eval_duration)',
+    ('model',),
+    buckets=(1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 100, 150, 200)
+))
+OLLAMA_TOKENS = REGISTRY.register(Counter(
+    'ollama_tokens_total',
+    'Prompt and completion tokens processed by Ollama',
+    ('model', 'kind')
+))
+OLLAMA_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'ollama_queue_depth',
+    'Generations waiting in the admission queue, by model and priority class',
+    ('model', 'priority')
+))
+UPSTREAM_CIRCUIT_OPEN = REGISTRY.register(Gauge(
+    'upstream_circuit_open',
+    '1 while the upstream circuit breaker refuses calls',
+    ('upstream',)
+))
+CHAT_CONTEXT_TOKENS_TRIMMED = REGISTRY.register(Counter(
+    'chat_context_tokens_trimmed_total',
+    'Estimated prompt tokens of chat turns left out to fit the model budget',
+    ('model',)
+))
+
+
+def observe_ollama_generation(frame, model=None):
+    """
+    Record time to first token, tokens per second and token counts from the
+    final frame of an Ollama generation (or a non-streaming result)
+
+    Frames that are not final ("done": false) are ignored. The model label
+    is taken from the request, or from the frame when it is not given.
+    """
+    if not isinstance(frame, dict) or not frame.get('done'):
+        return
+    model = model or frame.get('model') or 'unknown'
+    eval_count = frame.get('eval_count') or 0
+    eval_duration = frame.get('eval_duration') or 0
+    prompt_eval_duration = frame.get('prompt_eval_duration') or 0
+    load_duration = frame.get('load_duration') or 0
+
+    if eval_count and eval_duration:
+        OLLAMA_TOKENS_PER_SECOND.observe(eval_count / (eval_duration / 1e9), model=model)
+    if prompt_eval_duration or load_duration:
+        OLLAMA_TTFT_SECONDS.observe((load_duration + prompt_eval_duration) / 1e9, model=model)
+    OLLAMA_TOKENS.inc(frame.get('prompt_eval_count') or 0, model=model, kind='prompt')
+    OLLAMA_TOKENS.inc(eval_count, model=model, kind='completion')
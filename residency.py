@@ -0,0 +1,193 @@
+"""
+Model residency manager for Ollama
+
+Ollama unloads a model after it has been idle for its keep_alive duration, and
+the next request pays the full load. The manager preloads a configured set of
+models when the service starts, adds a per-model keep_alive to the requests
+sent to Ollama, and polls /api/ps from a background thread to report which
+models are loaded and how long their loads took.
+"""
+
+import threading
+import time
+
+from jsonlog import get_logger
+
+log = get_logger("residency")
+
+
+def model_key(name):
+    """Ollama reports "mistral" as "mistral:latest", compare names with the tag"""
+    return name if ':' in name else f"{name}:latest"
+
+
+class ModelResidency:
+    """
+    Preloading, keep_alive policy and residency state per model
+    """
+
+    def __init__(self, list_loaded, load, policies=None, default_keep_alive=None, preload=(), interval=30.0):
+        """
+        Args:
+            list_loaded: Callable returning the /api/ps "models" list
+            load: Callable (model, keep_alive) loading a model, returning a
+                dict with success, ms, load_ms and error
+            policies: Dictionary of model name -> keep_alive sent with its
+                requests (Ollama duration string or seconds, -1 keeps it
+                loaded until Ollama restarts)
+            default_keep_alive: keep_alive for models without a policy, None
+                leaves Ollama's default
+            preload: Model names loaded when the manager starts
+            interval: Seconds between two /api/ps polls
+        """
+        self._list_loaded = list_loaded
+        self._load = load
+        self.policies = {model_key(name): value for name, value in (policies or {}).items()}
+        self.default_keep_alive = default_keep_alive
+        self.preload = [model_key(name) for name in preload]
+        self.interval = interval
+        self._loaded = {}
+        self._loads = {}
+        self._checked_at = None
+        self._error = None
+        self._lock = threading.Lock()
+        self._monitor = None
+        self._start_lock = threading.Lock()
+
+    def keep_alive(self, model):
+        """Return the keep_alive policy for a model, None for Ollama's default"""
+        return self.policies.get(model_key(model), self.default_keep_alive)
+
+    def apply(self, payload):
+        """
+        Add the model's keep_alive to an Ollama request payload
+
+        A keep_alive already present in the payload is left unchanged.
+
+        Returns:
+            The same payload dictionary
+        """
+        self.start()
+        keep_alive = self.keep_alive(payload.get("model", ""))
+        if keep_alive is not None and "keep_alive" not in payload:
+            payload["keep_alive"] = keep_alive
+        return payload
+
+    def start(self):
+        """Preload the configured models and start polling, once"""
+        if self._monitor is not None:
+            return
+        with self._start_lock:
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+                self._monitor.start()
+
+    def _monitor_loop(self):
+        for model in self.preload:
+            result = self.load(model)
+            if result["success"]:
+                log.info("Preloaded model", model=model, ms=result["ms"])
+            else:
+                log.warning("Preloading model failed", model=model, error=result["error"])
+        while True:
+            self.refresh()
+            time.sleep(self.interval)
+
+    def load(self, model, keep_alive=None):
+        """
+        Load a model now and record how long the load took
+
+        Args:
+            model: Model name
+            keep_alive: Overrides the model's policy for this load
+        """
+        if keep_alive is None:
+            keep_alive = self.keep_alive(model)
+        result = self._load(model, keep_alive)
+        if result["success"]:
+            self.observe(model, result.get("load_ms"))
+        return result
+
+    def observe(self, model, load_ms):
+        """
+        Record a load Ollama reported for a request (load_duration)
+
+        Args:
+            model: Model name
+            load_ms: Load time in ms; 0 or None means the model was resident
+        """
+        if not load_ms:
+            return
+        key = model_key(model)
+        with self._lock:
+            loads = self._loads.setdefault(key, {"loads": 0, "total_ms": 0.0, "last_load_ms": None, "last_loaded_at": None})
+            loads["loads"] += 1
+            loads["total_ms"] += load_ms
+            loads["last_load_ms"] = load_ms
+            loads["last_loaded_at"] = time.time()
+
+    def refresh(self):
+        """Poll /api/ps and replace the loaded model state"""
+        try:
+            models = self._list_loaded()
+            loaded = {
+                model_key(entry.get("name") or entry.get("model", "")): {
+                    "size": entry.get("size"),
+                    "size_vram": entry.get("size_vram"),
+                    "expires_at": entry.get("expires_at")
+                }
+                for entry in models
+            }
+            error = None
+        except Exception as e:
+            loaded = None
+            error = str(e)
+        with self._lock:
+            if loaded is not None:
+                self._loaded = loaded
+            self._checked_at = time.time()
+            self._error = error
+
+    def is_loaded(self, model):
+        """Whether the last /api/ps poll listed the model as loaded"""
+        with self._lock:
+            return model_key(model) in self._loaded
+
+    def snapshot(self):
+        """
+        Returns:
+            Dictionary with checked_at, error (of the last poll), interval and
+            models: loaded flag, keep_alive, preload flag, /api/ps details
+            and load times for every model that is loaded, preloaded, has a
+            policy or was seen loading
+        """
+        self.start()
+        with self._lock:
+            loaded = {name: dict(entry) for name, entry in self._loaded.items()}
+            loads = {name: dict(entry) for name, entry in self._loads.items()}
+            checked_at = self._checked_at
+            error = self._error
+
+        names = sorted(set(loaded) | set(loads) | set(self.policies) | set(self.preload))
+        models = {}
+        for name in names:
+            entry = loaded.get(name, {})
+            stats = loads.get(name, {"loads": 0, "total_ms": 0.0, "last_load_ms": None, "last_loaded_at": None})
+            models[name] = {
+                "loaded": name in loaded,
+                "keep_alive": self.keep_alive(name),
+                "preload": name in self.preload,
+                "size": entry.get("size"),
+                "size_vram": entry.get("size_vram"),
+                "expires_at": entry.get("expires_at"),
+                "loads": stats["loads"],
+                "last_load_ms": stats["last_load_ms"],
+                "avg_load_ms": round(stats["total_ms"] / stats["loads"], 3) if stats["loads"] else None,
+                "last_loaded_at": stats["last_loaded_at"]
+            }
+        return {
+            "checked_at": checked_at,
+            "error": error,
+            "interval": self.interval,
+            "models": models
+        }
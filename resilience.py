@@ -0,0 +1,258 @@
+"""
+Circuit breakers and deadline budgets for upstream calls
+
+A circuit breaker per upstream stops sending requests to a service that keeps
+failing and lets a single trial call through after a cool-down. A deadline
+budget bounds the total time a request may spend on upstream calls: chained
+flows (extract then predict, classify then explain) share one budget, and
+every call's timeout is capped to what is left of it.
+
+Both raise UpstreamUnavailable, a requests.RequestException, so the existing
+connection error handling applies and routes can answer 503 right away.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+from jsonlog import get_logger
+
+log = get_logger("resilience")
+
+
+class UpstreamUnavailable(requests.exceptions.RequestException):
+    """An upstream call was refused before it was sent"""
+
+    def __init__(self, message, upstream=None, retry_after=None):
+        super().__init__(message)
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    """The upstream's circuit breaker is open"""
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    """The request's deadline budget is used up"""
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open circuit breaker for one upstream
+
+    - closed: calls pass, failure_threshold consecutive failures open it
+    - open: calls are refused for reset_timeout seconds
+    - half-open: one trial call passes; success closes the circuit, failure
+      opens it again
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        """
+        Args:
+            name: Upstream name used in error messages
+            failure_threshold: Consecutive failures that open the circuit,
+                0 disables the breaker
+            reset_timeout: Seconds the circuit stays open before a trial call
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started_at = None
+        self.rejected = 0
+
+    def _retry_after(self):
+        return max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+
+    def before_call(self):
+        """
+        Admit or refuse a call
+
+        Raises:
+            CircuitOpenError: While the circuit is open, or half-open with a
+                trial call already in flight
+        """
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            now = time.monotonic()
+            if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+                self._trial_started_at = None
+            # A trial that never reported back does not block the circuit forever
+            if self._state == HALF_OPEN and (
+                    self._trial_started_at is None or now - self._trial_started_at >= self.reset_timeout):
+                self._trial_started_at = now
+                return
+            self.rejected += 1
+            retry_after = self._retry_after() if self._state == OPEN else self.reset_timeout
+        raise self._open_error(retry_after)
+
+    def check(self):
+        """
+        Raise like before_call() would, without claiming the half-open trial
+
+        For routes that refuse up front but make the call later, from their
+        response generator; that call still goes through before_call().
+
+        Raises:
+            CircuitOpenError: While the circuit is open, or half-open with a
+                trial call already in flight
+        """
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            now = time.monotonic()
+            if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+                return
+            if self._state == HALF_OPEN and (
+                    self._trial_started_at is None or now - self._trial_started_at >= self.reset_timeout):
+                return
+            self.rejected += 1
+            retry_after = self._retry_after() if self._state == OPEN else self.reset_timeout
+        raise self._open_error(retry_after)
+
+    def _open_error(self, retry_after):
+        return CircuitOpenError(
+            f"{self.name} service is unavailable (circuit open)",
+            upstream=self.name,
+            retry_after=retry_after
+        )
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold > 0:
+                if self._state != OPEN:
+                    log.warning("Circuit opened", upstream=self.name, failures=self._failures)
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial_started_at = None
+
+    def stats(self):
+        with self._lock:
+            state = self._state
+            if state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                state = HALF_OPEN
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+                "retry_after": round(self._retry_after(), 3) if state == OPEN else 0.0,
+                "rejected": self.rejected
+            }
+
+
+_deadline = contextvars.ContextVar('upstream_deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Run a block with a time budget for its upstream calls
+
+    Budgets nest: an inner budget caps one stage of a chained flow but can
+    never extend the outer one. None leaves the current budget unchanged.
+    """
+    if seconds is None:
+        yield
+        return
+    expires_at = time.monotonic() + seconds
+    outer = _deadline.get()
+    if outer is not None:
+        expires_at = min(expires_at, outer)
+    token = _deadline.set(expires_at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def current_deadline():
+    """
+    Monotonic time the current budget runs out, None when no budget is set
+
+    A response generator runs after its view (and the view's deadline block)
+    has returned; pass this to deadline_at() inside the generator to keep
+    the view's budget.
+    """
+    return _deadline.get()
+
+
+@contextmanager
+def deadline_at(expires_at):
+    """Run a block with a budget ending at a time from current_deadline()"""
+    if expires_at is None:
+        yield
+        return
+    outer = _deadline.get()
+    if outer is not None:
+        expires_at = min(expires_at, outer)
+    token = _deadline.set(expires_at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left in the current budget, None when no budget is set"""
+    expires_at = _deadline.get()
+    if expires_at is None:
+        return None
+    return expires_at - time.monotonic()
+
+
+def apply_deadline(timeout, upstream=None):
+    """
+    Cap a requests timeout to the current budget
+
+    Args:
+        timeout: None, seconds, or a (connect, read) tuple
+        upstream: Upstream name used in the error
+
+    Returns:
+        Tuple of (timeout, capped) where capped tells whether the budget,
+        not the configured timeout, is the limit
+
+    Raises:
+        DeadlineExceeded: When the budget is already used up
+    """
+    left = remaining()
+    if left is None:
+        return timeout, False
+    if left <= 0:
+        raise DeadlineExceeded(
+            f"Request deadline exceeded before calling {upstream or 'upstream'} service",
+            upstream=upstream
+        )
+    if timeout is None:
+        return left, True
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        capped = (min(connect, left), min(read, left))
+        return capped, capped != timeout
+    return min(timeout, left), left < timeout
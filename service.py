@@ -1,306 +1,1047 @@
-from flask import Flask, request, jsonify, Response, stream_with_context, send_from_directory
+from flask import Flask, request, jsonify, Response, stream_with_context, send_from_directory, after_this_request, g
 import requests
 import os
 from flask_cors import CORS
 import json
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from config import (
     OLLAMA_API_HOST, HOST, PORT, DEBUG, DEFAULT_MODEL, CORS_ORIGINS, 
     REGRESSION_API_HOST, REGRESSION_PREDICT_ENDPOINT,
     IMAGE_API_HOST, IMAGE_PREDICT_ENDPOINT,
-    LIGHTS_API_HOST, LIGHTS_API_ENDPOINT
+    LIGHTS_API_HOST, LIGHTS_API_ENDPOINT,
+    IMAGE_EXPLANATION_SSE_FRAMING, MODELS_CACHE_TTL, MODELS_CACHE_STALE_TTL,
+    UPSTREAM_POOLS, RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL,
+    REGRESSION_BATCH_CHUNK_SIZE, REGRESSION_BATCH_MAX_PARALLEL, REQUEST_DEADLINES,
+    IMAGE_UPLOAD_MAX_BYTES, IMAGE_UPLOAD_FORM_OVERHEAD, IMAGE_UPLOAD_SPOOL_THRESHOLD,
+    IMAGE_UPLOAD_ALLOWED_TYPES, IMAGE_CACHE_ENABLED, IMAGE_CACHE_MAX_ENTRIES, IMAGE_CACHE_TTL,
+    IMAGE_PREPROCESS, IMAGE_PREPROCESS_WORKERS,
+    IMAGE_EXPLANATION_PRELOAD, REQUEST_COALESCING_ENABLED,
+    CONTEXT_WINDOW_ENABLED, CONTEXT_TOKEN_BUDGET_DEFAULT, CONTEXT_TOKEN_BUDGETS, CONTEXT_SUMMARY_ENABLED,
+    CONTEXT_SUMMARY_TOKENS, CONTEXT_SUMMARY_CACHE_MAX_ENTRIES, CONTEXT_SUMMARY_CACHE_TTL,
+    SESSION_MAX_SESSIONS, SESSION_MAX_MESSAGES, SESSION_TTL, SESSION_SPILL_DIR
 )
+import sse
+import metrics
+from batch import InvalidRecord, iter_records, iter_chunks, ordered_map
+from cache import ModelListCache, LRUCache, is_deterministic, response_cache_key
+from coalesce import RequestCoalescer, StreamCoalescer, AsyncStreamCoalescer
+from context_window import ContextWindow
+from sessions import SessionStore, SessionError
+import intent_router
+from intent_router import classify_messages
+from resilience import UpstreamUnavailable, deadline, current_deadline, deadline_at
+from upstream import ollama_http, regression_http, image_http, ollama_admission, SESSIONS
+from admission import AdmittedResponse, CHAT, BATCH
+from uploads import UploadRequest, MultipartFileBody, file_size, file_sha256
+from image_preprocess import ImagePreprocessor
+from werkzeug.exceptions import RequestEntityTooLarge
+from jsonlog import get_logger
+
+UploadRequest.spool_threshold = IMAGE_UPLOAD_SPOOL_THRESHOLD
+
+log = get_logger("service")
 
 app = Flask(__name__, static_folder='static')
+app.request_class = UploadRequest
 CORS(app, origins=CORS_ORIGINS)
 
+_STREAM_MIMETYPES = ('text/event-stream', 'application/x-ndjson')
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_request_metrics(response):
+    """Observe the request latency once the last byte has been sent"""
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    labels = {
+        "route": request.url_rule.rule if request.url_rule else "unmatched",
+        "method": request.method,
+        "status": str(response.status_code)
+    }
+    streaming = response.mimetype in _STREAM_MIMETYPES
+    if streaming:
+        metrics.HTTP_STREAMS_IN_FLIGHT.inc(route=labels["route"])
+    
+    def finished():
+        if streaming:
+            metrics.HTTP_STREAMS_IN_FLIGHT.dec(route=labels["route"])
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, **labels)
+    
+    response.call_on_close(finished)
+    return response
+
+def with_deadline(name):
+    """Run a route with the REQUEST_DEADLINES budget for its upstream calls"""
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with deadline(REQUEST_DEADLINES.get(name)):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def _unavailable_response(e):
+    """
+    503 for a call refused by a circuit breaker or an exhausted deadline,
+    429 when the model's admission queue is full
+    """
+    response = jsonify({
+        "success": False,
+        "error": str(e),
+        "upstream": e.upstream
+    })
+    response.status_code = getattr(e, 'status_code', 503)
+    if e.retry_after:
+        response.headers['Retry-After'] = str(max(int(round(e.retry_after)), 1))
+    return response
+
 @app.route('/')
 def index():
     return send_from_directory('static', 'index.html')
 
+def _fetch_model_list():
+    response = ollama_http.get(f"{OLLAMA_API_HOST}/api/tags")
+    response.raise_for_status()
+    return response.json()
+
+model_list_cache = ModelListCache(_fetch_model_list, ttl=MODELS_CACHE_TTL, stale_ttl=MODELS_CACHE_STALE_TTL)
+response_cache = LRUCache(max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL)
+# Classifier results keyed by the SHA-256 of the image bytes
+image_cache = LRUCache(max_entries=IMAGE_CACHE_MAX_ENTRIES, ttl=IMAGE_CACHE_TTL)
+# Optional downscaling before uploads are forwarded to the image API
+image_preprocessor = ImagePreprocessor(IMAGE_PREPROCESS.get('image'), workers=IMAGE_PREPROCESS_WORKERS)
+
+# Explanation model preloads run here while the classifier is called
+_preload_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-preload")
+_preloads = {}
+_preloads_lock = threading.Lock()
+
+def _preload_model(model):
+    """
+    Start loading a model into Ollama in the background
+    
+    Concurrent requests for the same model share one preload. The model
+    stays loaded for its MODEL_KEEP_ALIVE policy.
+    
+    Returns:
+        Future with the preload_ollama_model result, or None when disabled
+    """
+    from client import model_residency
+    
+    if not IMAGE_EXPLANATION_PRELOAD:
+        return None
+    with _preloads_lock:
+        future = _preloads.get(model)
+        if future is None or future.done():
+            future = _preload_pool.submit(model_residency.load, model)
+            _preloads[model] = future
+        return future
+
 @app.route('/api/models', methods=['GET'])
 def get_models():
     try:
-        response = requests.get(f"{OLLAMA_API_HOST}/api/tags")
-        return jsonify(response.json())
+        models, etag = model_list_cache.get()
+        
+        # Let the browser revalidate its copy instead of downloading it again
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify(models)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/models/pull', methods=['POST'])
+def pull_model():
+    """
+    Pull a model through Ollama and invalidate the cached model list
+    
+    Expects JSON:
+    {
+        "model": "llama3.2:latest",
+        "stream": false (optional, true streams Ollama progress as SSE)
+    }
+    """
+    try:
+        data = request.json or {}
+        if not (data.get('model') or data.get('name')):
+            return jsonify({"error": "Model parameter is required"}), 400
+        
+        if data.get('stream', False):
+            def generate():
+                try:
+                    response = ollama_http.post(
+                        f"{OLLAMA_API_HOST}/api/pull",
+                        json={**data, "stream": True},
+                        stream=True,
+                        timeout=(UPSTREAM_POOLS['ollama']['timeout'][0], None)
+                    )
+                    for line in response.iter_lines():
+                        if line:
+                            yield f"data: {line.decode('utf-8')}\n\n"
+                finally:
+                    model_list_cache.invalidate()
+            
+            return Response(stream_with_context(generate()), content_type='text/event-stream')
+        
+        # Downloads can take far longer than the default read timeout
+        response = ollama_http.post(
+            f"{OLLAMA_API_HOST}/api/pull",
+            json={**data, "stream": False},
+            timeout=(UPSTREAM_POOLS['ollama']['timeout'][0], None)
+        )
+        model_list_cache.invalidate()
+        return jsonify(response.json()), response.status_code
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/models/delete', methods=['DELETE', 'POST'])
+def delete_model():
+    """
+    Delete a model through Ollama and invalidate the cached model list
+    
+    Expects JSON:
+    {
+        "model": "llama3.2:latest"
+    }
+    """
+    try:
+        data = request.json or {}
+        if not (data.get('model') or data.get('name')):
+            return jsonify({"error": "Model parameter is required"}), 400
+        
+        response = ollama_http.delete(f"{OLLAMA_API_HOST}/api/delete", json=data)
+        model_list_cache.invalidate()
+        
+        if response.status_code == 200:
+            return jsonify({
+                "success": True,
+                "model": data.get('model') or data.get('name')
+            })
+        else:
+            return jsonify({
+                "success": False,
+                "error": f"Ollama API Error: {response.status_code}",
+                "details": response.text
+            }), response.status_code
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/models/residency', methods=['GET'])
+def model_residency_status():
+    """
+    Which models Ollama holds in memory, their keep_alive policy and load times
+    
+    Served from the residency manager's last /api/ps poll. Send
+    ?refresh=1 to poll Ollama now.
+    """
+    from client import model_residency
+    
+    if request.args.get('refresh') == '1':
+        model_residency.refresh()
+    return jsonify(model_residency.snapshot())
+
+def lookup_cached_response(kind, model, body, options):
+    """
+    Look up a deterministic generation in the response cache
+    
+    Returns:
+        Tuple of (cache key or None when the request is not cacheable, cached value or None)
+    """
+    if not RESPONSE_CACHE_ENABLED or not is_deterministic(options):
+        return None, None
+    cache_key = response_cache_key(kind, model, body, options)
+    return cache_key, response_cache.get(cache_key)
+
+# Identical generations in flight at the same time share one Ollama call
+request_coalescer = RequestCoalescer()
+stream_coalescer = StreamCoalescer()
+# Used by the streaming routes of async_service.py
+async_stream_coalescer = AsyncStreamCoalescer()
+
+def _summarize_conversation(model, previous_summary, messages):
+    from client import summarize_conversation
+    return summarize_conversation(model, previous_summary, messages)
+
+# Chat history sent to Ollama is cut to the model's token budget
+context_window = ContextWindow(
+    budgets=CONTEXT_TOKEN_BUDGETS,
+    default_budget=CONTEXT_TOKEN_BUDGET_DEFAULT,
+    summarize=_summarize_conversation if CONTEXT_SUMMARY_ENABLED else None,
+    summary_cache=LRUCache(max_entries=CONTEXT_SUMMARY_CACHE_MAX_ENTRIES, ttl=CONTEXT_SUMMARY_CACHE_TTL),
+    summary_tokens=CONTEXT_SUMMARY_TOKENS,
+    enabled=CONTEXT_WINDOW_ENABLED
+)
+
+def fit_context(model, messages):
+    """Trim chat messages to the model's token budget, see context_window.py"""
+    fitted, info = context_window.fit(model, messages)
+    if info["messages_trimmed"]:
+        log.debug("Trimmed chat history", model=model, **info)
+    return fitted
+
+# Chat histories kept server side, so clients only send the new turn
+chat_sessions = SessionStore(
+    max_sessions=SESSION_MAX_SESSIONS,
+    max_messages=SESSION_MAX_MESSAGES,
+    ttl=SESSION_TTL,
+    spill_dir=SESSION_SPILL_DIR
+)
+
+def session_messages(data):
+    """
+    Chat messages of a request and its session id
+    
+    Without a session_id the posted messages are used as before. With one, a
+    posted messages list starts (or restarts) the session with that history,
+    otherwise the new message is added to the stored history.
+    
+    Returns:
+        Tuple of (messages, session_id or None)
+        
+    Raises:
+        SessionError: Malformed id or request (400), unknown session (404)
+    """
+    session_id = data.get('session_id')
+    if session_id is None:
+        return data.get('messages', []), None
+    if 'messages' in data:
+        return chat_sessions.replace(session_id, data['messages']), session_id
+    message = data.get('message')
+    if not isinstance(message, dict) or not message.get('content'):
+        raise SessionError("Send the new turn as message, or the whole conversation as messages")
+    return chat_sessions.append(session_id, message), session_id
+
+def session_frames(frames, session_id):
+    """Pass SSE frames through, then store the reply of a completed stream in the session"""
+    lines = []
+    for frame in frames:
+        lines.append(frame[len('data: '):])
+        yield frame
+    chat_sessions.record_reply(session_id, lines)
+
+def _session_reply(session_id, message):
+    """Add the assistant message of a non-streaming reply to the session"""
+    if session_id and isinstance(message, dict) and message.get('content'):
+        chat_sessions.append(session_id, message, create=True)
+
+def _session_response(response, session_id):
+    if session_id:
+        response.headers['X-Session-Id'] = session_id
+    return response
+
+def _session_error_response(e):
+    """400 for a malformed session request, 404 when the session is gone"""
+    return jsonify({"success": False, "error": str(e), "session_expired": e.status_code == 404}), e.status_code
+
+def request_coalesce_key(kind, model, body, options):
+    """Key identifying identical generations, None when coalescing is disabled"""
+    if not REQUEST_COALESCING_ENABLED:
+        return None
+    return response_cache_key(kind, model, body, options)
+
+def _coalesced_call(coalesce_key, call):
+    """
+    Run a non-streaming Ollama call, shared with identical in-flight requests
+    
+    Returns:
+        Tuple of (result of call, shared)
+    """
+    if coalesce_key is None:
+        return call(), False
+    return request_coalescer.do(coalesce_key, call)
+
+def _coalesced_stream(path, payload, coalesce_key, cache_key=None, priority=CHAT):
+    """
+    Start an Ollama NDJSON stream, or attach to an identical one in flight
+    
+    Returns:
+        Tuple of (SSE frame generator, shared, close) where close ends the
+        upstream stream, or leaves the shared one; see _upstream_sse_response
+    """
+    if coalesce_key is None:
+        response = _open_ollama_stream(path, payload, priority)
+        return _stream_ollama(response, cache_key, payload["model"]), False, response.close
+    
+    def complete(lines):
+        final = _final_frame(lines[-1]) if lines else None
+        _observe_generation(final, payload["model"])
+        if cache_key and final is not None and final.get('done'):
+            response_cache.set(cache_key, [line.decode('utf-8') for line in lines])
+    
+    lines, shared = stream_coalescer.subscribe(
+        coalesce_key,
+        lambda: _open_ollama_stream(path, payload, priority),
+        on_complete=complete
+    )
+    return _shared_frames(lines), shared, lines.close
+
+def _shared_frames(lines):
+    """SSE frames for the lines of a shared stream, leaving it when the client goes away"""
+    try:
+        for line in lines:
+            yield f"data: {line.decode('utf-8')}\n\n"
+    finally:
+        lines.close()
+
+def _mark_coalesced(response, shared):
+    """Tell the client its response came from another request's upstream call"""
+    if shared:
+        response.headers['X-Coalesced'] = 'true'
+    return response
+
+def _keep_alive(payload):
+    """Add the model's keep_alive policy (MODEL_KEEP_ALIVE in config.py) to an Ollama payload"""
+    from client import model_residency
+    return model_residency.apply(payload)
+
+def _final_frame(line):
+    """Decode the last NDJSON line of an Ollama stream, None if it is not JSON"""
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+def _observe_generation(frame, model):
+    """
+    Record the model load, time to first token and token rate Ollama reports
+    in a non-streaming result or the final frame of a stream
+    """
+    from client import model_residency
+    if not isinstance(frame, dict):
+        return
+    metrics.observe_ollama_generation(frame, model)
+    if frame.get('load_duration'):
+        model_residency.observe(model, round(frame['load_duration'] / 1e6, 3))
+
+def _request_priority(data):
+    """Admission class of a generate or chat request; clients may only lower it to batch"""
+    return BATCH if data.get('priority') == BATCH else CHAT
+
+def _open_ollama_stream(path, payload, priority=CHAT, slot=None):
+    """
+    Start an Ollama NDJSON stream
+    
+    Called in the view rather than in the response generator, so an open
+    circuit, an exhausted deadline or a full admission queue is answered
+    before any frame has been sent. The returned response holds the model's
+    admission slot until it is read to the end or closed.
+    
+    A route that has to send frames before the stream is opened takes the
+    slot in its view and passes it in.
+    """
+    if slot is None:
+        slot = ollama_admission.acquire(payload["model"], priority)
+    try:
+        response = ollama_http.post(
+            f"{OLLAMA_API_HOST}{path}",
+            json=payload,
+            stream=True
+        )
+    except BaseException:
+        slot.release()
+        raise
+    return AdmittedResponse(response, slot)
+
+def _stream_ollama(response, cache_key=None, model=None):
+    """
+    Yield SSE frames for an Ollama NDJSON stream
+    
+    When a cache key is given, the lines of a stream that completes with
+    "done": true are stored so the same request can be replayed later.
+    """
+    lines = [] if cache_key and response.ok else None
+    last = None
+    try:
+        for line in response.iter_lines():
+            if line:
+                decoded = line.decode('utf-8')
+                last = decoded
+                if lines is not None:
+                    lines.append(decoded)
+                yield f"data: {decoded}\n\n"
+    finally:
+        response.close()
+    
+    final = _final_frame(last) if last else None
+    _observe_generation(final, model)
+    if lines and final is not None and final.get('done'):
+        response_cache.set(cache_key, lines)
+
+def _replay_stream(lines):
+    """Yield cached NDJSON lines in the same SSE framing as a live stream"""
+    for line in lines:
+        yield f"data: {line}\n\n"
+
+def _sse_response(frames, cache_status=None):
+    response = Response(stream_with_context(frames), content_type='text/event-stream')
+    if cache_status:
+        response.headers['X-Cache'] = cache_status
+    return response
+
+def _upstream_sse_response(frames, close, cache_status=None):
+    """
+    SSE response for frames read from Ollama with an admission slot taken
+    in the view
+    
+    The frame generator frees the slot only once it has started, so close
+    also runs when the response is closed, for clients that went away before
+    the first frame.
+    """
+    try:
+        response = _sse_response(frames, cache_status)
+        response.call_on_close(close)
+    except BaseException:
+        close()
+        raise
+    return response
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    """
+    Aggregated health of the upstream services
+    
+    Served from the background health monitor, no upstream is probed here.
+    
+    Returns:
+        JSON with healthy, the last probe result per upstream and the
+        circuit breaker states, status 503 if any upstream is down
+    """
+    from client import health_monitor
+    
+    snapshot = health_monitor.snapshot()
+    snapshot["circuits"] = {name: session.breaker.stats() for name, session in SESSIONS.items()}
+    return jsonify(snapshot), 200 if snapshot["healthy"] else 503
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters for the in-process caches"""
+    from client import extraction_cache
+    
+    return jsonify({
+        "responses": response_cache.stats(),
+        "images": image_cache.stats(),
+        "regression_extraction": extraction_cache.stats(),
+        "coalesced": {
+            "requests": request_coalescer.stats(),
+            "streams": stream_coalescer.stats(),
+            "async_streams": async_stream_coalescer.stats()
+        }
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text format: route and upstream latencies, streams, Ollama token rates"""
+    for model, stats in ollama_admission.stats()["models"].items():
+        for priority, depth in stats["queued"].items():
+            metrics.OLLAMA_QUEUE_DEPTH.set(depth, model=model, priority=priority)
+    for name, session in SESSIONS.items():
+        metrics.UPSTREAM_CIRCUIT_OPEN.set(1 if session.breaker.stats()["state"] == 'open' else 0, upstream=name)
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/sessions/stats', methods=['GET'])
+def session_stats():
+    """Chat sessions in memory, evictions and disk spills"""
+    return jsonify(chat_sessions.stats())
+
+@app.route('/api/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    """Stored history of a chat session"""
+    try:
+        return jsonify({"session_id": session_id, "messages": chat_sessions.history(session_id)})
+    except SessionError as e:
+        return _session_error_response(e)
+
+@app.route('/api/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """Forget a chat session, e.g. when the user starts a new chat"""
+    try:
+        return jsonify({"success": True, "deleted": chat_sessions.delete(session_id)})
+    except SessionError as e:
+        return _session_error_response(e)
+
+@app.route('/api/context/stats', methods=['GET'])
+def context_stats():
+    """Token budgets, tokens trimmed from chat histories and summary usage"""
+    return jsonify(context_window.stats())
+
+@app.route('/api/queue/stats', methods=['GET'])
+def queue_stats():
+    """Admission queue depth, rejections and wait times per Ollama model"""
+    return jsonify(ollama_admission.stats())
+
+@app.route('/api/image/preprocess/stats', methods=['GET'])
+def image_preprocess_stats():
+    """Counters for the optional image downscaling stage"""
+    return jsonify(image_preprocessor.stats())
+
 @app.route('/api/generate', methods=['POST'])
+@with_deadline('generate')
 def generate():
     try:
         data = request.json
         model = data.get('model', DEFAULT_MODEL)
         prompt = data.get('prompt', '')
+        options = data.get('options')
         
-        response = requests.post(
-            f"{OLLAMA_API_HOST}/api/generate",
-            json={
-                "model": model,
-                "prompt": prompt,
-                "stream": False
-            }
-        )
+        # A session continues from the context Ollama returned for its last prompt
+        session_id = data.get('session_id')
+        context = chat_sessions.context(session_id) if session_id else None
         
-        return jsonify(response.json())
+        cache_key, cached = (None, None) if context else lookup_cached_response('generate', model, prompt, options)
+        if cached is not None:
+            if session_id and cached.get('context'):
+                chat_sessions.set_context(session_id, cached['context'])
+            response = jsonify(cached)
+            response.headers['X-Cache'] = 'HIT'
+            return _session_response(response, session_id)
+        
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": False
+        }
+        if options:
+            payload["options"] = options
+        if context:
+            payload["context"] = context
+        
+        def call():
+            with ollama_admission.acquire(model, _request_priority(data)):
+                response = ollama_http.post(
+                    f"{OLLAMA_API_HOST}/api/generate",
+                    json=_keep_alive(payload)
+                )
+                result = response.json()
+            _observe_generation(result, model)
+            
+            if cache_key and response.status_code == 200:
+                response_cache.set(cache_key, result)
+            return result
+        
+        coalesce_key = None if context else request_coalesce_key('generate', model, prompt, options)
+        result, shared = _coalesced_call(coalesce_key, call)
+        if session_id and result.get('context'):
+            chat_sessions.set_context(session_id, result['context'])
+        
+        response = jsonify(result)
+        if cache_key:
+            response.headers['X-Cache'] = 'MISS'
+        return _session_response(_mark_coalesced(response, shared), session_id)
+    except SessionError as e:
+        return _session_error_response(e)
+    except UpstreamUnavailable as e:
+        return _unavailable_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/generate/stream', methods=['POST'])
+@with_deadline('generate')
 def generate_stream():
     try:
         data = request.json
         model = data.get('model', DEFAULT_MODEL)
         prompt = data.get('prompt', '')
+        options = data.get('options')
         
-        def generate():
-            response = requests.post(
-                f"{OLLAMA_API_HOST}/api/generate",
-                json={
-                    "model": model,
-                    "prompt": prompt,
-                    "stream": True
-                },
-                stream=True
-            )
-            
-            for line in response.iter_lines():
-                if line:
-                    yield f"data: {line.decode('utf-8')}\n\n"
+        session_id = data.get('session_id')
+        context = chat_sessions.context(session_id) if session_id else None
         
-        return Response(stream_with_context(generate()), content_type='text/event-stream')
+        cache_key, cached = (None, None) if context else lookup_cached_response('generate_stream', model, prompt, options)
+        if cached is not None:
+            frames = _replay_stream(cached)
+            if session_id:
+                frames = session_frames(frames, session_id)
+            return _session_response(_sse_response(frames, 'HIT'), session_id)
+        
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": True
+        }
+        if options:
+            payload["options"] = options
+        if context:
+            payload["context"] = context
+        
+        frames, shared, close = _coalesced_stream(
+            "/api/generate",
+            _keep_alive(payload),
+            None if context else request_coalesce_key('generate_stream', model, prompt, options),
+            cache_key,
+            _request_priority(data)
+        )
+        if session_id:
+            frames = session_frames(frames, session_id)
+        response = _upstream_sse_response(frames, close, 'MISS' if cache_key else None)
+        return _session_response(_mark_coalesced(response, shared), session_id)
+    except SessionError as e:
+        return _session_error_response(e)
+    except UpstreamUnavailable as e:
+        return _unavailable_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _lights_reply(lights_result, is_english):
+    """
+    Build the assistant reply for a lights control result
+    
+    Works for a single room (control_home_lights) and for several rooms
+    (control_home_lights_batch, which carries per-room "results").
+    
+    Returns:
+        (assistant_message, lights_actions) where lights_actions lists
+        {"room", "status"} for every room that was switched, empty if none was
+    """
+    results = lights_result.get("results", [lights_result])
+    done = [result for result in results if result.get("success")]
+    lights_actions = [{"room": result.get("room"), "status": result.get("status")} for result in done]
+    
+    if len(results) == 1:
+        action = "açıldı" if lights_result.get("status") == "on" else "kapatıldı"
+        action_eng = "turned on" if lights_result.get("status") == "on" else "turned off"
+        room = lights_result.get("room", "belirtilen oda")
+        if is_english:
+            return f"The {room} lights have been {action_eng}. Would you like to control lights in another room?", lights_actions
+        return f"{room.capitalize()} ışıkları {action}. Başka bir odada ışık kontrolü yapmamı ister misiniz?", lights_actions
+    
+    sentences = []
+    for status, action, action_eng in (("on", "açıldı", "turned on"), ("off", "kapatıldı", "turned off")):
+        rooms = [item["room"] for item in lights_actions if item["status"] == status]
+        if not rooms:
+            continue
+        if is_english:
+            sentences.append(f"The {', '.join(rooms)} lights have been {action_eng}.")
+        else:
+            sentences.append(f"{', '.join(room.capitalize() for room in rooms)} ışıkları {action}.")
+    
+    failed = [result.get("room") for result in results if not result.get("success")]
+    if failed:
+        if is_english:
+            sentences.append(f"I could not control the {', '.join(failed)} lights.")
+        else:
+            sentences.append(f"{', '.join(room.capitalize() for room in failed)} ışıkları kontrol edilemedi.")
+    return " ".join(sentences), lights_actions
+
 @app.route('/api/chat', methods=['POST'])
+@with_deadline('chat')
 def chat():
     try:
         data = request.json
         model = data.get('model', DEFAULT_MODEL)
-        messages = data.get('messages', [])
-        print(f"Received messages: {messages}")
+        messages, session_id = session_messages(data)
+        log.debug("Received messages", model=model, count=len(messages), session_id=session_id, payload=messages)
         
-        # Check if this is a lights-related message
-        if len(messages) > 0 and messages[-1].get('role') == 'user':
+        # Classify the latest user message (chat, light control or light status)
+        intent = classify_messages(messages)
+        if intent.kind != intent_router.CHAT:
             user_message = messages[-1].get('content', '').lower()
             
-            # Keywords for light control
-            light_control_keywords = ['aç', 'kapat', 'söndür', 'yak', 'turn on', 'turn off', 'switch on', 'switch off']
-            
-            # Keywords for light status query
-            status_keywords = ['status', 'durum', 'state', 'which', 'hangi', 'list', 'liste', 'show', 'göster', 'rooms', 'odalar', 'have', 'var']
-            status_phrase_patterns = ['is the', 'are the', 'tell me about', 'what is', 'bana söyle', 'durum ne', 'ışıkları göster', 'show me']
-            
-            # Check if the message is related to lights
-            light_keywords = ['ışık', 'lamba', 'aydınlat', 'lights', 'light', 'lamp']
-            room_keywords = ['salon', 'sitting', 'oturulan', 'mutfak', 'yatak', 'banyo', 'tuvalet', 'toilet', 'wc', 'living', 'kitchen', 'bedroom', 'bathroom', 'room', 'oda']
-            
-            # Determine if this is a light control command or a status query
-            is_light_control = any(keyword in user_message for keyword in light_control_keywords) and \
-                              any(keyword in user_message for keyword in light_keywords) and \
-                              any(keyword in user_message for keyword in room_keywords)
-            
-            # More strict detection for status queries to avoid false positives
-            is_status_query = False
-            
-            # Check for direct status query indicators
-            if any(keyword in user_message for keyword in status_keywords) and \
-               (any(keyword in user_message for keyword in light_keywords) or any(keyword in user_message for keyword in room_keywords)):
-                is_status_query = True
-                
-            # Check for phrase patterns that indicate a status query
-            if any(pattern in user_message for pattern in status_phrase_patterns) and \
-               (any(keyword in user_message for keyword in light_keywords) or any(keyword in user_message for keyword in room_keywords)):
-                is_status_query = True
-                
-            # If it looks like a light-related query but not a control command, treat as status query
-            if any(keyword in user_message for keyword in light_keywords) and \
-               any(keyword in user_message for keyword in room_keywords) and \
-               not is_light_control and \
-               not any(keyword in user_message for keyword in light_control_keywords):
-                is_status_query = True
-            
             # Process light control commands  
-            if is_light_control:
+            if intent.kind == intent_router.LIGHT_CONTROL:
                 from client import process_lights_command_from_text
                 
                 # Process the command through our lights control function
-                print(f"[DEBUG] Processing light control command: {user_message}")
+                log.debug("Processing light control command", payload=user_message)
                 lights_result = process_lights_command_from_text(user_message, model)
                 
-                if lights_result["success"]:
-                    # Create a response from the lights result
-                    action = "açıldı" if lights_result.get("status") == "on" else "kapatıldı"
-                    action_eng = "turned on" if lights_result.get("status") == "on" else "turned off"
-                    room = lights_result.get("room", "belirtilen oda")
-                    
-                    # Check if the original message was in English
-                    is_english_query = any(word in user_message for word in ['turn', 'switch', 'lights', 'on', 'off'])
-                    
-                    # Create assistant message to add to chat history
-                    if is_english_query:
-                        assistant_message = f"The {room} lights have been {action_eng}. Would you like to control lights in another room?"
-                    else:
-                        assistant_message = f"{room.capitalize()} ışıkları {action}. Başka bir odada ışık kontrolü yapmamı ister misiniz?"
-                    
-                    # Return formatted chat response
-                    return jsonify({
-                        "message": {
-                            "role": "assistant",
-                            "content": assistant_message
-                        },
-                        "lights_action": {
-                            "room": room,
-                            "status": lights_result.get("status")
-                        }
-                    })
+                # Create assistant message to add to chat history
+                assistant_message, lights_actions = _lights_reply(lights_result, intent.is_english)
+                
+                if lights_actions:
+                    # Return formatted chat response, lights_action is the first
+                    # room for clients that only know single room commands
+                    reply = {"role": "assistant", "content": assistant_message}
+                    _session_reply(session_id, reply)
+                    return _session_response(jsonify({
+                        "message": reply,
+                        "lights_action": lights_actions[0],
+                        "lights_actions": lights_actions
+                    }), session_id)
             
             # Process light status queries
-            elif is_status_query:
+            elif intent.kind == intent_router.LIGHT_STATUS:
                 from client import process_lights_status_query_from_text
                 
                 # Process the status query
-                print(f"[DEBUG] Processing light status query: {user_message}")
+                log.debug("Processing light status query", payload=user_message)
                 status_result = process_lights_status_query_from_text(user_message, model)
                 
                 if status_result["success"]:
                     # Return the status response
-                    return jsonify({
-                        "message": {
-                            "role": "assistant",
-                            "content": status_result["message"]
-                        },
+                    reply = {"role": "assistant", "content": status_result["message"]}
+                    _session_reply(session_id, reply)
+                    return _session_response(jsonify({
+                        "message": reply,
                         "lights_states": status_result["states"]
-                    })
+                    }), session_id)
                 else:
                     # If there was an error with the status query, inform the user
                     error_message = status_result.get("error", "Could not retrieve light status information.")
-                    return jsonify({
-                        "message": {
-                            "role": "assistant", 
-                            "content": f"Sorry, I couldn't get the light status information: {error_message}"
-                        }
-                    })
+                    reply = {
+                        "role": "assistant",
+                        "content": f"Sorry, I couldn't get the light status information: {error_message}"
+                    }
+                    _session_reply(session_id, reply)
+                    return _session_response(jsonify({"message": reply}), session_id)
                 
         
         # If not a lights command, proceed with regular chat
-        response = requests.post(
-            f"{OLLAMA_API_HOST}/api/chat",
-            json={
-                "model": model,
-                "messages": messages,
-                "stream": False
-            }
-        )
+        messages = fit_context(model, messages)
+        options = data.get('options')
+        cache_key, cached = lookup_cached_response('chat', model, messages, options)
+        if cached is not None:
+            _session_reply(session_id, cached.get('message'))
+            response = jsonify(cached)
+            response.headers['X-Cache'] = 'HIT'
+            return _session_response(response, session_id)
         
-        return jsonify(response.json())
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": False
+        }
+        if options:
+            payload["options"] = options
+        
+        def call():
+            with ollama_admission.acquire(model, _request_priority(data)):
+                response = ollama_http.post(
+                    f"{OLLAMA_API_HOST}/api/chat",
+                    json=_keep_alive(payload)
+                )
+                result = response.json()
+            _observe_generation(result, model)
+            
+            if cache_key and response.status_code == 200:
+                response_cache.set(cache_key, result)
+            return result
+        
+        result, shared = _coalesced_call(request_coalesce_key('chat', model, messages, options), call)
+        _session_reply(session_id, result.get('message'))
+        
+        response = jsonify(result)
+        if cache_key:
+            response.headers['X-Cache'] = 'MISS'
+        return _session_response(_mark_coalesced(response, shared), session_id)
+    except SessionError as e:
+        return _session_error_response(e)
+    except UpstreamUnavailable as e:
+        return _unavailable_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/chat/stream', methods=['POST'])
+@with_deadline('chat')
 def chat_stream():
     try:
         data = request.json
         model = data.get('model', DEFAULT_MODEL)
-        messages = data.get('messages', [])
+        messages, session_id = session_messages(data)
+        
+        # Classify the latest user message (chat, light control or light status)
+        intent = classify_messages(messages)
         
-        # Check if this is a lights control command
-        if len(messages) > 0 and messages[-1].get('role') == 'user':
+        if intent.kind == intent_router.LIGHT_STATUS:
+            from client import process_lights_status_query_from_text
+            
             user_message = messages[-1].get('content', '').lower()
+            status_result = process_lights_status_query_from_text(user_message, model)
             
-            # Check if the message is related to lights
-            light_keywords = ['ışık', 'lamba', 'aydınlat', 'aç', 'kapat', 'söndür', 'yak', 'turn on', 'turn off', 'lights', 'switch on', 'switch off', 'light', 'lamp']
-            room_keywords = ['salon', 'sitting', 'oturulan', 'mutfak', 'yatak', 'banyo', 'tuvalet', 'toilet', 'wc', 'living', 'kitchen', 'bedroom', 'bathroom']
+            def generate_status_response():
+                if status_result["success"]:
+                    response_data = {
+                        "message": {"role": "assistant", "content": status_result["message"]},
+                        "lights_states": status_result["states"]
+                    }
+                else:
+                    error_message = status_result.get("error", "Could not retrieve light status information.")
+                    response_data = {
+                        "message": {
+                            "role": "assistant",
+                            "content": f"Sorry, I couldn't get the light status information: {error_message}"
+                        }
+                    }
+                yield f"data: {json.dumps(response_data)}\n\n"
             
-            is_light_command = any(keyword in user_message for keyword in light_keywords) and \
-                              any(keyword in user_message for keyword in room_keywords)
+            frames = generate_status_response()
+            if session_id:
+                frames = session_frames(frames, session_id)
+            return _session_response(_sse_response(frames), session_id)
+        
+        if intent.kind == intent_router.LIGHT_CONTROL:
+            user_message = messages[-1].get('content', '').lower()
             
-            if is_light_command:
-                from client import process_lights_command_from_text
-                import json
-                # Process the command through our lights control function
-                lights_result = process_lights_command_from_text(user_message, model)
-                print (lights_result)
-                def generate_lights_response():
-                    if lights_result["success"]:
-                        # Create a response from the lights result
-                        action = "açıldı" if lights_result.get("status") == "on" else "kapatıldı"
-                        action_eng = "turned on" if lights_result.get("status") == "on" else "turned off"
-                        room = lights_result.get("room", "belirtilen oda")
-                        
-                        # Check if the original message was in English
-                        is_english_query = any(word in user_message for word in ['turn', 'switch', 'lights', 'on', 'off'])
-                        
-                        # Create assistant message
-                        if is_english_query:
-                            assistant_message = f"The {room} lights have been {action_eng}. Would you like to control lights in another room?"
+            from client import process_lights_command_from_text
+            # Process the command through our lights control function
+            lights_result = process_lights_command_from_text(user_message, model)
+            log.debug("Lights command result", path=lights_result.get("path"), success=lights_result.get("success"), payload=lights_result)
+            def generate_lights_response():
+                # Create assistant message
+                assistant_message, lights_actions = _lights_reply(lights_result, intent.is_english)
+                
+                if lights_actions:
+                    # Stream the response in chunks to simulate typing
+                    chunks = [assistant_message[i:i+10] for i in range(0, len(assistant_message), 10)]
+                    
+                    for i, chunk in enumerate(chunks):
+                        # First chunk starts the message
+                        if i == 0:
+                            response_data = {
+                                "message": {"role": "assistant", "content": chunk},
+                                "lights_action": lights_actions[0],
+                                "lights_actions": lights_actions
+                            }
                         else:
-                            assistant_message = f"{room.capitalize()} ışıkları {action}. Başka bir odada ışık kontrolü yapmamı ister misiniz?"
-                        
-                        # Stream the response in chunks to simulate typing
-                        chunks = [assistant_message[i:i+10] for i in range(0, len(assistant_message), 10)]
-                        
-                        for i, chunk in enumerate(chunks):
-                            # First chunk starts the message
-                            if i == 0:
-                                response_data = {
-                                    "message": {"role": "assistant", "content": chunk},
-                                    "lights_action": {
-                                        "room": room,
-                                        "status": lights_result.get("status")
-                                    }
-                                }
-                            else:
-                                response_data = {
-                                    "message": {"role": "assistant", "content": chunk}
-                                }
-                                
-                            yield f"data: {json.dumps(response_data)}\n\n"
-                            
-                    else:
-                        # If there was an error with the lights control, inform the user
-                        error_message = lights_result.get("error", "Işıklar kontrol edilemedi, bir hata oluştu.")
-                        response_data = {
-                            "message": {
-                                "role": "assistant", 
-                                "content": f"Üzgünüm, ışıkları kontrol ederken bir sorun oluştu: {error_message}"
+                            response_data = {
+                                "message": {"role": "assistant", "content": chunk}
                             }
-                        }
+                            
                         yield f"data: {json.dumps(response_data)}\n\n"
-                
-                return Response(stream_with_context(generate_lights_response()), content_type='text/event-stream')
+                        
+                else:
+                    # If there was an error with the lights control, inform the user
+                    error_message = lights_result.get("error", "Işıklar kontrol edilemedi, bir hata oluştu.")
+                    response_data = {
+                        "message": {
+                            "role": "assistant", 
+                            "content": f"Üzgünüm, ışıkları kontrol ederken bir sorun oluştu: {error_message}"
+                        }
+                    }
+                    yield f"data: {json.dumps(response_data)}\n\n"
+            
+            frames = generate_lights_response()
+            if session_id:
+                frames = session_frames(frames, session_id)
+            return _session_response(_sse_response(frames), session_id)
         
         # If not a lights command, proceed with regular chat stream
-        def generate():
-            response = requests.post(
-                f"{OLLAMA_API_HOST}/api/chat",
-                json={
-                    "model": model,
-                    "messages": messages,
-                    "stream": True
-                },
-                stream=True
-            )
-            
-            for line in response.iter_lines():
-                if line:
-                    yield f"data: {line.decode('utf-8')}\n\n"
+        messages = fit_context(model, messages)
+        options = data.get('options')
+        cache_key, cached = lookup_cached_response('chat_stream', model, messages, options)
+        if cached is not None:
+            frames = _replay_stream(cached)
+            if session_id:
+                frames = session_frames(frames, session_id)
+            return _session_response(_sse_response(frames, 'HIT'), session_id)
         
-        return Response(stream_with_context(generate()), content_type='text/event-stream')
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": True
+        }
+        if options:
+            payload["options"] = options
+        
+        frames, shared, close = _coalesced_stream(
+            "/api/chat",
+            _keep_alive(payload),
+            request_coalesce_key('chat_stream', model, messages, options),
+            cache_key,
+            _request_priority(data)
+        )
+        if session_id:
+            frames = session_frames(frames, session_id)
+        response = _upstream_sse_response(frames, close, 'MISS' if cache_key else None)
+        return _session_response(_mark_coalesced(response, shared), session_id)
+    except SessionError as e:
+        return _session_error_response(e)
+    except UpstreamUnavailable as e:
+        return _unavailable_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/regression/predict', methods=['POST'])
+@with_deadline('regression')
 def regression_predict():
     try:
         data = request.json
-        response = requests.post(
+        response = regression_http.post(
             f"{REGRESSION_API_HOST}{REGRESSION_PREDICT_ENDPOINT}",
             json=data
         )
         return jsonify(response.json())
+    except UpstreamUnavailable as e:
+        return _unavailable_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Shared by all batch requests, so concurrent uploads cannot multiply the load on the regression service
+_regression_batch_pool = ThreadPoolExecutor(
+    max_workers=REGRESSION_BATCH_MAX_PARALLEL,
+    thread_name_prefix="regression-batch"
+)
+
+def _score_regression_chunk(chunk):
+    """Score one chunk of batch rows, rows that are not JSON objects fail on their own"""
+    from client import get_regression_predictions
+    
+    rows = [row for row in chunk if isinstance(row, dict)]
+    predictions = iter(get_regression_predictions(rows) if rows else [])
+    results = []
+    for row in chunk:
+        if isinstance(row, InvalidRecord):
+            results.append({"success": False, "error": row.error})
+        elif not isinstance(row, dict):
+            results.append({"success": False, "error": "Row must be a JSON object"})
+        else:
+            results.append(next(predictions))
+    return results
+
+@app.route('/api/regression/predict_batch', methods=['POST'])
+def regression_predict_batch():
+    """
+    Score many rows with the regression model in one request
+    
+    Accepts a JSON array of rows or NDJSON (one row per line), either as the
+    request body or as an uploaded "file". The upload is read incrementally
+    and scored in chunks with bounded concurrency, so memory stays flat for
+    any input size.
+    
+    Query parameters:
+        chunk_size: Rows per chunk (default REGRESSION_BATCH_CHUNK_SIZE)
+    
+    Returns:
+        NDJSON stream with one {"index", "success", "prediction" | "error"}
+        line per row in input order, then {"done": true, "rows", "failed"}
+    """
+    if 'file' in request.files:
+        stream = request.files['file'].stream
+    else:
+        stream = request.stream
+    chunk_size = max(request.args.get('chunk_size', type=int) or REGRESSION_BATCH_CHUNK_SIZE, 1)
+    
+    def generate_results():
+        index = 0
+        failed = 0
+        summary = {"done": True}
+        try:
+            chunks = iter_chunks(iter_records(stream), chunk_size)
+            for results in ordered_map(_regression_batch_pool, _score_regression_chunk, chunks, REGRESSION_BATCH_MAX_PARALLEL):
+                lines = []
+                for result in results:
+                    if not result["success"]:
+                        failed += 1
+                    lines.append(json.dumps({"index": index, **result}))
+                    index += 1
+                yield "\n".join(lines) + "\n"
+        except ValueError as e:
+            # Malformed JSON array: rows before the error were already sent
+            summary["error"] = str(e)
+        summary.update({"rows": index, "failed": failed})
+        yield json.dumps(summary) + "\n"
+    
+    return Response(stream_with_context(generate_results()), content_type='application/x-ndjson')
+
 @app.route('/api/regression/status', methods=['GET'])
 def regression_status():
     """Check and return the status of the regression service"""
@@ -329,12 +1070,13 @@ def regression_status():
         }), 500
 
 @app.route('/api/regression/predict_from_text', methods=['POST'])
+@with_deadline('regression_from_text')
 def regression_predict_from_text():
     try:
-        from client import process_regression_request_from_prompt, check_regression_service
+        from client import process_regression_request_from_prompt, health_monitor
         
-        # Check if regression service is running first
-        if not check_regression_service():
+        # Check if regression service is running first (cached, no probe request)
+        if not health_monitor.is_healthy("regression"):
             return jsonify({
                 "success": False, 
                 "error": f"Regression service not running at {REGRESSION_API_HOST}. Please start the service on port 5001."
@@ -349,6 +1091,8 @@ def regression_predict_from_text():
         
         result = process_regression_request_from_prompt(user_message, model)
         return jsonify(result)
+    except UpstreamUnavailable as e:
+        return _unavailable_response(e)
     except Exception as e:
         import traceback
         traceback_str = traceback.format_exc()
@@ -358,49 +1102,126 @@ def regression_predict_from_text():
             "traceback": traceback_str
         }), 500
 
+def _image_upload():
+    """
+    Validate an image upload before it is forwarded
+    
+    The content type and Content-Length are checked before the body is read;
+    a body without Content-Length is cut off at the limit while it is parsed.
+    
+    Returns:
+        Tuple of (FileStorage, None) or (None, error response)
+    """
+    def error(message, status):
+        return None, (jsonify({"success": False, "error": message}), status)
+    
+    if request.mimetype != 'multipart/form-data':
+        return error("Image must be sent as multipart/form-data", 415)
+    
+    limit = IMAGE_UPLOAD_MAX_BYTES + IMAGE_UPLOAD_FORM_OVERHEAD
+    if request.content_length is not None and request.content_length > limit:
+        return error(f"Image is larger than {IMAGE_UPLOAD_MAX_BYTES} bytes", 413)
+    request.upload_limit = limit
+    
+    try:
+        image_file = request.files.get('image')
+    except RequestEntityTooLarge:
+        return error(f"Image is larger than {IMAGE_UPLOAD_MAX_BYTES} bytes", 413)
+    
+    # Check if image was uploaded
+    if image_file is None:
+        return error("No image file provided", 400)
+    if image_file.filename == '':
+        return error("No image file selected", 400)
+    if image_file.mimetype not in IMAGE_UPLOAD_ALLOWED_TYPES:
+        return error(f"Unsupported image type '{image_file.mimetype}', use one of: {', '.join(IMAGE_UPLOAD_ALLOWED_TYPES)}", 415)
+    if file_size(image_file.stream) > IMAGE_UPLOAD_MAX_BYTES:
+        return error(f"Image is larger than {IMAGE_UPLOAD_MAX_BYTES} bytes", 413)
+    return image_file, None
+
+def _image_body(image_file):
+    """
+    Multipart body for the image API, read from the uploaded file in blocks
+    
+    Large uploads are downscaled first when IMAGE_PREPROCESS is enabled.
+    """
+    fileobj, filename, content_type, stats = image_preprocessor.process(
+        image_file.stream, image_file.filename, image_file.content_type, file_size(image_file.stream)
+    )
+    if stats:
+        log.debug("Downscaled upload", original_bytes=stats["original_bytes"], bytes=stats["bytes"], ms=stats["ms"])
+    return MultipartFileBody('image', filename, content_type, fileobj)
+
+def _classify_image(image_file):
+    """
+    Get the classifier result for an upload, from the cache when the same
+    image bytes were classified before
+    
+    Sets an X-Cache: HIT|MISS header on the route's response.
+    
+    Returns:
+        Tuple of (prediction results, None) or (None, error response)
+    
+    Raises:
+        requests.RequestException: When the image API cannot be reached
+    """
+    digest = file_sha256(image_file.stream) if IMAGE_CACHE_ENABLED else None
+    cached = image_cache.get(digest) if digest else None
+    
+    @after_this_request
+    def add_cache_header(response):
+        if digest:
+            response.headers['X-Cache'] = 'HIT' if cached is not None else 'MISS'
+        return response
+    
+    if cached is not None:
+        return cached, None
+    
+    body = _image_body(image_file)
+    response = image_http.post(
+        f"{IMAGE_API_HOST}{IMAGE_PREDICT_ENDPOINT}",
+        data=body,
+        headers={'Content-Type': body.content_type}
+    )
+    
+    if response.status_code != 200:
+        return None, (jsonify({
+            "success": False,
+            "error": f"Image API Error: {response.status_code}",
+            "details": response.text
+        }), response.status_code)
+    
+    prediction_results = response.json()
+    if digest:
+        image_cache.set(digest, prediction_results)
+    return prediction_results, None
+
 @app.route('/api/image/predict', methods=['POST'])
+@with_deadline('image')
 def image_predict():
     """
     Endpoint to handle image prediction requests.
     Accepts an image file and forwards it to the image prediction service.
     """
     try:
-        # Check if image was uploaded
-        if 'image' not in request.files:
-            return jsonify({
-                "success": False,
-                "error": "No image file provided"
-            }), 400
-        
-        image_file = request.files['image']
-        
-        if image_file.filename == '':
-            return jsonify({
-                "success": False,
-                "error": "No image file selected"
-            }), 400
-        
-        # Forward the image file to the image prediction API
-        files = {'image': (image_file.filename, image_file.read(), image_file.content_type)}
+        # Check the upload before anything is forwarded
+        image_file, error_response = _image_upload()
+        if error_response is not None:
+            return error_response
         
         try:
-            response = requests.post(
-                f"{IMAGE_API_HOST}{IMAGE_PREDICT_ENDPOINT}",
-                files=files
-            )
+            # Forward the image file to the image prediction API (or reuse the cached result)
+            prediction_results, error_response = _classify_image(image_file)
+            if error_response is not None:
+                return error_response
             
-            if response.status_code == 200:
-                return jsonify({
-                    "success": True,
-                    "prediction": response.json()
-                })
-            else:
-                return jsonify({
-                    "success": False,
-                    "error": f"Image API Error: {response.status_code}",
-                    "details": response.text
-                }), response.status_code
+            return jsonify({
+                "success": True,
+                "prediction": prediction_results
+            })
                 
+        except UpstreamUnavailable as e:
+            return _unavailable_response(e)
         except requests.RequestException as e:
             return jsonify({
                 "success": False,
@@ -417,49 +1238,28 @@ def image_predict():
         }), 500
 
 @app.route('/api/image/predict_with_explanation', methods=['POST'])
+@with_deadline('image_explain')
 def image_predict_with_explanation():
     """
     Enhanced endpoint that processes an image prediction and then asks
     the language model to provide a natural language explanation of the results.
     """
     try:
-        # Check if image was uploaded
-        if 'image' not in request.files:
-            return jsonify({
-                "success": False,
-                "error": "No image file provided"
-            }), 400
-        
-        image_file = request.files['image']
-        
-        if image_file.filename == '':
-            return jsonify({
-                "success": False,
-                "error": "No image file selected"
-            }), 400
+        # Check the upload before anything is forwarded
+        image_file, error_response = _image_upload()
+        if error_response is not None:
+            return error_response
         
         # Get the LLM model to use for explanation
         data = request.form.to_dict()
         model = data.get('model', DEFAULT_MODEL)
         
-        # Forward the image file to the image prediction API
-        files = {'image': (image_file.filename, image_file.read(), image_file.content_type)}
-        
         try:
-            # Step 1: Get image prediction
-            response = requests.post(
-                f"{IMAGE_API_HOST}{IMAGE_PREDICT_ENDPOINT}",
-                files=files
-            )
-            
-            if response.status_code != 200:
-                return jsonify({
-                    "success": False,
-                    "error": f"Image API Error: {response.status_code}",
-                    "details": response.text
-                }), response.status_code
-                
-            prediction_results = response.json()
+            # Step 1: Get image prediction, leaving part of the budget for the explanation
+            with deadline(REQUEST_DEADLINES.get('image_classify')):
+                prediction_results, error_response = _classify_image(image_file)
+            if error_response is not None:
+                return error_response
             
             # Step 2: Ask LLM to explain the results
             system_prompt = """
@@ -481,20 +1281,21 @@ def image_predict_with_explanation():
 
             # Call LLM for explanation
             try:
-                print(f"Sending request to Ollama API at {OLLAMA_API_HOST}/api/chat with model: {model}")
-                llm_response = requests.post(
-                    f"{OLLAMA_API_HOST}/api/chat",
-                    json={
-                        "model": model,
-                        "messages": [
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_message}
-                        ]
-                    },
-                    timeout=30  # 30 saniye timeout ekleyelim
-                )
+                log.debug("Requesting image explanation", model=model)
+                with ollama_admission.acquire(model):
+                    llm_response = ollama_http.post(
+                        f"{OLLAMA_API_HOST}/api/chat",
+                        json=_keep_alive({
+                            "model": model,
+                            "messages": [
+                                {"role": "system", "content": system_prompt},
+                                {"role": "user", "content": user_message}
+                            ]
+                        }),
+                        timeout=30  # 30 saniye timeout ekleyelim
+                    )
                 
-                print(f"Ollama API response status: {llm_response.status_code}")
+                log.debug("Image explanation response", model=model, status=llm_response.status_code)
                 
                 if llm_response.status_code != 200:
                     # Hata durumunda daha fazla bilgi toplama
@@ -505,7 +1306,7 @@ def image_predict_with_explanation():
                         "model": model
                     }
                     
-                    print(f"Ollama API error: {error_details}")
+                    log.error("Ollama API error", model=model, status=llm_response.status_code, payload=error_details)
                     
                     return jsonify({
                         "success": True, 
@@ -516,7 +1317,7 @@ def image_predict_with_explanation():
             
             except requests.RequestException as e:
                 # Bağlantı hataları (Ollama çalışmıyor olabilir)
-                print(f"Failed to connect to Ollama: {str(e)}")
+                log.error("Failed to connect to Ollama", model=model, error=str(e))
                 return jsonify({
                     "success": True,
                     "prediction": prediction_results,
@@ -542,6 +1343,8 @@ def image_predict_with_explanation():
                 "prediction_json": json.dumps(prediction_results, indent=2)  # Add pretty JSON for chat display
             })
                 
+        except UpstreamUnavailable as e:
+            return _unavailable_response(e)
         except requests.RequestException as e:
             return jsonify({
                 "success": False,
@@ -558,31 +1361,29 @@ def image_predict_with_explanation():
         }), 500
 
 @app.route('/api/image/predict_with_explanation/stream', methods=['POST'])
+@with_deadline('image_explain')
 def image_predict_with_explanation_stream():
     """
     Enhanced endpoint that processes an image prediction and then streams
     the language model's explanation of the results in real-time.
     """
     try:
-        # Check if image was uploaded
-        if 'image' not in request.files:
-            return jsonify({
-                "success": False,
-                "error": "No image file provided"
-            }), 400
-        
-        image_file = request.files['image']
-        
-        if image_file.filename == '':
-            return jsonify({
-                "success": False,
-                "error": "No image file selected"
-            }), 400
+        # Check the upload before anything is forwarded
+        image_file, error_response = _image_upload()
+        if error_response is not None:
+            return error_response
         
         # Get the LLM model and chat history to use for explanation
         data = request.form.to_dict()
         # Always use llama3.2:latest as sub-model
         model = 'llama3.2:latest'
+        # SSE framing: "json" (legacy envelope) or "passthrough" (typed events, raw Ollama bytes)
+        framing = data.get('framing', IMAGE_EXPLANATION_SSE_FRAMING)
+        if framing not in sse.FRAMINGS:
+            return jsonify({
+                "success": False,
+                "error": f"Unsupported framing '{framing}', use one of: {', '.join(sse.FRAMINGS)}"
+            }), 400
         # Get chat history if provided
         messages_json = data.get('messages')
         if messages_json:
@@ -593,25 +1394,17 @@ def image_predict_with_explanation_stream():
         else:
             messages = []
         
-        # Forward the image file to the image prediction API
-        files = {'image': (image_file.filename, image_file.read(), image_file.content_type)}
-        
         try:
-            # Step 1: Get image prediction
-            response = requests.post(
-                f"{IMAGE_API_HOST}{IMAGE_PREDICT_ENDPOINT}",
-                files=files
-            )
-            
-            if response.status_code != 200:
-                return jsonify({
-                    "success": False,
-                    "error": f"Image API Error: {response.status_code}",
-                    "details": response.text
-                }), response.status_code
-                
-            prediction_results = response.json()
-            print(f"Got prediction results: {prediction_results}")
+            # Step 1: Get image prediction, leaving part of the budget for the explanation.
+            # The explanation model loads in the meantime, so a cold start overlaps classification.
+            started = time.perf_counter()
+            preload = _preload_model(model)
+            with deadline(REQUEST_DEADLINES.get('image_classify')):
+                prediction_results, error_response = _classify_image(image_file)
+            classify_ms = round((time.perf_counter() - started) * 1000, 3)
+            if error_response is not None:
+                return error_response
+            log.debug("Got prediction results", payload=prediction_results)
             
             # Step 2: Stream the LLM (sub-model) explanation
             # Improved system prompt for multiple results per image
@@ -641,36 +1434,83 @@ def image_predict_with_explanation_stream():
             full_messages.append({"role": "system", "content": system_prompt})
             full_messages.extend(messages)
             full_messages.append(prediction_message)
+            
+            # The prediction frame goes out before the explanation stream is
+            # opened, so refuse here what would be refused then: an open
+            # circuit (503), a full admission queue (429) or a budget used up
+            # while queued. The generator opens the stream with the slot and
+            # what is left of this route's budget.
+            ollama_http.breaker.check()
+            slot = ollama_admission.acquire(model)
+            expires_at = current_deadline()
 
             def generate():
+                passthrough = framing == sse.FRAMING_PASSTHROUGH
+                explanation_frame = sse.explanation_frame if passthrough else sse.json_explanation_frame
+                
+                def error_frame(message):
+                    if passthrough:
+                        return sse.event_frame('error', {'message': message})
+                    return sse.json_frame({'type': 'error', 'message': message})
+                
                 # First yield the prediction results as a single JSON object (for frontend logic, not for user display)
-                yield f"data: {json.dumps({'type': 'prediction', 'data': prediction_results})}\n\n"
+                if passthrough:
+                    yield sse.event_frame('prediction', prediction_results)
+                else:
+                    yield sse.json_frame({'type': 'prediction', 'data': prediction_results})
                 
                 # Then start streaming the LLM explanation
+                first_token_ms = None
                 try:
-                    response = requests.post(
-                        f"{OLLAMA_API_HOST}/api/chat",
-                        json={
+                    with deadline_at(expires_at):
+                        response = _open_ollama_stream("/api/chat", _keep_alive({
                             "model": model,
                             "messages": full_messages,
                             "stream": True
-                        },
-                        stream=True
-                    )
+                        }), slot=slot)
                     
                     if not response.ok:
-                        yield f"data: {json.dumps({'type': 'error', 'message': f'Ollama API error: {response.status_code}'})}\n\n"
+                        response.close()
+                        yield error_frame(f'Ollama API error: {response.status_code}')
                         return
                     
+                    # In passthrough mode the NDJSON bytes go into the frame untouched
+                    last = None
                     for line in response.iter_lines():
                         if line:
-                            yield f"data: {json.dumps({'type': 'explanation', 'content': line.decode('utf-8')})}\n\n"
+                            if first_token_ms is None:
+                                first_token_ms = round((time.perf_counter() - started) * 1000, 3)
+                            last = line
+                            yield explanation_frame(line)
                             
                 except Exception as e:
-                    yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
-                    
-            return Response(stream_with_context(generate()), content_type='text/event-stream')
+                    yield error_frame(str(e))
+                    return
+                
+                _observe_generation(_final_frame(last) if last else None, model)
+                
+                # Phase timings, all in ms since the upload was accepted
+                preload_result = preload.result() if preload is not None and preload.done() else None
+                timings = {
+                    "classify_ms": classify_ms,
+                    "preload_ms": preload_result["ms"] if preload_result else None,
+                    "model_load_ms": preload_result["load_ms"] if preload_result else None,
+                    "overlap_ms": min(classify_ms, preload_result["ms"]) if preload_result else 0.0,
+                    "first_token_ms": first_token_ms,
+                    "total_ms": round((time.perf_counter() - started) * 1000, 3)
+                }
+                if preload_result and not preload_result["success"]:
+                    log.warning("Preloading model failed", model=model, error=preload_result["error"])
+                log.info("Image explanation timings", model=model, **timings)
+                if passthrough:
+                    yield sse.event_frame('timings', timings)
+                else:
+                    yield sse.json_frame({'type': 'timings', 'data': timings})
+            
+            return _upstream_sse_response(generate(), slot.release)
                 
+        except UpstreamUnavailable as e:
+            return _unavailable_response(e)
         except requests.RequestException as e:
             return jsonify({
                 "success": False,
@@ -694,14 +1534,56 @@ def lights_status():
     Returns:
         JSON response with service status
     """
-    from client import check_lights_service
+    from client import health_monitor
+    
+    status = health_monitor.status("lights")
+    
+    return jsonify({
+        "success": True,
+        "service_running": status["healthy"] is not False,
+        "host": LIGHTS_API_HOST,
+        "checked_at": status["checked_at"]
+    })
+
+@app.route('/api/lights/states', methods=['GET'])
+def lights_states():
+    """
+    Current light state of every room from the local mirror
+    
+    Query parameters:
+        refresh: "true" to re-sync from the lights API first
+        
+    Returns:
+        JSON response with the states, their age in seconds and their source
+    """
+    from client import light_state_mirror
+    
+    if request.args.get('refresh', '').lower() in ('1', 'true', 'yes'):
+        result = light_state_mirror.get(max_age=0)
+    else:
+        result = light_state_mirror.get()
+    
+    if result["success"]:
+        return jsonify(result)
+    else:
+        return jsonify(result), 503
+
+@app.route('/api/lights/stats', methods=['GET'])
+def lights_stats():
+    """
+    Latency and call counts per lights command path
     
-    is_running = check_lights_service()
+    "fast" commands were parsed without the LLM, "llm" commands needed an
+    extraction round trip.
+    
+    Returns:
+        JSON response with per-path counters
+    """
+    from client import lights_path_stats
     
     return jsonify({
         "success": True,
-        "service_running": is_running,
-        "host": LIGHTS_API_HOST
+        "paths": lights_path_stats.snapshot()
     })
 
 @app.route('/api/lights/control', methods=['POST'])
@@ -746,6 +1628,60 @@ def lights_control():
             "traceback": traceback.format_exc()
         }), 500
 
+@app.route('/api/lights/control_batch', methods=['POST'])
+def lights_control_batch():
+    """
+    Control the lights in several rooms with one request
+    
+    The lights API is called for every room in parallel.
+    
+    Expects JSON, one of:
+    {"actions": [{"room": "kitchen", "lights": false}, {"room": "bedroom", "lights": true}]}
+    {"rooms": ["kitchen", "bedroom"], "lights": true/false}
+    {"all": true, "lights": true/false}
+    
+    Returns:
+        JSON response with success (every room succeeded) and per-room results
+    """
+    from client import control_home_lights_batch, light_state_mirror
+    
+    try:
+        data = request.json
+        turn_on = data.get('lights', True)
+        
+        if data.get('actions'):
+            actions = [(item.get('room'), item.get('lights', True)) for item in data['actions']]
+        elif data.get('rooms'):
+            actions = [(room, turn_on) for room in data['rooms']]
+        elif data.get('all'):
+            states = light_state_mirror.get()
+            if not states["success"]:
+                return jsonify(states), 503
+            actions = [(room, turn_on) for room in states["states"]]
+        else:
+            actions = []
+        
+        if not actions or not all(room for room, _ in actions):
+            return jsonify({
+                "success": False,
+                "error": "actions, rooms or all parameter is required, every action needs a room"
+            }), 400
+        
+        result = control_home_lights_batch(actions)
+        
+        if result["success"]:
+            return jsonify(result)
+        else:
+            return jsonify(result), 500
+            
+    except Exception as e:
+        import traceback
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "traceback": traceback.format_exc()
+        }), 500
+
 @app.route('/api/lights/control_from_text', methods=['POST'])
 def lights_control_from_text():
     """
@@ -793,10 +1729,10 @@ def test_lights():
     """
     Simple test endpoint for lights service connectivity
     """
-    from client import check_lights_service, control_home_lights
+    from client import health_monitor, control_home_lights
     
     # First test service availability
-    is_running = check_lights_service()
+    is_running = health_monitor.is_healthy("lights")
     
     if (is_running):
         # If service is running, attempt a test command
@@ -990,4 +1926,8 @@ def lights_control_from_text_shortcut():
     return lights_control_from_text()
 
 if __name__ == '__main__':
+    # With the debug reloader, only the child process that serves requests preloads models
+    if not DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        from client import model_residency
+        model_residency.start()
     app.run(host=HOST, port=PORT, debug=DEBUG)
\ No newline at end of file
@@ -0,0 +1,341 @@
+"""
+Server-side chat sessions
+
+Without a session the browser posts the whole conversation with every turn,
+so the upload and the JSON parsing grow with the length of the chat. With a
+session the client sends its session id and only the new message; the history
+is kept here and the route assembles the Ollama request from it.
+
+Sessions live in a bounded in-memory LRU store. Sessions idle for longer than
+the TTL expire; when the store is full the least recently used session is
+written to the spill directory (if one is configured) and read back the next
+time it is used, otherwise it is dropped. A client whose session is gone gets
+a 404 and can start it again by posting its full history once.
+
+A session also keeps the "context" array Ollama returned for the last
+/api/generate call, so the next prompt of the session continues from it.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from jsonlog import get_logger
+
+log = get_logger("sessions")
+
+_SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+# Spill files older than the TTL are swept after this many spills
+_SWEEP_EVERY = 100
+
+
+class SessionError(Exception):
+    """A request referred to a session that cannot be used"""
+
+    status_code = 400
+
+
+class InvalidSessionId(SessionError):
+    """The session id is not 8 to 64 letters, digits, '-' or '_'"""
+
+
+class SessionNotFound(SessionError):
+    """The session expired, was evicted or never existed"""
+
+    status_code = 404
+
+
+def validate_session_id(session_id):
+    if not isinstance(session_id, str) or not _SESSION_ID.match(session_id):
+        raise InvalidSessionId("session_id must be 8 to 64 letters, digits, '-' or '_'")
+    return session_id
+
+
+def _new_session():
+    return {"messages": [], "context": None, "updated_at": time.time()}
+
+
+class SessionStore:
+    """
+    Bounded chat history store with LRU eviction and optional disk spill
+    """
+
+    def __init__(self, max_sessions=1000, max_messages=200, ttl=86400, spill_dir=None):
+        """
+        Args:
+            max_sessions: Sessions kept in memory
+            max_messages: Messages kept per session; older ones are dropped,
+                leading system messages are always kept
+            ttl: Seconds a session may stay idle before it expires
+            spill_dir: Directory evicted sessions are written to, None drops
+                them instead
+        """
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self._sessions = OrderedDict()
+        # Evicted sessions whose spill file is still being written
+        self._spilling = {}
+        self._lock = threading.Lock()
+        self._counters = {"created": 0, "hits": 0, "misses": 0, "expired": 0, "evicted": 0,
+                          "spilled": 0, "restored": 0, "spill_errors": 0}
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _spill_path(self, session_id):
+        return os.path.join(self.spill_dir, f"{session_id}.json")
+
+    def _expired(self, session):
+        return self.ttl is not None and time.time() - session["updated_at"] > self.ttl
+
+    def _restore(self, session_id):
+        """Read a spilled session back, None if there is none or it expired"""
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(session_id)
+        try:
+            with open(path, encoding="utf-8") as f:
+                session = json.load(f)
+            os.remove(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.warning("Reading spilled session failed", session_id=session_id, error=str(e))
+            return None
+        if self._expired(session):
+            with self._lock:
+                self._counters["expired"] += 1
+            return None
+        with self._lock:
+            self._counters["restored"] += 1
+        return session
+
+    def _spill(self, evicted):
+        """Write evicted sessions to the spill directory, outside the store lock"""
+        for session_id, session in evicted:
+            try:
+                path = self._spill_path(session_id)
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(session, f, ensure_ascii=False)
+                os.replace(path + ".tmp", path)
+                with self._lock:
+                    self._counters["spilled"] += 1
+                    sweep = self._counters["spilled"] % _SWEEP_EVERY == 0
+            except OSError as e:
+                sweep = False
+                with self._lock:
+                    self._counters["spill_errors"] += 1
+                log.warning("Spilling session failed", session_id=session_id, error=str(e))
+            finally:
+                with self._lock:
+                    if self._spilling.get(session_id) is session:
+                        del self._spilling[session_id]
+            if sweep:
+                self._sweep()
+
+    def _sweep(self):
+        """Delete spill files of sessions that have been idle for longer than the TTL"""
+        if self.ttl is None:
+            return
+        cutoff = time.time() - self.ttl
+        try:
+            for entry in os.scandir(self.spill_dir):
+                if entry.name.endswith(".json") and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+        except OSError as e:
+            log.warning("Sweeping spilled sessions failed", error=str(e))
+
+    def _session(self, session_id, create):
+        """
+        Return the live session dict for an id, loading a spilled one
+
+        Must be called without the lock held; the returned dict is only
+        changed under the lock.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and self._expired(session):
+                del self._sessions[session_id]
+                self._counters["expired"] += 1
+                session = None
+            if session is None:
+                session = self._spilling.pop(session_id, None)
+            if session is not None:
+                self._sessions[session_id] = session
+                self._sessions.move_to_end(session_id)
+                self._counters["hits"] += 1
+                return session
+
+        session = self._restore(session_id)
+        if session is None:
+            with self._lock:
+                self._counters["misses"] += 1
+            if not create:
+                raise SessionNotFound(f"Unknown or expired session {session_id}")
+            session = _new_session()
+            with self._lock:
+                self._counters["created"] += 1
+        return self._insert(session_id, session)
+
+    def _insert(self, session_id, session):
+        evicted = []
+        with self._lock:
+            # Another request may have loaded or created it meanwhile
+            session = self._sessions.setdefault(session_id, session)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                evicted_id, evicted_session = self._sessions.popitem(last=False)
+                self._counters["evicted"] += 1
+                if self.spill_dir:
+                    self._spilling[evicted_id] = evicted_session
+                    evicted.append((evicted_id, evicted_session))
+        if evicted:
+            self._spill(evicted)
+        return session
+
+    def _cap(self, messages):
+        if len(messages) <= self.max_messages:
+            return messages
+        head = 0
+        while head < len(messages) and messages[head].get("role") == "system":
+            head += 1
+        tail = max(self.max_messages - head, 1)
+        return messages[:head] + messages[-tail:]
+
+    def replace(self, session_id, messages):
+        """
+        Start a session, or restart it, with a full history
+
+        Returns:
+            Copy of the stored history
+        """
+        validate_session_id(session_id)
+        session = self._session(session_id, create=True)
+        with self._lock:
+            session["messages"] = self._cap(list(messages))
+            session["context"] = None
+            session["updated_at"] = time.time()
+            return list(session["messages"])
+
+    def append(self, session_id, message, create=False):
+        """
+        Add a message to a session's history
+
+        Args:
+            session_id: Session id
+            message: Chat message dict with role and content
+            create: Start the session if it does not exist, otherwise raise
+
+        Returns:
+            Copy of the history including the new message
+
+        Raises:
+            InvalidSessionId: When the id is malformed
+            SessionNotFound: When the session does not exist and create is
+                False
+        """
+        validate_session_id(session_id)
+        session = self._session(session_id, create=create)
+        with self._lock:
+            session["messages"] = self._cap(session["messages"] + [message])
+            session["updated_at"] = time.time()
+            return list(session["messages"])
+
+    def context(self, session_id):
+        """
+        Return the Ollama context of the session's last generate call
+
+        Starts the session when it does not exist yet, so a generate session
+        can begin with any new id.
+        """
+        validate_session_id(session_id)
+        session = self._session(session_id, create=True)
+        with self._lock:
+            session["updated_at"] = time.time()
+            return session["context"]
+
+    def set_context(self, session_id, context):
+        session = self._session(session_id, create=True)
+        with self._lock:
+            session["context"] = context
+            session["updated_at"] = time.time()
+
+    def record_reply(self, session_id, lines):
+        """
+        Store the result of a completed Ollama stream in the session
+
+        The message contents of the lines are joined into the assistant reply
+        (chat), and the "context" of the final line is kept for the next
+        prompt (generate).
+
+        Args:
+            session_id: Session id
+            lines: NDJSON lines of the stream as strings
+        """
+        content = []
+        final = None
+        for line in lines:
+            try:
+                frame = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(frame, dict):
+                continue
+            message = frame.get("message")
+            if isinstance(message, dict) and message.get("content"):
+                content.append(message["content"])
+            final = frame
+        if content:
+            self.append(session_id, {"role": "assistant", "content": "".join(content)}, create=True)
+        if final is not None and final.get("done") and final.get("context"):
+            self.set_context(session_id, final["context"])
+
+    def history(self, session_id):
+        """
+        Returns:
+            Copy of the session's messages
+
+        Raises:
+            SessionNotFound: When the session does not exist
+        """
+        validate_session_id(session_id)
+        session = self._session(session_id, create=False)
+        with self._lock:
+            return list(session["messages"])
+
+    def delete(self, session_id):
+        """Forget a session, in memory and on disk"""
+        validate_session_id(session_id)
+        with self._lock:
+            removed = self._sessions.pop(session_id, None) is not None
+            removed = self._spilling.pop(session_id, None) is not None or removed
+        if self.spill_dir:
+            try:
+                os.remove(self._spill_path(session_id))
+                removed = True
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def stats(self):
+        """
+        Returns:
+            Dictionary with the store limits, sessions and messages in memory,
+            and the created, hit, miss, expiry, eviction and spill counters
+        """
+        with self._lock:
+            stats = {
+                "sessions": len(self._sessions),
+                "messages": sum(len(session["messages"]) for session in self._sessions.values()),
+                "max_sessions": self.max_sessions,
+                "max_messages": self.max_messages,
+                "ttl": self.ttl,
+                "spill_dir": self.spill_dir
+            }
+            stats.update(self._counters)
+        return stats
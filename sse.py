@@ -0,0 +1,39 @@
+"""
+Server-Sent Events framing helpers
+
+Two framings are used for the image explanation stream:
+
+- json: every frame is "data: {"type": ..., ...}". Ollama NDJSON lines are
+  decoded and wrapped as a string inside the envelope (double-encoded JSON).
+- passthrough: every frame carries a typed event name and the Ollama line is
+  copied byte for byte into the data field, with no decode or re-serialize.
+"""
+
+import json
+
+FRAMING_JSON = 'json'
+FRAMING_PASSTHROUGH = 'passthrough'
+FRAMINGS = (FRAMING_JSON, FRAMING_PASSTHROUGH)
+
+_EXPLANATION_PREFIX = b"event: explanation\ndata: "
+_FRAME_END = b"\n\n"
+
+
+def json_frame(payload):
+    """Legacy envelope frame: data: <json payload>"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def json_explanation_frame(line):
+    """Legacy explanation frame: decodes the NDJSON line and re-encodes it"""
+    return json_frame({'type': 'explanation', 'content': line.decode('utf-8')})
+
+
+def event_frame(event, payload):
+    """Typed frame whose data is a JSON encoded payload"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode('utf-8')
+
+
+def explanation_frame(line):
+    """Typed explanation frame carrying the raw Ollama NDJSON bytes"""
+    return _EXPLANATION_PREFIX + line + _FRAME_END
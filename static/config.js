@@ -9,6 +9,7 @@ const CONFIG = {
         GENERATE_STREAM: '/api/generate/stream',
         CHAT: '/api/chat',
         CHAT_STREAM: '/api/chat/stream',
+        SESSIONS: '/api/sessions',
         REGRESSION_PREDICT: '/api/regression/predict',
         REGRESSION_PREDICT_FROM_TEXT: '/api/regression/predict_from_text',
         IMAGE_PREDICT: '/api/image/predict',
@@ -27,6 +27,33 @@ document.addEventListener('DOMContentLoaded', () => {
     let messages = [];
     let isGenerating = false;
 
+    // The server keeps the chat history per session, so each turn only sends the new message
+    let sessionId = newSessionId();
+    let sessionStarted = false;
+
+    function newSessionId() {
+        if (window.crypto && window.crypto.randomUUID) {
+            return window.crypto.randomUUID();
+        }
+        return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 12);
+    }
+
+    function resetSession() {
+        if (sessionStarted) {
+            fetch(`${window.CHAT_CONFIG.API.SESSIONS}/${sessionId}`, { method: 'DELETE' }).catch(() => {});
+        }
+        sessionId = newSessionId();
+        sessionStarted = false;
+    }
+
+    function chatRequestBody(modelName, fullHistory) {
+        // The whole history starts the session, or restarts it after the server lost it
+        if (fullHistory || !sessionStarted) {
+            return { model: modelName, session_id: sessionId, messages: messages };
+        }
+        return { model: modelName, session_id: sessionId, message: messages[messages.length - 1] };
+    }
+
     // Butonları tekrar seç (özellikle input-container içindeki sıralama değiştiyse)
     const sendButton = document.getElementById('send-button');
     const plusButton = document.getElementById('plus-button');
@@ -47,6 +74,7 @@ document.addEventListener('DOMContentLoaded', () => {
             // Clear chat history when "New Chat" is clicked
             chatContainer.innerHTML = '';
             messages = [];
+            resetSession();
 
             // Add welcome message
             const welcomeDiv = document.createElement('div');
@@ -154,6 +182,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         // If streaming is enabled and explanation is requested
         if (useStreaming && explainResults) {
+            formData.append('framing', 'passthrough');
             handleStreamingImageAnalysis(formData, getCurrentModel());
             return;
         }
@@ -417,10 +446,10 @@ document.addEventListener('DOMContentLoaded', () => {
                 const lines = chunk.split('\n\n');
 
                 for (const line of lines) {
-                    if (line.startsWith('data: ')) {
+                    if (line.startsWith('data: ') || line.startsWith('event: ')) {
                         try {
-                            // Parse the JSON data
-                            const eventData = JSON.parse(line.substring(6));
+                            // Parse the SSE frame (typed or legacy JSON envelope)
+                            const eventData = parseImageStreamFrame(line);
 
                             // Handle different event types
                             if (eventData.type === 'prediction') {
@@ -518,6 +547,26 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Parse one SSE frame from the image explanation stream into an event object.
+    // Typed frames ("event: explanation" + raw Ollama line) are mapped to the same
+    // shape as the legacy JSON envelope ({type: ..., ...}).
+    function parseImageStreamFrame(frame) {
+        let eventName = null;
+        let data = '';
+        for (const field of frame.split('\n')) {
+            if (field.startsWith('event: ')) {
+                eventName = field.substring(7);
+            } else if (field.startsWith('data: ')) {
+                data += field.substring(6);
+            }
+        }
+
+        if (!eventName) return JSON.parse(data);
+        if (eventName === 'explanation') return { type: 'explanation', content: data };
+        if (eventName === 'prediction') return { type: 'prediction', data: JSON.parse(data) };
+        return { type: eventName, ...JSON.parse(data) };
+    }
+
     // Update the send button appearance based on generation state
     function updateSendButton() {
         if (isGenerating) {
@@ -630,21 +679,26 @@ document.addEventListener('DOMContentLoaded', () => {
             currentController = new AbortController();
             const signal = currentController.signal;
 
-            // Attempt to fetch streaming response
-            fetch(window.CHAT_CONFIG.API.CHAT_STREAM, {
+            const postChat = fullHistory => fetch(window.CHAT_CONFIG.API.CHAT_STREAM, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
-                body: JSON.stringify({
-                    model: modelName,
-                    messages: messages
-                }),
+                body: JSON.stringify(chatRequestBody(modelName, fullHistory)),
                 signal
+            });
+
+            // Attempt to fetch streaming response; an expired session (404) is
+            // started again with the whole history
+            postChat(false).then(response => {
+                return response.status === 404 && sessionStarted ? postChat(true) : response;
             }).then(response => {
                 if (!response.ok) {
+                    // The server may not have stored this turn, send the whole history next time
+                    sessionStarted = false;
                     throw new Error(`HTTP error! Status: ${response.status}`);
                 }
+                sessionStarted = true;
 
                 // Get a reader to process the stream
                 const reader = response.body.getReader();
@@ -694,13 +748,14 @@ document.addEventListener('DOMContentLoaded', () => {
 
                                     // Check if this is a lights control response
                                     if (data.lights_action) {
-                                        const lightsAction = data.lights_action;
-                                        const room = lightsAction.room;
-                                        const status = lightsAction.status;
+                                        // Multi-room commands list every room in lights_actions
+                                        const lightsActions = data.lights_actions || [data.lights_action];
 
                                         // Show lights control visual indicator
                                         setTimeout(() => {
-                                            showLightsActionIndicator(aiMessageDiv, room, status === 'on');
+                                            lightsActions.forEach(lightsAction => {
+                                                showLightsActionIndicator(aiMessageDiv, lightsAction.room, lightsAction.status === 'on');
+                                            });
                                         }, 100);
                                     }
                                 } else if (data.response) {
@@ -981,6 +1036,7 @@ document.addEventListener('DOMContentLoaded', () => {
         const formData = new FormData();
         formData.append('image', chatImageFile);
         if (userMessage) formData.append('text', userMessage);
+        formData.append('framing', 'passthrough');
         // Add AI message for classification
         let aiMsg = addMessage('ai', 'Analyzing image...');
         chatContainer.scrollTop = chatContainer.scrollHeight;
@@ -1012,9 +1068,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 const chunk = decoder.decode(value, { stream: true });
                 const lines = chunk.split('\n\n');
                 for (const line of lines) {
-                    if (line.startsWith('data: ')) {
+                    if (line.startsWith('data: ') || line.startsWith('event: ')) {
                         try {
-                            const eventData = JSON.parse(line.substring(6));
+                            const eventData = parseImageStreamFrame(line);
                             if (eventData.type === 'explanation') {
                                 let contentToAdd = '';
                                 try {
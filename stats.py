@@ -0,0 +1,47 @@
+"""
+Lightweight in-process counters for request paths
+"""
+
+import threading
+
+
+class LatencyCounters:
+    """
+    Thread-safe call count and latency totals per named path
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths = {}
+
+    def record(self, path, seconds):
+        """
+        Record one call
+
+        Args:
+            path: Name of the path taken, e.g. "fast" or "llm"
+            seconds: Wall clock duration of the call
+        """
+        with self._lock:
+            entry = self._paths.setdefault(path, {"count": 0, "total": 0.0, "max": 0.0})
+            entry["count"] += 1
+            entry["total"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+
+    def snapshot(self):
+        """
+        Returns:
+            Dictionary of path -> {count, share, avg_ms, max_ms, total_ms}
+        """
+        with self._lock:
+            calls = sum(entry["count"] for entry in self._paths.values())
+            return {
+                path: {
+                    "count": entry["count"],
+                    "share": round(entry["count"] / calls, 4) if calls else 0.0,
+                    "avg_ms": round(entry["total"] / entry["count"] * 1000, 3),
+                    "max_ms": round(entry["max"] * 1000, 3),
+                    "total_ms": round(entry["total"] * 1000, 3)
+                }
+                for path, entry in self._paths.items()
+            }
@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import BATCH, CHAT, INTERACTIVE, AdmissionController, QueueFull
+from resilience import DeadlineExceeded, deadline
+
+MODEL = 'mistral:7b'
+
+
+def _depth(controller):
+    return controller.stats()["models"][MODEL]["depth"]
+
+
+def _wait_for_depth(controller, depth):
+    for _ in range(200):
+        if _depth(controller) == depth:
+            return
+        time.sleep(0.005)
+    raise AssertionError(f"queue depth never reached {depth}")
+
+
+def _queue_in_thread(controller, priority, order):
+    def run():
+        slot = controller.acquire(MODEL, priority)
+        order.append(priority)
+        slot.release()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_admits_up_to_concurrency_at_once():
+    controller = AdmissionController('ollama', concurrency=2, max_queue=4)
+    first = controller.acquire(MODEL)
+    second = controller.acquire(MODEL)
+    assert controller.stats()["models"][MODEL]["in_flight"] == 2
+    first.release()
+    second.release()
+    assert controller.stats()["models"][MODEL]["in_flight"] == 0
+
+
+def test_waiters_are_admitted_by_class_then_arrival():
+    controller = AdmissionController('ollama', concurrency=1, max_queue=8)
+    held = controller.acquire(MODEL)
+    order = []
+    threads = []
+    for depth, priority in enumerate([BATCH, CHAT, INTERACTIVE, CHAT], start=1):
+        threads.append(_queue_in_thread(controller, priority, order))
+        _wait_for_depth(controller, depth)
+
+    held.release()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert order == [INTERACTIVE, CHAT, CHAT, BATCH]
+
+
+def test_full_queue_is_refused_with_retry_after():
+    controller = AdmissionController('ollama', concurrency=1, max_queue=1)
+    held = controller.acquire(MODEL)
+    order = []
+    thread = _queue_in_thread(controller, CHAT, order)
+    _wait_for_depth(controller, 1)
+
+    with pytest.raises(QueueFull) as refused:
+        controller.acquire(MODEL, CHAT)
+    assert refused.value.status_code == 429
+    assert refused.value.retry_after >= 1
+    assert controller.stats()["models"][MODEL]["rejected"] == 1
+
+    held.release()
+    thread.join(timeout=5)
+    assert order == [CHAT]
+
+
+def test_higher_class_displaces_the_lowest_waiter():
+    controller = AdmissionController('ollama', concurrency=1, max_queue=1)
+    held = controller.acquire(MODEL)
+    displaced = []
+
+    def run():
+        try:
+            controller.acquire(MODEL, BATCH)
+        except QueueFull as e:
+            displaced.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    _wait_for_depth(controller, 1)
+
+    order = []
+    interactive = _queue_in_thread(controller, INTERACTIVE, order)
+    thread.join(timeout=5)
+    assert len(displaced) == 1
+
+    held.release()
+    interactive.join(timeout=5)
+    assert order == [INTERACTIVE]
+
+
+def test_zero_queue_depth_refuses_instead_of_queueing():
+    controller = AdmissionController('ollama', concurrency=1, max_queue=0)
+    held = controller.acquire(MODEL)
+    with pytest.raises(QueueFull):
+        controller.acquire(MODEL, INTERACTIVE)
+    held.release()
+
+
+def test_deadline_while_queued_leaves_the_queue():
+    controller = AdmissionController('ollama', concurrency=1, max_queue=4)
+    held = controller.acquire(MODEL)
+    with deadline(0.05):
+        with pytest.raises(DeadlineExceeded):
+            controller.acquire(MODEL)
+    assert _depth(controller) == 0
+    held.release()
+    assert controller.stats()["models"][MODEL]["in_flight"] == 0
+
+
+def test_disabled_controller_admits_everything():
+    controller = AdmissionController('ollama', concurrency=1, max_queue=0, enabled=False)
+    slots = [controller.acquire(MODEL) for _ in range(5)]
+    for slot in slots:
+        slot.release()
+    assert controller.stats()["models"] == {}
+
+
+def test_async_waiter_is_admitted_on_release_from_another_thread():
+    controller = AdmissionController('ollama', concurrency=1, max_queue=4)
+    held = controller.acquire(MODEL)
+
+    async def main():
+        waiting = asyncio.ensure_future(controller.acquire_async(MODEL, CHAT))
+        await asyncio.sleep(0.01)
+        assert _depth(controller) == 1
+        threading.Timer(0.01, held.release).start()
+        slot = await asyncio.wait_for(waiting, timeout=5)
+        slot.release()
+
+    asyncio.run(main())
+    assert controller.stats()["models"][MODEL]["in_flight"] == 0
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    controller = AdmissionController('ollama', concurrency=1, max_queue=4)
+    held = controller.acquire(MODEL)
+
+    async def main():
+        waiting = asyncio.ensure_future(controller.acquire_async(MODEL, CHAT))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+    asyncio.run(main())
+    assert _depth(controller) == 0
+    held.release()
+    assert controller.stats()["models"][MODEL]["in_flight"] == 0
+
+
+def test_cancelled_async_waiter_passes_on_a_slot_it_was_given():
+    controller = AdmissionController('ollama', concurrency=1, max_queue=4)
+    held = controller.acquire(MODEL)
+
+    async def main():
+        waiting = asyncio.ensure_future(controller.acquire_async(MODEL, CHAT))
+        await asyncio.sleep(0.01)
+        # Admitted, but cancelled before it resumed
+        held.release()
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+    asyncio.run(main())
+    assert controller.stats()["models"][MODEL]["in_flight"] == 0
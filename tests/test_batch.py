@@ -0,0 +1,100 @@
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from batch import InvalidRecord, iter_chunks, iter_records, ordered_map
+
+RECORDS = [
+    {"age": 30, "sex": "male", "city": "İstanbul"},
+    {"age": 41.5, "note": "şğü, [not] the end"},
+    12345,
+    "çay",
+    [1, 2, {"nested": [3]}],
+    None
+]
+
+# Tiny blocks split numbers, strings and multi-byte characters across reads
+READ_SIZES = [1, 2, 3, 7, 64 * 1024]
+
+
+def _records(text, read_size):
+    return list(iter_records(io.BytesIO(text.encode("utf-8")), read_size=read_size))
+
+
+@pytest.mark.parametrize("read_size", READ_SIZES)
+@pytest.mark.parametrize("text", [
+    json.dumps(RECORDS, ensure_ascii=False),
+    json.dumps(RECORDS, ensure_ascii=False, indent=2),
+    "  \n" + json.dumps(RECORDS, ensure_ascii=False) + "\n",
+])
+def test_json_array(text, read_size):
+    assert _records(text, read_size) == RECORDS
+
+
+@pytest.mark.parametrize("read_size", READ_SIZES)
+@pytest.mark.parametrize("text", [
+    "\n".join(json.dumps(record, ensure_ascii=False) for record in RECORDS),
+    "\n".join(json.dumps(record, ensure_ascii=False) for record in RECORDS) + "\n",
+    "\r\n\n".join(json.dumps(record, ensure_ascii=False) for record in RECORDS),
+])
+def test_ndjson(text, read_size):
+    assert _records(text, read_size) == RECORDS
+
+
+@pytest.mark.parametrize("read_size", READ_SIZES)
+def test_invalid_ndjson_line_keeps_its_index(read_size):
+    records = _records('{"age": 1}\n{"age": \n{"age": 3}', read_size)
+    assert records[0] == {"age": 1}
+    assert isinstance(records[1], InvalidRecord)
+    assert records[2] == {"age": 3}
+
+
+@pytest.mark.parametrize("read_size", READ_SIZES)
+@pytest.mark.parametrize("text", [
+    '[{"age": 1}, {"age": ', '[{"age": 1}', '[1, }',
+    '[1 2]', '[1,,2]', '[,1]', '[1,]', '[,]', '[1 , ]', '[{"age": 1} {"age": 2}]'
+])
+def test_malformed_json_array_raises(text, read_size):
+    with pytest.raises(ValueError):
+        _records(text, read_size)
+
+
+@pytest.mark.parametrize("text", ["", "   \n\t"])
+def test_empty_upload_has_no_records(text):
+    assert _records(text, 3) == []
+
+
+@pytest.mark.parametrize("read_size", READ_SIZES)
+def test_empty_array(read_size):
+    assert _records(" [ ] ", read_size) == []
+
+
+def test_chunks():
+    assert list(iter_chunks(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(iter_chunks([], 3)) == []
+
+
+def test_ordered_map_keeps_input_order_and_bounds_in_flight():
+    in_flight = []
+    peak = []
+    lock = threading.Lock()
+
+    def work(chunk):
+        with lock:
+            in_flight.append(chunk)
+            peak.append(len(in_flight))
+        # Later chunks finish first
+        time.sleep(0.02 / (chunk[0] + 1))
+        with lock:
+            in_flight.remove(chunk)
+        return [value * 2 for value in chunk]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(ordered_map(pool, work, iter_chunks(range(20), 2), max_in_flight=3))
+
+    assert results == [[value * 2 for value in chunk] for chunk in iter_chunks(range(20), 2)]
+    assert max(peak) <= 3
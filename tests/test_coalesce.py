@@ -0,0 +1,273 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from coalesce import AsyncStreamCoalescer, RequestCoalescer, StreamCoalescer
+
+
+class FakeStream:
+    """Streamed response whose lines are released one by one"""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.released = threading.Semaphore(0)
+        self.closed = threading.Event()
+
+    def iter_lines(self):
+        for line in self.lines:
+            self.released.acquire(timeout=5)
+            yield line
+
+    def release(self, count=None):
+        for _ in range(count or len(self.lines)):
+            self.released.release()
+
+    def close(self):
+        self.closed.set()
+
+
+def test_identical_calls_share_one_result():
+    coalescer = RequestCoalescer()
+    started = threading.Event()
+    finish = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        started.set()
+        finish.wait(5)
+        return {"response": "ok"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(coalescer.do("key", call)))]
+    threads[0].start()
+    started.wait(5)
+    threads += [threading.Thread(target=lambda: results.append(coalescer.do("key", call))) for _ in range(3)]
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)
+    finish.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert all(result == {"response": "ok"} for result, _ in results)
+
+
+def test_errors_reach_every_waiting_caller():
+    coalescer = RequestCoalescer()
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        coalescer.do("key", fail)
+    assert coalescer.stats()["in_flight"] == 0
+
+
+def test_subscribers_receive_every_line_once_from_one_stream():
+    coalescer = StreamCoalescer()
+    stream = FakeStream([b"a", b"b", b"c"])
+    opened = []
+    completed = []
+
+    def open_stream():
+        opened.append(1)
+        return stream
+
+    leader, leader_shared = coalescer.subscribe("key", open_stream, completed.append)
+    stream.release(1)
+    follower, follower_shared = coalescer.subscribe("key", open_stream)
+    stream.release()
+
+    assert (leader_shared, follower_shared) == (False, True)
+    assert list(leader) == [b"a", b"b", b"c"]
+    # A late subscriber replays the lines it missed
+    assert list(follower) == [b"a", b"b", b"c"]
+    assert len(opened) == 1
+    assert stream.closed.wait(5)
+    for _ in range(100):
+        if completed:
+            break
+        time.sleep(0.01)
+    assert completed == [[b"a", b"b", b"c"]]
+    assert coalescer.stats()["in_flight"] == 0
+
+
+def test_closing_an_unread_subscription_closes_the_upstream():
+    coalescer = StreamCoalescer()
+    stream = FakeStream([b"a", b"b", b"c"])
+    lines, _ = coalescer.subscribe("key", lambda: stream)
+
+    # The client went away before its response started
+    lines.close()
+    stream.release()
+
+    assert stream.closed.wait(5)
+    assert coalescer.stats()["in_flight"] == 0
+
+
+def test_open_error_reaches_the_leader_and_is_not_shared_later():
+    coalescer = StreamCoalescer()
+
+    def fail():
+        raise ConnectionError("refused")
+
+    with pytest.raises(ConnectionError):
+        coalescer.subscribe("key", fail)
+
+    stream = FakeStream([b"a"])
+    stream.release()
+    lines, shared = coalescer.subscribe("key", lambda: stream)
+    assert not shared
+    assert list(lines) == [b"a"]
+
+
+class FakeAsyncStream:
+    """Async line stream whose lines are released one by one"""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.released = asyncio.Semaphore(0)
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for line in self.lines:
+            await self.released.acquire()
+            yield line
+
+    def release(self, count=None):
+        for _ in range(count or len(self.lines)):
+            self.released.release()
+
+    async def aclose(self):
+        self.closed = True
+
+
+async def _read(lines):
+    return [line async for line in lines]
+
+
+def test_async_subscribers_share_one_stream():
+    async def main():
+        coalescer = AsyncStreamCoalescer()
+        stream = FakeAsyncStream(["a", "b", "c"])
+        opened = []
+        completed = []
+
+        async def open_stream():
+            opened.append(1)
+            return stream
+
+        leader, leader_shared = await coalescer.subscribe("key", open_stream, completed.append)
+        follower, follower_shared = await coalescer.subscribe("key", open_stream)
+        stream.release()
+        results = await asyncio.gather(_read(leader), _read(follower))
+
+        assert (leader_shared, follower_shared) == (False, True)
+        assert results == [["a", "b", "c"], ["a", "b", "c"]]
+        assert len(opened) == 1
+        await asyncio.sleep(0)
+        assert completed == [["a", "b", "c"]]
+        assert stream.closed
+        assert coalescer.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+
+def test_async_stream_stops_when_the_last_subscriber_leaves():
+    async def main():
+        coalescer = AsyncStreamCoalescer()
+        stream = FakeAsyncStream(["a", "b", "c"])
+        completed = []
+
+        async def open_stream():
+            return stream
+
+        lines, _ = await coalescer.subscribe("key", open_stream, completed.append)
+        stream.release(1)
+        assert await lines.__anext__() == "a"
+        await lines.aclose()
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+        assert stream.closed
+        assert completed == []
+        assert coalescer.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+
+def test_async_stream_is_closed_when_the_leader_leaves_before_the_first_line():
+    async def main():
+        coalescer = AsyncStreamCoalescer()
+        stream = FakeAsyncStream(["a"])
+
+        async def open_stream():
+            return stream
+
+        lines, _ = await coalescer.subscribe("key", open_stream)
+        await lines.aclose()
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+        assert stream.closed
+        assert coalescer.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+
+def test_async_open_error_reaches_waiting_subscribers():
+    async def main():
+        coalescer = AsyncStreamCoalescer()
+        gate = asyncio.Event()
+
+        async def fail():
+            await gate.wait()
+            raise ConnectionError("refused")
+
+        leader = asyncio.ensure_future(coalescer.subscribe("key", fail))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(coalescer.subscribe("key", fail))
+        await asyncio.sleep(0)
+        gate.set()
+        results = await asyncio.gather(leader, follower, return_exceptions=True)
+
+        assert all(isinstance(result, ConnectionError) for result in results)
+        assert coalescer.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+
+def test_follower_opens_the_stream_when_the_leader_is_cancelled():
+    async def main():
+        coalescer = AsyncStreamCoalescer()
+        stream = FakeAsyncStream(["a"])
+        gate = asyncio.Event()
+        opened = []
+
+        async def open_stream():
+            opened.append(1)
+            if len(opened) == 1:
+                await gate.wait()
+            return stream
+
+        leader = asyncio.ensure_future(coalescer.subscribe("key", open_stream))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(coalescer.subscribe("key", open_stream))
+        await asyncio.sleep(0)
+        leader.cancel()
+        lines, shared = await follower
+
+        stream.release()
+        assert not shared
+        assert await _read(lines) == ["a"]
+        assert len(opened) == 2
+
+    asyncio.run(main())
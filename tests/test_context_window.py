@@ -0,0 +1,132 @@
+import time
+
+from cache import LRUCache
+from context_window import SUMMARY_PREFIX, ContextWindow, estimate_tokens
+
+SYSTEM = {"role": "system", "content": "You are a helpful assistant."}
+
+
+def _turns(count, size=40):
+    """Alternating user/assistant turns of about size / 4 tokens each"""
+    roles = ("user", "assistant")
+    return [{"role": roles[index % 2], "content": f"{index:03d}" + "x" * (size - 3)} for index in range(count)]
+
+
+def _wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError("condition never became true")
+
+
+def test_estimate_tokens():
+    assert estimate_tokens({"role": "user", "content": ""}) == 4
+    assert estimate_tokens({"role": "user", "content": "abcd"}) == 5
+    assert estimate_tokens({"role": "user", "content": "abcde"}) == 6
+    assert estimate_tokens({"role": "user"}) == 4
+
+
+def test_messages_within_budget_pass_unchanged():
+    window = ContextWindow(default_budget=1000)
+    messages = [SYSTEM] + _turns(4)
+    fitted, info = window.fit("mistral:7b", messages)
+    assert fitted is messages
+    assert info["messages_trimmed"] == 0
+    assert info["tokens_sent"] == info["tokens_in"]
+
+
+def test_trims_oldest_turns_and_keeps_system_prompt_and_last_message():
+    window = ContextWindow(default_budget=100)
+    messages = [SYSTEM] + _turns(20)
+    fitted, info = window.fit("mistral:7b", messages)
+
+    assert fitted[0] == SYSTEM
+    assert fitted[-1] == messages[-1]
+    # The newest turns are kept, in order, with nothing skipped in between
+    kept = fitted[1:]
+    assert kept == messages[len(messages) - len(kept):]
+    assert sum(estimate_tokens(message) for message in fitted) <= 100
+    assert info["messages_trimmed"] == len(messages) - len(fitted)
+    assert info["tokens_sent"] + info["tokens_trimmed"] == info["tokens_in"]
+    assert info["summary"] is None
+
+
+def test_last_message_is_sent_even_when_it_alone_exceeds_the_budget():
+    window = ContextWindow(default_budget=10)
+    messages = [SYSTEM] + _turns(3, size=400)
+    fitted, _ = window.fit("mistral:7b", messages)
+    assert fitted == [SYSTEM, messages[-1]]
+
+
+def test_budgets_are_per_model_and_match_untagged_names():
+    window = ContextWindow(budgets={"llama3.2": 60}, default_budget=10000)
+    messages = _turns(20)
+    assert window.budget("llama3.2:latest") == 60
+    assert window.fit("llama3.2:latest", messages)[1]["messages_trimmed"] > 0
+    assert window.fit("mistral:7b", messages)[1]["messages_trimmed"] == 0
+
+
+def test_disabled_window_passes_everything():
+    window = ContextWindow(default_budget=10, enabled=False)
+    messages = _turns(20)
+    assert window.fit("mistral:7b", messages)[0] is messages
+
+
+def test_trimmed_turns_are_summarized_in_the_background():
+    calls = []
+
+    def summarize(model, previous, messages):
+        calls.append((previous, [message["content"][:3] for message in messages]))
+        return f"summary of {len(messages)} turns" + (f" after {previous}" if previous else "")
+
+    window = ContextWindow(default_budget=150, summarize=summarize, summary_cache=LRUCache(), summary_tokens=30)
+    messages = [SYSTEM] + _turns(20)
+
+    # Nothing is cached yet: the request is trimmed without waiting for the summary
+    fitted, info = window.fit("mistral:7b", messages)
+    assert info["summary"] is None
+    _wait_for(lambda: window.stats()["summaries_pending"] == 0)
+    assert window.stats()["summaries_built"] == 1
+
+    fitted, info = window.fit("mistral:7b", messages)
+    assert info["summary"] == "current"
+    assert fitted[0] == SYSTEM
+    assert fitted[1]["role"] == "system" and fitted[1]["content"].startswith(SUMMARY_PREFIX)
+    assert fitted[-1] == messages[-1]
+    assert len(calls) == 1
+
+    # Two more turns: the cached summary is used while it is extended
+    longer = messages + _turns(22)[20:]
+    fitted, info = window.fit("mistral:7b", longer)
+    assert info["summary"] == "stale"
+    _wait_for(lambda: window.stats()["summaries_pending"] == 0)
+    assert window.stats()["summaries_built"] == 2
+    previous, extended = calls[-1]
+    assert previous is not None
+    assert len(extended) == 2
+
+    assert window.fit("mistral:7b", longer)[1]["summary"] == "current"
+
+
+def test_summary_of_another_conversation_is_not_reused():
+    window = ContextWindow(default_budget=150, summarize=lambda model, previous, messages: "summary",
+                           summary_cache=LRUCache(), summary_tokens=30)
+    first = [SYSTEM] + _turns(20)
+    window.fit("mistral:7b", first)
+    _wait_for(lambda: window.stats()["summaries_pending"] == 0)
+
+    # Same opening message, different history after it
+    other = [SYSTEM] + [first[1]] + [{"role": "user", "content": "different " * 5}] + _turns(20)[2:]
+    assert window.fit("mistral:7b", other)[1]["summary"] is None
+
+
+def test_failed_summary_is_counted_and_the_request_is_still_trimmed():
+    def fail(model, previous, messages):
+        raise ConnectionError("ollama down")
+
+    window = ContextWindow(default_budget=150, summarize=fail, summary_cache=LRUCache(), summary_tokens=30)
+    fitted, info = window.fit("mistral:7b", [SYSTEM] + _turns(20))
+    assert info["messages_trimmed"] > 0
+    _wait_for(lambda: window.stats()["summaries_pending"] == 0)
+    assert window.stats()["summary_errors"] == 1
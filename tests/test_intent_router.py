@@ -0,0 +1,36 @@
+import pytest
+
+from intent_router import CHAT, LIGHT_CONTROL, LIGHT_STATUS, classify, classify_messages
+
+
+@pytest.mark.parametrize("message, kind", [
+    ("Turn off the kitchen lights", LIGHT_CONTROL),
+    ("salonun ışıklarını aç", LIGHT_CONTROL),
+    ("mutfağın ışığını kapat", LIGHT_CONTROL),
+    ("tüm ışıkları kapat", LIGHT_CONTROL),
+    ("bütün ışıkları aç", LIGHT_CONTROL),
+    ("turn off all lights", LIGHT_CONTROL),
+    ("switch on every light", LIGHT_CONTROL),
+    ("is the kitchen light on?", LIGHT_STATUS),
+    ("hangi odaların ışıkları açık", LIGHT_STATUS),
+    ("are all the lights off", LIGHT_STATUS),
+    ("Tell me a story about the sea", CHAT),
+    ("can you call me a taxi and turn on some music", CHAT),
+    ("what is the capital of France", CHAT),
+])
+def test_classify(message, kind):
+    assert classify(message).kind == kind
+
+
+def test_english_lights_command_is_marked_english():
+    assert classify("turn off all lights").is_english
+    assert not classify("tüm ışıkları kapat").is_english
+
+
+def test_only_a_trailing_user_message_is_classified():
+    assert classify_messages([]).kind == CHAT
+    assert classify_messages([{"role": "user", "content": "tüm ışıkları kapat"}]).kind == LIGHT_CONTROL
+    assert classify_messages([
+        {"role": "user", "content": "tüm ışıkları kapat"},
+        {"role": "assistant", "content": "Done"}
+    ]).kind == CHAT
@@ -0,0 +1,112 @@
+import threading
+import time
+
+from light_state import LightStateMirror
+
+
+class GatedFetch:
+    """Lights API stand-in whose answers can be held back"""
+
+    def __init__(self, states):
+        self.states = states
+        self.calls = 0
+        self.gates = []
+
+    def hold(self):
+        gate = threading.Event()
+        self.gates.append(gate)
+        return gate
+
+    def __call__(self):
+        self.calls += 1
+        snapshot = dict(self.states)
+        if self.gates:
+            self.gates.pop(0).wait(5)
+        return {"success": True, "states": snapshot}
+
+
+def test_get_serves_the_mirror_until_it_is_too_old():
+    fetch = GatedFetch({"kitchen": True})
+    mirror = LightStateMirror(fetch, max_age=60)
+    assert mirror.get()["source"] == "api"
+    assert mirror.get()["source"] == "mirror"
+    assert mirror.get(max_age=0)["source"] == "api"
+    assert fetch.calls == 2
+
+
+def test_write_through_keeps_the_value_shape():
+    mirror = LightStateMirror(lambda: {"success": True, "states": {"kitchen": {"lights": True, "brightness": 80}}})
+    mirror.refresh()
+    mirror.update("kitchen", False)
+    mirror.update("bedroom", True)
+    states = mirror.get()["states"]
+    assert states["kitchen"] == {"lights": False, "brightness": 80}
+    assert states["bedroom"] == {"lights": True}
+
+
+def test_refresh_started_before_a_write_does_not_undo_it():
+    fetch = GatedFetch({"kitchen": True})
+    mirror = LightStateMirror(fetch)
+    mirror.refresh()
+
+    gate = fetch.hold()
+    refresher = threading.Thread(target=mirror.refresh)
+    refresher.start()
+    time.sleep(0.05)
+    # The kitchen is switched off while the snapshot is in flight
+    mirror.update("kitchen", False)
+    gate.set()
+    refresher.join(5)
+
+    assert mirror.get()["states"]["kitchen"] is False
+
+
+def test_write_before_the_first_sync_is_applied_to_it():
+    fetch = GatedFetch({"kitchen": True})
+    mirror = LightStateMirror(fetch)
+    gate = fetch.hold()
+    refresher = threading.Thread(target=mirror.refresh)
+    refresher.start()
+    time.sleep(0.05)
+    mirror.update("kitchen", False)
+    gate.set()
+    refresher.join(5)
+
+    assert mirror.get()["states"]["kitchen"] is False
+
+
+def test_older_refresh_finishing_last_is_dropped():
+    fetch = GatedFetch({"kitchen": True})
+    mirror = LightStateMirror(fetch)
+    slow_gate = fetch.hold()
+    slow = threading.Thread(target=mirror.refresh)
+    slow.start()
+    time.sleep(0.05)
+
+    # Changed by another client, seen by a later refresh that returns first
+    fetch.states = {"kitchen": False}
+    mirror.refresh()
+    slow_gate.set()
+    slow.join(5)
+
+    assert mirror.get()["states"]["kitchen"] is False
+
+
+def test_concurrent_first_calls_start_one_refresher(monkeypatch):
+    mirror = LightStateMirror(lambda: {"success": True, "states": {}}, refresh_interval=3600)
+    started = []
+    original = threading.Thread.start
+
+    def counting_start(thread):
+        if getattr(thread, "_target", None) == mirror._refresh_loop:
+            started.append(thread)
+        original(thread)
+
+    monkeypatch.setattr(threading.Thread, "start", counting_start)
+    threads = [threading.Thread(target=mirror.get) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(started) == 1
@@ -0,0 +1,75 @@
+import pytest
+
+from config import LIGHTS_FAST_PATH_MIN_CONFIDENCE
+from lights_parser import parse_lights_actions, parse_lights_command
+
+ALL_ROOMS = ['living_room', 'sitting_room', 'kitchen', 'bedroom', 'bathroom', 'toilet']
+
+
+@pytest.mark.parametrize("text, actions", [
+    ("Turn on the living room lights", [('living_room', True)]),
+    ("turn off the kitchen lights", [('kitchen', False)]),
+    ("Switch the bedroom lamp off", [('bedroom', False)]),
+    ("Salonun ışıklarını aç", [('living_room', True)]),
+    ("Mutfaktaki ışıkları kapat", [('kitchen', False)]),
+    ("Yatak odasındaki lambayı söndür", [('bedroom', False)]),
+    ("mutfağın ışığını kapat", [('kitchen', False)]),
+    ("yatağın lambasını yak", [('bedroom', True)]),
+    ("wc'nin ışığını aç", [('toilet', True)]),
+    ("turn off the kitchen, bedroom and toilet lights", [('kitchen', False), ('bedroom', False), ('toilet', False)]),
+])
+def test_confident_commands_take_the_fast_path(text, actions):
+    parsed = parse_lights_actions(text)
+    assert parsed.actions == actions
+    assert parsed.confidence >= LIGHTS_FAST_PATH_MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("text", [
+    "Don't turn off the kitchen lights",
+    "Don’t turn off the kitchen lights",
+    "do not turn on the bedroom light",
+    "never switch off the bathroom lights",
+    "the kitchen lights shouldn't be turned off",
+    "Mutfağın ışıklarını kapatma",
+    "salonun ışıklarını açmayın",
+    "mutfak ışığını kapatmak değil, açmak istiyorum",
+])
+def test_negated_commands_are_left_to_the_llm(text):
+    parsed = parse_lights_actions(text)
+    assert "negated command" in parsed.reasons
+    assert parsed.confidence < LIGHTS_FAST_PATH_MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("text, actions", [
+    ("mutfağı aç, banyoyu kapat", [('kitchen', True), ('bathroom', False)]),
+    ("mutfağı kapat", [('kitchen', False)]),
+    ("yatağı aç", [('bedroom', True)]),
+    ("banyoyu aç ve tuvaleti kapat", [('bathroom', True), ('toilet', False)]),
+    ("turn on the kitchen lights and switch off the bedroom lights", [('kitchen', True), ('bedroom', False)]),
+])
+def test_turkish_suffixes_and_mixed_actions(text, actions):
+    assert parse_lights_actions(text).actions == actions
+
+
+@pytest.mark.parametrize("text, turn_on", [
+    ("tüm ışıkları kapat", False),
+    ("bütün ışıkları aç", True),
+    ("turn off all lights", False),
+    ("switch on every light", True),
+])
+def test_all_rooms(text, turn_on):
+    parsed = parse_lights_actions(text, all_rooms=ALL_ROOMS)
+    assert parsed.actions == [(room, turn_on) for room in ALL_ROOMS]
+    assert parsed.confidence >= LIGHTS_FAST_PATH_MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("text, reason", [
+    ("turn on the lights", "no room mentioned"),
+    ("kitchen lights", "no on/off verb"),
+    ("is the kitchen light on?", "phrased as a question"),
+    ("turn on the kitchen and turn off the kitchen", "conflicting on/off verbs"),
+])
+def test_ambiguous_commands_are_penalised(text, reason):
+    parsed = parse_lights_command(text)
+    assert reason in parsed.reasons
+    assert parsed.confidence < LIGHTS_FAST_PATH_MIN_CONFIDENCE
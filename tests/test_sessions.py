@@ -0,0 +1,154 @@
+import json
+import os
+
+import pytest
+
+import sessions
+from sessions import InvalidSessionId, SessionNotFound, SessionStore
+
+SYSTEM = {"role": "system", "content": "You are a helpful assistant."}
+
+
+def _message(index, role="user"):
+    return {"role": role, "content": f"message {index}"}
+
+
+def test_replace_append_and_history():
+    store = SessionStore()
+    assert store.replace("session-1", [SYSTEM, _message(0)]) == [SYSTEM, _message(0)]
+    assert store.append("session-1", _message(1, "assistant")) == [SYSTEM, _message(0), _message(1, "assistant")]
+    assert store.history("session-1")[-1] == _message(1, "assistant")
+
+    # Replacing restarts the history and the generate context
+    store.set_context("session-1", [1, 2, 3])
+    store.replace("session-1", [_message(9)])
+    assert store.history("session-1") == [_message(9)]
+    assert store.context("session-1") is None
+
+
+def test_history_is_a_copy():
+    store = SessionStore()
+    store.replace("session-1", [_message(0)])
+    store.history("session-1").append(_message(1))
+    assert store.history("session-1") == [_message(0)]
+
+
+def test_unknown_session_is_not_found_unless_created():
+    store = SessionStore()
+    with pytest.raises(SessionNotFound) as excinfo:
+        store.append("missing-1", _message(0))
+    assert excinfo.value.status_code == 404
+    with pytest.raises(SessionNotFound):
+        store.history("missing-1")
+    assert store.append("missing-1", _message(0), create=True) == [_message(0)]
+
+
+@pytest.mark.parametrize("session_id", ["short", "x" * 65, "has space1", "../../etc/passwd", None, 12345678])
+def test_malformed_session_ids_are_rejected(session_id):
+    store = SessionStore()
+    with pytest.raises(InvalidSessionId) as excinfo:
+        store.replace(session_id, [_message(0)])
+    assert excinfo.value.status_code == 400
+
+
+def test_history_is_capped_and_keeps_the_system_prompt():
+    store = SessionStore(max_messages=4)
+    store.replace("session-1", [SYSTEM])
+    for index in range(10):
+        history = store.append("session-1", _message(index))
+    assert history == [SYSTEM, _message(7), _message(8), _message(9)]
+
+
+def test_least_recently_used_session_is_dropped_without_spill_dir():
+    store = SessionStore(max_sessions=2)
+    store.replace("session-1", [_message(1)])
+    store.replace("session-2", [_message(2)])
+    store.history("session-1")
+    store.replace("session-3", [_message(3)])
+
+    assert store.history("session-1") == [_message(1)]
+    with pytest.raises(SessionNotFound):
+        store.history("session-2")
+    assert store.stats()["evicted"] == 1
+
+
+def test_evicted_sessions_are_spilled_and_restored(tmp_path):
+    store = SessionStore(max_sessions=1, spill_dir=str(tmp_path))
+    store.replace("session-1", [_message(1)])
+    store.set_context("session-1", [4, 5, 6])
+    store.replace("session-2", [_message(2)])
+
+    spilled = tmp_path / "session-1.json"
+    assert json.loads(spilled.read_text(encoding="utf-8"))["messages"] == [_message(1)]
+
+    assert store.history("session-1") == [_message(1)]
+    assert store.context("session-1") == [4, 5, 6]
+    # Restoring session-1 evicted session-2 in turn
+    assert not spilled.exists()
+    assert (tmp_path / "session-2.json").exists()
+    stats = store.stats()
+    assert stats["spilled"] == 2
+    assert stats["restored"] == 1
+
+
+def test_idle_sessions_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sessions.time, "time", lambda: now[0])
+    store = SessionStore(ttl=60)
+    store.replace("session-1", [_message(0)])
+
+    now[0] += 59
+    assert store.history("session-1") == [_message(0)]
+    store.append("session-1", _message(1))
+    now[0] += 59
+    assert len(store.history("session-1")) == 2
+    now[0] += 61
+    with pytest.raises(SessionNotFound):
+        store.history("session-1")
+    assert store.stats()["expired"] == 1
+
+
+def test_expired_spilled_session_is_not_restored(monkeypatch, tmp_path):
+    now = [1000.0]
+    monkeypatch.setattr(sessions.time, "time", lambda: now[0])
+    store = SessionStore(max_sessions=1, ttl=60, spill_dir=str(tmp_path))
+    store.replace("session-1", [_message(1)])
+    store.replace("session-2", [_message(2)])
+
+    now[0] += 61
+    with pytest.raises(SessionNotFound):
+        store.history("session-1")
+
+
+def test_record_reply_stores_the_reply_and_context():
+    store = SessionStore()
+    store.replace("session-1", [_message(0)])
+    store.record_reply("session-1", [
+        json.dumps({"message": {"role": "assistant", "content": "Hel"}, "done": False}),
+        "not json",
+        json.dumps({"message": {"role": "assistant", "content": "lo"}, "done": False}),
+        json.dumps({"done": True, "context": [7, 8, 9]})
+    ])
+    assert store.history("session-1") == [_message(0), {"role": "assistant", "content": "Hello"}]
+    assert store.context("session-1") == [7, 8, 9]
+
+
+def test_record_reply_ignores_an_unfinished_context():
+    store = SessionStore()
+    store.replace("session-1", [_message(0)])
+    store.record_reply("session-1", [json.dumps({"response": "partial", "done": False, "context": [1]})])
+    assert store.history("session-1") == [_message(0)]
+    assert store.context("session-1") is None
+
+
+def test_delete_removes_memory_and_spill_file(tmp_path):
+    store = SessionStore(max_sessions=1, spill_dir=str(tmp_path))
+    store.replace("session-1", [_message(1)])
+    store.replace("session-2", [_message(2)])
+
+    assert store.delete("session-1")
+    assert not os.path.exists(tmp_path / "session-1.json")
+    assert store.delete("session-2")
+    assert not store.delete("session-2")
+    with pytest.raises(SessionNotFound):
+        store.history("session-2")
@@ -0,0 +1,108 @@
+"""
+Bounded, streamed file upload handling
+
+Uploaded files are spooled to disk above a threshold instead of being held in
+memory, and forwarded to upstream services as a multipart body that is read
+from the spooled file block by block. The size limit is enforced while the
+request body is parsed, so an oversized upload is refused without being read.
+"""
+
+import hashlib
+import io
+import tempfile
+import uuid
+
+from flask import Request
+
+READ_SIZE = 64 * 1024
+
+
+class UploadRequest(Request):
+    """
+    Flask request with a per-request size limit and a spool threshold
+
+    Set upload_limit before the form is accessed to bound this request's
+    body; uploaded files larger than spool_threshold bytes go to a temporary
+    file on disk.
+    """
+
+    spool_threshold = 512 * 1024
+    upload_limit = None
+
+    @property
+    def max_content_length(self):
+        if self.upload_limit is not None:
+            return self.upload_limit
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=self.spool_threshold, mode="rb+")
+
+
+def file_size(fileobj):
+    """Size in bytes of a seekable file object, leaving it at the start"""
+    fileobj.seek(0, io.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+
+def file_sha256(fileobj):
+    """Hex SHA-256 of a seekable file object, read in blocks, leaving it at the start"""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(READ_SIZE), b""):
+        digest.update(block)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+class MultipartFileBody:
+    """
+    multipart/form-data body with one file part, read lazily from a file
+
+    requests sends a body with read() and __len__ with a Content-Length
+    header, block by block, so the file is never loaded into memory whole.
+
+    Usage:
+        body = MultipartFileBody('image', filename, content_type, fileobj)
+        session.post(url, data=body, headers={'Content-Type': body.content_type})
+    """
+
+    def __init__(self, field, filename, content_type, fileobj):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        # Same escaping as urllib3 for header parameters
+        filename = (filename or field).replace('"', '%22').replace('\r', '').replace('\n', '')
+        head = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type or 'application/octet-stream'}\r\n\r\n"
+        ).encode("utf-8")
+        tail = f"\r\n--{boundary}--\r\n".encode("ascii")
+
+        self._length = len(head) + file_size(fileobj) + len(tail)
+        self._parts = [io.BytesIO(head), fileobj, io.BytesIO(tail)]
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b"".join(part.read() for part in self._parts)
+        chunks = []
+        while size > 0 and self._parts:
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def __iter__(self):
+        while True:
+            block = self.read(READ_SIZE)
+            if not block:
+                return
+            yield block
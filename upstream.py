@@ -0,0 +1,154 @@
+"""
+Pooled HTTP sessions for the upstream services (Ollama, regression, image, lights)
+
+Every route used to call the module-level requests functions, which open a new
+TCP connection per call. The sessions below keep a warm keep-alive pool per
+upstream host, so handlers that chain several calls (e.g. Ollama extraction
+followed by a lights command) reuse sockets instead of reconnecting.
+"""
+
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import (
+    OLLAMA_API_HOST, REGRESSION_API_HOST, IMAGE_API_HOST, LIGHTS_API_HOST,
+    UPSTREAM_POOLS, OLLAMA_ADMISSION_ENABLED, OLLAMA_MODEL_CONCURRENCY, OLLAMA_QUEUE_MAX_DEPTH
+)
+from admission import AdmissionController
+from metrics import UPSTREAM_ERRORS, UPSTREAM_REQUEST_SECONDS
+from resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, apply_deadline
+
+
+class UpstreamSession(requests.Session):
+    """
+    requests.Session bound to a single upstream host
+
+    Applies the configured default timeout to every call that does not pass
+    its own, caps it to the current deadline budget (resilience.deadline),
+    and mounts an HTTPAdapter sized for the upstream's pool. Calls go through
+    the upstream's circuit breaker unless they pass circuit=False. Call
+    latency and errors are recorded in metrics.py.
+    """
+
+    def __init__(self, name, host, pool_size=10, retries=0, backoff_factor=0, timeout=None,
+                 failure_threshold=0, reset_timeout=30):
+        super().__init__()
+        self.name = name
+        self.host = host
+        self.default_timeout = timeout
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+
+        # Only retry connection setup failures; read errors and status codes
+        # are passed back to the caller so non-idempotent POSTs are not repeated
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=backoff_factor,
+            allowed_methods=None,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+            pool_block=False
+        )
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, circuit=True, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self._send(method, url, circuit, **kwargs)
+        except requests.exceptions.RequestException as e:
+            UPSTREAM_ERRORS.inc(upstream=self.name, kind=_error_kind(e))
+            raise
+        UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - start, upstream=self.name, method=method.upper())
+        if response.status_code >= 500:
+            UPSTREAM_ERRORS.inc(upstream=self.name, kind='http_5xx')
+        return response
+
+    def _send(self, method, url, circuit, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.default_timeout
+        kwargs["timeout"], capped = apply_deadline(kwargs["timeout"], self.name)
+
+        if not circuit:
+            return super().request(method, url, **kwargs)
+
+        self.breaker.before_call()
+        try:
+            response = super().request(method, url, **kwargs)
+        except requests.exceptions.Timeout as e:
+            if capped:
+                # The request's budget ran out, not the upstream's own timeout
+                self.breaker.record_success()
+                raise DeadlineExceeded(
+                    f"Request deadline exceeded while waiting for {self.name} service",
+                    upstream=self.name
+                ) from e
+            self.breaker.record_failure()
+            raise
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+
+def _error_kind(error):
+    """Label for upstream_errors_total"""
+    if isinstance(error, CircuitOpenError):
+        return 'circuit_open'
+    if isinstance(error, DeadlineExceeded):
+        return 'deadline'
+    if isinstance(error, requests.exceptions.Timeout):
+        return 'timeout'
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return 'connection'
+    return 'error'
+
+
+def _build_session(name, host):
+    settings = UPSTREAM_POOLS.get(name, {})
+    return UpstreamSession(
+        name,
+        host,
+        pool_size=settings.get('pool_size', 10),
+        retries=settings.get('retries', 0),
+        backoff_factor=settings.get('backoff_factor', 0),
+        timeout=settings.get('timeout'),
+        failure_threshold=settings.get('failure_threshold', 0),
+        reset_timeout=settings.get('reset_timeout', 30)
+    )
+
+
+# One shared session per upstream host, used by both service.py and client.py
+ollama_http = _build_session('ollama', OLLAMA_API_HOST)
+regression_http = _build_session('regression', REGRESSION_API_HOST)
+image_http = _build_session('image', IMAGE_API_HOST)
+lights_http = _build_session('lights', LIGHTS_API_HOST)
+
+# Every Ollama generation (chat or generate) takes a slot here first
+ollama_admission = AdmissionController(
+    'ollama',
+    concurrency=OLLAMA_MODEL_CONCURRENCY,
+    max_queue=OLLAMA_QUEUE_MAX_DEPTH,
+    enabled=OLLAMA_ADMISSION_ENABLED
+)
+
+SESSIONS = {
+    'ollama': ollama_http,
+    'regression': regression_http,
+    'image': image_http,
+    'lights': lights_http
+}